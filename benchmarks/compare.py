@@ -0,0 +1,80 @@
+"""Compare two benchmark result files.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Prints the change of every latency percentile per database size and mode,
+and exits with status 1 if any end-to-end p95 regressed by more than the
+threshold (percent).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any
+
+METRICS = ("recorder_fetch_ms", "formatting_ms", "llm_ms", "end_to_end_ms")
+
+
+def _index(path: Path) -> dict[tuple[int, str], dict[str, Any]]:
+    report = json.loads(path.read_text())
+    return {(result["states"], result["mode"]): result for result in report["results"]}
+
+
+def _change(old: float | None, new: float | None) -> float | None:
+    if old is None or new is None or old == 0:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(baseline: Path, candidate: Path, threshold: float) -> bool:
+    """Print the comparison; return whether the candidate is within threshold."""
+    old_results = _index(baseline)
+    new_results = _index(candidate)
+    ok = True
+    for key in sorted(old_results.keys() & new_results.keys()):
+        old, new = old_results[key], new_results[key]
+        print(f"states={key[0]} mode={key[1]}")
+        for metric in METRICS:
+            for percentile in ("p50", "p95", "p99"):
+                change = _change(old[metric][percentile], new[metric][percentile])
+                if change is None:
+                    continue
+                print(
+                    f"  {metric:<18} {percentile}: "
+                    f"{old[metric][percentile]:9.1f} -> "
+                    f"{new[metric][percentile]:9.1f} ({change:+.1f}%)"
+                )
+        print(
+            f"  prompt_tokens mean: {old['prompt_tokens']['mean']:.0f} -> "
+            f"{new['prompt_tokens']['mean']:.0f}; peak RSS: "
+            f"{old['peak_rss_mb']:.0f} -> {new['peak_rss_mb']:.0f} MiB"
+        )
+        change = _change(old["end_to_end_ms"]["p95"], new["end_to_end_ms"]["p95"])
+        if change is not None and change > threshold:
+            print(f"  REGRESSION: end-to-end p95 {change:+.1f}%")
+            ok = False
+    for key in sorted(old_results.keys() ^ new_results.keys()):
+        print(f"states={key[0]} mode={key[1]}: only in one file, skipped")
+    return ok
+
+
+def main() -> None:
+    """Run the comparison from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Allowed end-to-end p95 regression in percent",
+    )
+    args = parser.parse_args()
+    sys.exit(0 if compare(args.baseline, args.candidate, args.threshold) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Options, fixtures and the JSON report of the benchmark suite."""
+
+from __future__ import annotations
+
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+from homeassistant.const import __version__ as HA_VERSION
+
+from .fake_llm import FakeLLMServer
+from .synthetic import DatabaseSpec, cached_database, parse_mix
+
+RESULTS = pytest.StashKey[list[dict[str, Any]]]()
+MANIFEST = Path(__file__).parent.parent / "custom_components/rag_search/manifest.json"
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    """Register the benchmark options."""
+    group = parser.getgroup("rag_search benchmarks")
+    group.addoption(
+        "--bench-states",
+        default="1e4",
+        help="Comma-separated database sizes in states, e.g. 1e4,1e5,1e6,1e7",
+    )
+    group.addoption("--bench-entities", type=int, default=20)
+    group.addoption(
+        "--bench-mix",
+        default="sensor=0.6,binary_sensor=0.3,light=0.1",
+        help="Entity kinds and their share of the entities",
+    )
+    group.addoption("--bench-days", type=float, default=30, help="History span")
+    group.addoption("--bench-queries", type=int, default=20)
+    group.addoption(
+        "--bench-modes", default="recent", help="search_history modes to run"
+    )
+    group.addoption("--bench-latency", type=float, default=50, help="LLM ms")
+    group.addoption("--bench-jitter", type=float, default=0, help="LLM ms")
+    group.addoption("--bench-error-rate", type=float, default=0.0)
+    group.addoption(
+        "--bench-warm",
+        action="store_true",
+        help="Keep the segment cache between queries instead of reading cold",
+    )
+    group.addoption("--bench-seed", type=int, default=0)
+    group.addoption(
+        "--bench-db-dir",
+        default=str(Path(tempfile.gettempdir()) / "rag_search_bench"),
+        help="Where generated databases are cached",
+    )
+    group.addoption("--bench-output", default="benchmark-results.json")
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    """Start collecting results."""
+    config.stash[RESULTS] = []
+
+
+def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
+    """Run every benchmark once per database size and mode."""
+    config = metafunc.config
+    if "bench_states" in metafunc.fixturenames:
+        sizes = [
+            int(float(size)) for size in config.getoption("bench_states").split(",")
+        ]
+        metafunc.parametrize("bench_states", sizes, ids=[f"{s:.0e}" for s in sizes])
+    if "bench_mode" in metafunc.fixturenames:
+        modes = config.getoption("bench_modes").split(",")
+        metafunc.parametrize("bench_mode", modes)
+
+
+@pytest.fixture
+def bench_spec(pytestconfig: pytest.Config, bench_states: int) -> DatabaseSpec:
+    """Return the database to benchmark against."""
+    return DatabaseSpec(
+        states=bench_states,
+        entities=pytestconfig.getoption("bench_entities"),
+        mix=parse_mix(pytestconfig.getoption("bench_mix")),
+        days=pytestconfig.getoption("bench_days"),
+        seed=pytestconfig.getoption("bench_seed"),
+    )
+
+
+@pytest.fixture
+def bench_database(pytestconfig: pytest.Config, bench_spec: DatabaseSpec) -> Path:
+    """Generate (or reuse) the recorder database for the spec."""
+    return cached_database(bench_spec, Path(pytestconfig.getoption("bench_db_dir")))
+
+
+@pytest.fixture
+def recorder_db_url(bench_database: Path) -> str:
+    """Point the recorder at the generated database."""
+    return f"sqlite:///{bench_database}"
+
+
+@pytest.fixture(autouse=True)
+def auto_enable_custom_integrations(recorder_db_url, enable_custom_integrations):
+    """Prepare the recorder database before the hass fixture is created."""
+    return
+
+
+@pytest.fixture
+async def fake_llm(pytestconfig: pytest.Config, socket_enabled):
+    """Run the fake chat completions server."""
+    server = FakeLLMServer(
+        latency=pytestconfig.getoption("bench_latency") / 1000,
+        jitter=pytestconfig.getoption("bench_jitter") / 1000,
+        error_rate=pytestconfig.getoption("bench_error_rate"),
+        seed=pytestconfig.getoption("bench_seed"),
+    )
+    await server.start()
+    yield server
+    await server.stop()
+
+
+@pytest.fixture
+def bench_report(pytestconfig: pytest.Config) -> list[dict[str, Any]]:
+    """Return the list benchmark results are appended to."""
+    return pytestconfig.stash[RESULTS]
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=MANIFEST.parent,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    """Write the collected results as JSON."""
+    config = session.config
+    if not (results := config.stash.get(RESULTS, [])):
+        return
+    report = {
+        "integration_version": json.loads(MANIFEST.read_text())["version"],
+        "git_revision": _git_revision(),
+        "homeassistant_version": HA_VERSION,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "options": {
+            name: config.getoption(name)
+            for name in (
+                "bench_entities",
+                "bench_mix",
+                "bench_days",
+                "bench_queries",
+                "bench_latency",
+                "bench_jitter",
+                "bench_error_rate",
+                "bench_warm",
+                "bench_seed",
+            )
+        },
+        "results": results,
+    }
+    output = Path(config.getoption("bench_output"))
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    terminal = config.pluginmanager.get_plugin("terminalreporter")
+    if terminal is not None:
+        terminal.write_line(f"Benchmark results written to {output}")
@@ -0,0 +1,96 @@
+"""A local fake of the chat completions API with injectable latency and errors."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+ANSWER = "This is a benchmark answer."
+
+
+@dataclass
+class FakeRequest:
+    """One chat completion the fake server received."""
+
+    prompt: str
+    status: int
+
+
+@dataclass
+class FakeLLMServer:
+    """Serve ``/v1/chat/completions`` and ``/v1/models`` on localhost.
+
+    Every completion waits ``latency`` seconds (plus up to ``jitter``) and
+    fails with ``error_rate`` probability, as a 429 with ``Retry-After`` or a
+    503, half each. Streaming requests are answered as server-sent events.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+    requests: list[FakeRequest] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        """Prepare the application."""
+        self._random = random.Random(self.seed)
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    async def start(self) -> str:
+        """Start listening on a free port and return the base URL."""
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._completions)
+        app.router.add_get("/v1/models", self._models)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        return self.base_url
+
+    async def stop(self) -> None:
+        """Stop the server."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _models(self, request: web.Request) -> web.Response:
+        return web.json_response({"data": [{"id": "bench"}]})
+
+    async def _completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        prompt = payload["messages"][-1]["content"]
+        await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        if self._random.random() < self.error_rate:
+            status = 429 if self._random.random() < 0.5 else 503
+            self.requests.append(FakeRequest(prompt, status))
+            headers = {"Retry-After": "0.1"} if status == 429 else {}
+            return web.json_response(
+                {"error": {"message": "injected"}}, status=status, headers=headers
+            )
+        self.requests.append(FakeRequest(prompt, 200))
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(ANSWER) // 4,
+        }
+        if not payload.get("stream"):
+            return web.json_response(
+                {
+                    "choices": [{"message": {"role": "assistant", "content": ANSWER}}],
+                    "usage": usage,
+                }
+            )
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in ANSWER.split(" "):
+            chunk = {"choices": [{"delta": {"content": f"{word} "}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
@@ -0,0 +1,182 @@
+"""Generate synthetic recorder databases for the benchmarks."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import time
+from collections.abc import Iterator, Mapping
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from homeassistant.components.recorder.db_schema import (
+    SCHEMA_VERSION,
+    Base,
+    States,
+)
+from sqlalchemy import create_engine
+
+# Entity kinds and how each produces states.
+KINDS = ("sensor", "binary_sensor", "light")
+
+_BATCH = 100_000
+
+
+@dataclass(frozen=True)
+class DatabaseSpec:
+    """What to generate: how many states, entities and of which kinds."""
+
+    states: int
+    entities: int
+    mix: Mapping[str, float]
+    days: float
+    seed: int = 0
+
+    def entity_ids(self) -> list[str]:
+        """Return the generated entity ids, kinds split by ``mix``."""
+        total = sum(self.mix.values())
+        counts = {
+            kind: round(self.entities * weight / total)
+            for kind, weight in self.mix.items()
+        }
+        # Rounding may lose or add an entity; the first kind absorbs it.
+        first = next(iter(counts))
+        counts[first] += self.entities - sum(counts.values())
+        return [
+            f"{kind}.bench_{index:04}"
+            for kind, count in counts.items()
+            for index in range(count)
+        ]
+
+    def digest(self) -> str:
+        """Return a short key identifying the generated content."""
+        material = json.dumps(
+            [
+                self.states,
+                self.entities,
+                sorted(self.mix.items()),
+                self.days,
+                self.seed,
+                SCHEMA_VERSION,
+            ]
+        )
+        return hashlib.sha256(material.encode()).hexdigest()[:12]
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parse ``sensor=0.6,binary_sensor=0.3,light=0.1``."""
+    mix: dict[str, float] = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f"unknown entity kind {kind!r}; use one of {KINDS}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def _values(kind: str, count: int, rng: np.random.Generator) -> list[str]:
+    """Return ``count`` chronological state values for an entity kind."""
+    if kind == "sensor":
+        walk = 20 + np.cumsum(rng.normal(0, 0.1, count))
+        values = [f"{value:.1f}" for value in walk]
+    else:
+        on = np.arange(count) % 2 == 1
+        values = ["on" if state else "off" for state in on]
+    # A sprinkle of unavailable readings, as real devices produce.
+    for index in rng.choice(count, size=count // 500, replace=False):
+        values[index] = "unavailable"
+    return values
+
+
+def _rows(
+    spec: DatabaseSpec, end_ts: float, rng: np.random.Generator
+) -> Iterator[tuple[str, float, int]]:
+    """Yield ``(state, last_updated_ts, metadata_id)`` for every state."""
+    entity_ids = spec.entity_ids()
+    per_entity = np.full(len(entity_ids), spec.states // len(entity_ids))
+    per_entity[: spec.states % len(entity_ids)] += 1
+    start_ts = end_ts - spec.days * 86400
+    for metadata_id, (entity_id, count) in enumerate(
+        zip(entity_ids, per_entity), start=1
+    ):
+        times = np.sort(rng.uniform(start_ts, end_ts, int(count)))
+        values = _values(entity_id.split(".")[0], int(count), rng)
+        yield from zip(values, times.tolist(), [metadata_id] * int(count))
+
+
+def generate(spec: DatabaseSpec, path: Path, end_ts: float | None = None) -> Path:
+    """Write a recorder SQLite database for ``spec`` to ``path``.
+
+    The schema is the recorder's own, at its current version, so Home
+    Assistant opens the file without migrating. States end one minute
+    before ``end_ts`` (now by default) and spread uniformly over
+    ``spec.days`` days.
+    """
+    end_ts = (end_ts or time.time()) - 60
+    path.unlink(missing_ok=True)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = np.random.default_rng(spec.seed)
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        # Indexes are rebuilt once at the end; that is far faster than
+        # maintaining them row by row.
+        for index in States.__table__.indexes:
+            connection.execute(f"DROP INDEX {index.name}")
+        connection.execute(
+            "INSERT INTO schema_changes (schema_version, changed) "
+            "VALUES (?, datetime('now'))",
+            (SCHEMA_VERSION,),
+        )
+        connection.executemany(
+            "INSERT INTO states_meta (metadata_id, entity_id) VALUES (?, ?)",
+            enumerate(spec.entity_ids(), start=1),
+        )
+        batch: list[tuple[str, float, int]] = []
+        for row in _rows(spec, end_ts, rng):
+            batch.append(row)
+            if len(batch) >= _BATCH:
+                _insert(connection, batch)
+                batch.clear()
+        _insert(connection, batch)
+        connection.commit()
+    finally:
+        connection.close()
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as sa_connection:
+        for index in States.__table__.indexes:
+            index.create(sa_connection)
+    engine.dispose()
+    return path
+
+
+def _insert(connection: sqlite3.Connection, rows: list[tuple[str, float, int]]) -> None:
+    connection.executemany(
+        "INSERT INTO states (state, last_updated_ts, metadata_id, origin_idx) "
+        "VALUES (?, ?, ?, 0)",
+        rows,
+    )
+
+
+def cached_database(spec: DatabaseSpec, directory: Path) -> Path:
+    """Return a database for ``spec`` in ``directory``, generating it once.
+
+    Databases are named by the spec's digest and the day they were made, as
+    the states are placed relative to the time of generation.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    day = time.strftime("%Y%m%d")
+    path = directory / f"recorder-{spec.states}-{spec.digest()}-{day}.db"
+    if not path.exists():
+        partial = path.with_suffix(".partial")
+        generate(spec, partial)
+        partial.rename(path)
+    return path
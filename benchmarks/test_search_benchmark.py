@@ -0,0 +1,180 @@
+"""End-to-end benchmark of search_history against a synthetic recorder."""
+
+from __future__ import annotations
+
+import random
+import resource
+import sys
+import time
+from datetime import timedelta
+from typing import Any
+from unittest.mock import patch
+
+import numpy as np
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.rag_search import search
+from custom_components.rag_search.const import (
+    CONF_BASE_URL,
+    CONF_CACHE_TTL,
+    CONF_ENTITY_SCOPE,
+    CONF_OPENAI_API_KEY,
+    CONF_OPENAI_MODEL,
+    DOMAIN,
+    SERVICE_SEARCH_HISTORY,
+)
+from custom_components.rag_search.prompt import estimate_tokens
+from custom_components.rag_search.segments import SegmentCache
+
+from .fake_llm import FakeLLMServer
+from .synthetic import DatabaseSpec
+
+WINDOWS = (timedelta(hours=1), timedelta(days=1), timedelta(days=7))
+QUERIES = (
+    "When was it warmest?",
+    "How often did the lights turn on?",
+    "Was anything unavailable?",
+)
+
+
+def _percentiles(samples: list[float]) -> dict[str, float | None]:
+    """Return p50/p95/p99 of ``samples`` in milliseconds."""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def _peak_rss_mb() -> float:
+    """Return the process' peak resident set size in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class _Timer:
+    """Wrap a coroutine function, summing the time spent in it."""
+
+    def __init__(self, func) -> None:
+        self._func = func
+        self.total = 0.0
+
+    async def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._func(*args, **kwargs)
+        finally:
+            self.total += time.perf_counter() - started
+
+
+def _request(rng: random.Random, spec: DatabaseSpec, mode: str, now) -> dict[str, Any]:
+    """Return a random service call within the generated history."""
+    window = rng.choice(WINDOWS)
+    span = timedelta(days=spec.days) - window
+    end = now - timedelta(seconds=rng.uniform(0, span.total_seconds()))
+    entity_ids = rng.sample(spec.entity_ids(), k=min(3, spec.entities))
+    return {
+        "entity_id": entity_ids,
+        "start_time": (end - window).isoformat(),
+        "end_time": end.isoformat(),
+        "query": rng.choice(QUERIES),
+        "mode": mode,
+    }
+
+
+async def test_search_history(
+    recorder_mock,
+    hass: HomeAssistant,
+    pytestconfig,
+    bench_spec: DatabaseSpec,
+    bench_mode: str,
+    fake_llm: FakeLLMServer,
+    bench_report: list[dict[str, Any]],
+) -> None:
+    """Time queries end to end and split the time into its stages."""
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={
+            CONF_OPENAI_API_KEY: "bench",
+            CONF_OPENAI_MODEL: "gpt-4o-mini",
+            CONF_ENTITY_SCOPE: bench_spec.entity_ids(),
+        },
+        options={CONF_BASE_URL: fake_llm.base_url, CONF_CACHE_TTL: 0},
+    )
+    entry.add_to_hass(hass)
+    setup_started = time.perf_counter()
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    setup_time = time.perf_counter() - setup_started
+
+    rng = random.Random(pytestconfig.getoption("bench_seed"))
+    now = dt_util.utcnow()
+    warm = pytestconfig.getoption("bench_warm")
+
+    async def _query(data: dict[str, Any]) -> dict[str, Any]:
+        return await hass.services.async_call(
+            DOMAIN, SERVICE_SEARCH_HISTORY, data, blocking=True, return_response=True
+        )
+
+    # Lazy imports and connection set-up are not measured.
+    await _query(_request(rng, bench_spec, bench_mode, now))
+
+    fetch = _Timer(search._async_get_history)
+    llm = _Timer(search._call_openai)
+    fetch_times: list[float] = []
+    llm_times: list[float] = []
+    format_times: list[float] = []
+    e2e_times: list[float] = []
+    prompt_bytes: list[int] = []
+    prompt_tokens: list[int] = []
+    errors = 0
+    with patch.object(search, "_async_get_history", fetch), patch.object(
+        search, "_call_openai", llm
+    ):
+        for _ in range(pytestconfig.getoption("bench_queries")):
+            if not warm:
+                hass.data[DOMAIN]["segments"] = SegmentCache()
+            fetch.total = llm.total = 0.0
+            seen = len(fake_llm.requests)
+            started = time.perf_counter()
+            response = await _query(_request(rng, bench_spec, bench_mode, now))
+            elapsed = time.perf_counter() - started
+
+            errors += response["answer"] is None
+            e2e_times.append(elapsed)
+            fetch_times.append(fetch.total)
+            llm_times.append(llm.total)
+            format_times.append(max(elapsed - fetch.total - llm.total, 0.0))
+            for sent in fake_llm.requests[seen:]:
+                prompt_bytes.append(len(sent.prompt.encode()))
+                prompt_tokens.append(estimate_tokens(sent.prompt))
+
+    injected = sum(sent.status != 200 for sent in fake_llm.requests)
+    bench_report.append(
+        {
+            "states": bench_spec.states,
+            "entities": bench_spec.entities,
+            "mode": bench_mode,
+            "queries": len(e2e_times),
+            "setup_s": setup_time,
+            "recorder_fetch_ms": _percentiles(fetch_times),
+            "formatting_ms": _percentiles(format_times),
+            "llm_ms": _percentiles(llm_times),
+            "end_to_end_ms": _percentiles(e2e_times),
+            "prompt_bytes": {
+                "mean": float(np.mean(prompt_bytes)) if prompt_bytes else 0.0,
+                "max": max(prompt_bytes, default=0),
+            },
+            "prompt_tokens": {
+                "mean": float(np.mean(prompt_tokens)) if prompt_tokens else 0.0,
+                "max": max(prompt_tokens, default=0),
+            },
+            "llm_requests": len(fake_llm.requests),
+            "injected_errors": injected,
+            "failed_queries": errors,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+    )
+    assert e2e_times
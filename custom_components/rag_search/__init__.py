@@ -1,28 +1,77 @@
 """The RAG Search integration."""
 
 import logging
+from datetime import datetime
 
 import voluptuous as vol
 from homeassistant.config_entries import SOURCE_IMPORT, ConfigEntry
-from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.const import Platform
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+    callback,
+)
 from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_track_time_change
 
+from .backend import OpenAIBackend, async_create_dedicated_session
+from .buffer import HistoryBuffer
+from .cache import AnswerCache, SemanticCache, SingleFlight
 from .const import (
+    CONF_BASE_URL,
+    CONF_CACHE_PERSIST,
+    CONF_CACHE_TTL,
+    CONF_COMPRESS,
+    CONF_DEDICATED_CONNECTOR,
     CONF_ENTITY_SCOPE,
+    CONF_FACTS,
     CONF_MAX_ITEMS,
+    CONF_MAX_TOKENS,
     CONF_OPENAI_API_KEY,
     CONF_OPENAI_MODEL,
+    CONF_PROMPT_TOKENS,
+    CONF_SCHEDULED_QUERIES,
+    CONF_SEMANTIC_THRESHOLD,
+    CONF_STREAM,
+    DEFAULT_BASE_URL,
+    DEFAULT_CACHE_PERSIST,
+    DEFAULT_CACHE_TTL,
+    DEFAULT_COMPRESS,
+    DEFAULT_DEDICATED_CONNECTOR,
+    DEFAULT_FACTS,
     DEFAULT_MAX_ITEMS,
+    DEFAULT_MAX_TOKENS,
     DEFAULT_MODEL,
+    DEFAULT_PROMPT_TOKENS,
+    DEFAULT_SEMANTIC_THRESHOLD,
+    DEFAULT_STREAM,
+    DIGEST_BUILD_HOUR,
+    DIGEST_BUILD_MINUTE,
     DOMAIN,
-    RESULT_ENTITY,
     SERVICE_SEARCH_HISTORY,
+    SERVICE_SEARCH_HISTORY_BATCH,
+    SUMMARY_CACHE_MAX_ENTRIES,
+    SUMMARY_CACHE_STORAGE_KEY,
+    SUMMARY_CACHE_TTL,
 )
-from .search import search_history
+from .digests import DigestStore
+from .metrics import QueryMetrics
+from .retrieval import HashingEmbedder
+from .routing import EntityIndex
+from .scheduled import ScheduledQueries
+from .scheduler import RequestScheduler
+from .scope import ScopePolicy
+from .search import search_history, search_history_batch
+from .segments import SegmentCache
+from .sessions import SessionStore
 
 _LOGGER = logging.getLogger(__name__)
 
+PLATFORMS = [Platform.SENSOR]
+
 # YAML schema kept for backwards compatibility. New installs should use the UI
 # config flow; any YAML present is imported into a config entry on startup.
 CONFIG_SCHEMA = vol.Schema(
@@ -31,8 +80,8 @@ CONFIG_SCHEMA = vol.Schema(
             {
                 vol.Required(CONF_OPENAI_API_KEY): cv.string,
                 vol.Optional(CONF_OPENAI_MODEL, default=DEFAULT_MODEL): cv.string,
-                vol.Required(CONF_ENTITY_SCOPE, default=[]): cv.ensure_list(
-                    cv.entity_id
+                vol.Required(CONF_ENTITY_SCOPE, default=[]): vol.All(
+                    cv.ensure_list, [cv.string]
                 ),
                 vol.Optional(
                     CONF_MAX_ITEMS, default=DEFAULT_MAX_ITEMS
@@ -73,38 +122,171 @@ def _resolve_config(entry: ConfigEntry) -> dict:
         CONF_OPENAI_MODEL: merged.get(CONF_OPENAI_MODEL, DEFAULT_MODEL),
         CONF_ENTITY_SCOPE: merged.get(CONF_ENTITY_SCOPE, []),
         CONF_MAX_ITEMS: merged.get(CONF_MAX_ITEMS, DEFAULT_MAX_ITEMS),
+        CONF_CACHE_TTL: merged.get(CONF_CACHE_TTL, DEFAULT_CACHE_TTL),
+        CONF_CACHE_PERSIST: merged.get(CONF_CACHE_PERSIST, DEFAULT_CACHE_PERSIST),
+        CONF_SEMANTIC_THRESHOLD: merged.get(
+            CONF_SEMANTIC_THRESHOLD, DEFAULT_SEMANTIC_THRESHOLD
+        ),
+        CONF_COMPRESS: merged.get(CONF_COMPRESS, DEFAULT_COMPRESS),
+        CONF_FACTS: merged.get(CONF_FACTS, DEFAULT_FACTS),
+        CONF_PROMPT_TOKENS: merged.get(CONF_PROMPT_TOKENS, DEFAULT_PROMPT_TOKENS),
+        CONF_MAX_TOKENS: merged.get(CONF_MAX_TOKENS, DEFAULT_MAX_TOKENS),
+        CONF_STREAM: merged.get(CONF_STREAM, DEFAULT_STREAM),
+        CONF_BASE_URL: merged.get(CONF_BASE_URL, DEFAULT_BASE_URL),
+        CONF_DEDICATED_CONNECTOR: merged.get(
+            CONF_DEDICATED_CONNECTOR, DEFAULT_DEDICATED_CONNECTOR
+        ),
+        CONF_SCHEDULED_QUERIES: merged.get(CONF_SCHEDULED_QUERIES, []),
     }
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up RAG Search from a config entry."""
     conf = _resolve_config(entry)
-    entity_scope = conf[CONF_ENTITY_SCOPE]
+    # The entities searches may read, compiled from the scope rules and
+    # following the entity, device, area and label registries.
+    scope = ScopePolicy(conf[CONF_ENTITY_SCOPE])
+    entry.async_on_unload(scope.async_start(hass))
+
+    if conf[CONF_DEDICATED_CONNECTOR]:
+        # A pool of our own: kept-alive connections, per-host limit and DNS
+        # cache tuned for the backend, connected ahead of the first query.
+        session, cancel_close = async_create_dedicated_session(hass)
+        entry.async_on_unload(session.close)
+        entry.async_on_unload(cancel_close)
+    else:
+        # Use Home Assistant's shared aiohttp client session so we do not leak
+        # sessions and it is closed by HA on shutdown.
+        session = async_get_clientsession(hass)
+    backend = OpenAIBackend(session, conf[CONF_OPENAI_API_KEY], conf[CONF_BASE_URL])
+    if conf[CONF_DEDICATED_CONNECTOR]:
+        entry.async_create_background_task(
+            hass, backend.async_warm_up(), f"{DOMAIN} connection warm-up"
+        )
+
+    # Keep recent history of the scoped entities in memory so queries over
+    # recent windows do not have to go back to the recorder database.
+    buffer = HistoryBuffer(scope.allowed)
+    entry.async_on_unload(buffer.async_start(hass))
+    entry.async_on_unload(scope.async_add_listener(buffer.async_set_entities))
+    if "recorder" in hass.config.components:
+        entry.async_create_background_task(
+            hass, buffer.async_backfill(hass), f"{DOMAIN} history backfill"
+        )
+
+    # Daily digests answer long windows; they are built off-peak from the
+    # recorder and outlive its retention.
+    digests = DigestStore(hass, scope.allowed)
+    await digests.async_load()
+    entry.async_on_unload(scope.async_add_listener(digests.async_set_entities))
+    if "recorder" in hass.config.components:
+
+        @callback
+        def _async_build_digests(_now: datetime) -> None:
+            entry.async_create_background_task(
+                hass, digests.async_update(hass), f"{DOMAIN} daily digests"
+            )
+
+        entry.async_on_unload(
+            async_track_time_change(
+                hass,
+                _async_build_digests,
+                hour=DIGEST_BUILD_HOUR,
+                minute=DIGEST_BUILD_MINUTE,
+                second=0,
+            )
+        )
+
+    # Resolves room, device and entity names to entity ids; follows the
+    # entity, device, area and label registries.
+    index = EntityIndex()
+    entry.async_on_unload(index.async_start(hass))
+
+    cache = AnswerCache(hass, conf[CONF_CACHE_TTL], conf[CONF_CACHE_PERSIST])
+    await cache.async_load()
+    # Chunk summaries of mode: map_reduce, reused across questions and windows.
+    summaries = AnswerCache(
+        hass,
+        SUMMARY_CACHE_TTL,
+        conf[CONF_CACHE_PERSIST],
+        SUMMARY_CACHE_MAX_ENTRIES,
+        SUMMARY_CACHE_STORAGE_KEY,
+    )
+    await summaries.async_load()
+
+    # Local embedder for mode: relevant and the semantic cache. Replace with
+    # any object implementing retrieval.Embedder to use a different local
+    # model.
+    embedder = HashingEmbedder()
+    scheduled = ScheduledQueries(conf[CONF_SCHEDULED_QUERIES])
 
-    # Use Home Assistant's shared aiohttp client session so we do not leak
-    # sessions and it is closed by HA on shutdown.
-    session = async_get_clientsession(hass)
     hass.data.setdefault(DOMAIN, {})
-    hass.data[DOMAIN] = {"session": session, "config": conf}
+    hass.data[DOMAIN] = {
+        "backend": backend,
+        "config": conf,
+        "buffer": buffer,
+        "cache": cache,
+        "digests": digests,
+        "summaries": summaries,
+        "segments": SegmentCache(),
+        # Paces and prioritises every OpenAI request of this entry.
+        "scheduler": RequestScheduler(),
+        # Identical search_history calls in flight share one execution.
+        "inflight": SingleFlight(),
+        "embedder": embedder,
+        # Answers reused for differently worded questions about the same
+        # history.
+        "semantic": SemanticCache(
+            embedder, conf[CONF_CACHE_TTL], conf[CONF_SEMANTIC_THRESHOLD]
+        ),
+        "index": index,
+        "scope": scope,
+        # Conversations kept for follow-up questions (field: session_id).
+        "sessions": SessionStore(),
+        # Per-stage timings and token usage of recent queries.
+        "metrics": QueryMetrics(hass),
+        # Recurring queries answered ahead of time, published as sensors.
+        "scheduled": scheduled,
+    }
 
-    async def handle_search_history(call: ServiceCall) -> None:
-        entity_id = call.data.get("entity_id")
-        if entity_id not in entity_scope:
-            _LOGGER.error("Entity %s is not in the allowed scope.", entity_id)
-            hass.states.async_set(RESULT_ENTITY, "Entity not in scope.")
-            return
-        await search_history(hass, conf, call)
+    async def handle_search_history(call: ServiceCall) -> ServiceResponse:
+        return await search_history(hass, conf, call)
 
-    hass.services.async_register(DOMAIN, SERVICE_SEARCH_HISTORY, handle_search_history)
-    _LOGGER.info("Service %s.%s registered.", DOMAIN, SERVICE_SEARCH_HISTORY)
+    async def handle_search_history_batch(call: ServiceCall) -> ServiceResponse:
+        return await search_history_batch(hass, conf, call)
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SEARCH_HISTORY,
+        handle_search_history,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SEARCH_HISTORY_BATCH,
+        handle_search_history_batch,
+        supports_response=SupportsResponse.ONLY,
+    )
+    _LOGGER.info(
+        "Services %s.%s and %s.%s registered.",
+        DOMAIN,
+        SERVICE_SEARCH_HISTORY,
+        DOMAIN,
+        SERVICE_SEARCH_HISTORY_BATCH,
+    )
 
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    entry.async_on_unload(scheduled.async_start(hass, entry, conf))
     entry.async_on_unload(entry.add_update_listener(_async_update_listener))
     return True
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
+    if not await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+        return False
     hass.services.async_remove(DOMAIN, SERVICE_SEARCH_HISTORY)
+    hass.services.async_remove(DOMAIN, SERVICE_SEARCH_HISTORY_BATCH)
     hass.data.pop(DOMAIN, None)
     return True
 
@@ -0,0 +1,272 @@
+"""Quantitative facts computed locally over entity history."""
+
+from __future__ import annotations
+
+from collections.abc import Mapping, Sequence
+from datetime import datetime
+from typing import Any
+
+import numpy as np
+from homeassistant.util import dt as dt_util
+
+from .columns import StateColumns
+from .compress import NOISE_STATES, format_duration, format_number
+
+PERCENTILES = (5, 50, 95)
+
+
+def _iso(timestamp: float) -> str:
+    return dt_util.utc_from_timestamp(timestamp).isoformat()
+
+
+def _round(value: float) -> float:
+    return round(float(value), 3)
+
+
+def _extreme(values: np.ndarray, times: np.ndarray, index: int) -> dict[str, Any]:
+    return {"value": _round(values[index]), "at": _iso(times[index])}
+
+
+def analyze_states(
+    states: Sequence,
+    start_time: datetime,
+    end_time: datetime,
+    threshold: float | None = None,
+) -> dict[str, Any]:
+    """Compute the facts of one entity's chronological states over a window.
+
+    ``states`` may start with the state in effect at ``start_time``, as the
+    recorder's ``include_start_time_state`` returns it; every state lasts
+    until the next one and the last until ``end_time``. All entities get the
+    number of changes and the gaps (spans ``unavailable``/``unknown``, or
+    without data at the start of the window). Numeric entities also get
+    min/max with their times, the mean and time-weighted mean, percentiles
+    and, with a ``threshold``, the time spent above it and how often it was
+    crossed. Other entities get how often each state was entered and the
+    time spent in it.
+    """
+    columns = (
+        states
+        if isinstance(states, StateColumns)
+        else StateColumns.from_states("", states)
+    )
+    start_ts, end_ts = start_time.timestamp(), end_time.timestamp()
+    columns = columns[columns.times < end_ts]
+    facts: dict[str, Any] = {
+        "start": _iso(start_ts),
+        "end": _iso(end_ts),
+        "states": len(columns),
+        "changes": 0,
+    }
+    if not len(columns):
+        facts["gaps"] = {"count": 1, "seconds": _round(end_ts - start_ts)}
+        return facts
+
+    times = np.maximum(columns.times, start_ts)
+    durations = np.diff(np.append(times, end_ts))
+    codes = columns.codes
+    noise = np.isin(
+        codes,
+        [
+            code
+            for value in NOISE_STATES
+            if (code := columns.vocabulary.code(value)) is not None
+        ],
+    )
+    # A run starting at the window start was entered before the window.
+    changed = np.concatenate(([True], codes[1:] != codes[:-1]))
+    entered = changed & (times > start_ts)
+    facts["changes"] = int(entered.sum())
+
+    gap_starts = noise & np.concatenate(([True], ~noise[:-1]))
+    gap_ids = np.cumsum(gap_starts)[noise]
+    gap_lengths = np.bincount(gap_ids, weights=durations[noise])[1:]
+    if times[0] > start_ts:
+        gap_lengths = np.append(gap_lengths, times[0] - start_ts)
+    if len(gap_lengths):
+        facts["gaps"] = {
+            "count": len(gap_lengths),
+            "seconds": _round(gap_lengths.sum()),
+            "longest": _round(gap_lengths.max()),
+        }
+
+    valid = ~noise
+    if not valid.any():
+        return facts
+    values = columns.values[valid]
+    valid_times = times[valid]
+    valid_durations = durations[valid]
+    last = int(np.flatnonzero(valid & changed)[-1])
+    if not np.isfinite(values).all():
+        counts = np.bincount(codes[entered & valid], minlength=len(columns.vocabulary))
+        seconds = np.bincount(
+            codes[valid], weights=valid_durations, minlength=len(counts)
+        )
+        strings = columns.vocabulary.strings
+        facts["time_in_state"] = {
+            strings[code]: _round(seconds[code])
+            for code in np.argsort(-seconds, kind="stable").tolist()
+            if seconds[code] > 0 or counts[code]
+        }
+        facts["entered"] = {
+            strings[code]: int(counts[code]) for code in np.flatnonzero(counts).tolist()
+        }
+        facts["last"] = {"state": columns.state(last), "since": _iso(times[last])}
+        return facts
+
+    total = valid_durations.sum()
+    facts.update(
+        {
+            "readings": len(values),
+            "min": _extreme(values, valid_times, int(np.argmin(values))),
+            "max": _extreme(values, valid_times, int(np.argmax(values))),
+            "mean": _round(values.mean()),
+            "time_weighted_mean": _round(
+                (values * valid_durations).sum() / total if total > 0 else values.mean()
+            ),
+            "percentiles": {
+                f"p{percent}": _round(value)
+                for percent, value in zip(
+                    PERCENTILES, np.percentile(values, PERCENTILES)
+                )
+            },
+            "last": {"value": _round(values[-1]), "since": _iso(times[last])},
+        }
+    )
+    if threshold is not None:
+        above = values > threshold
+        facts["threshold"] = {
+            "value": threshold,
+            "above_seconds": _round(valid_durations[above].sum()),
+            "crossed_above": int((~above[:-1] & above[1:]).sum()),
+            "crossed_below": int((above[:-1] & ~above[1:]).sum()),
+        }
+    return facts
+
+
+def analyze_statistics(
+    rows: Sequence[Mapping], start_time: datetime, end_time: datetime
+) -> dict[str, Any]:
+    """Compute min/max/mean facts from long-term statistics rows.
+
+    The rows cover equal periods, so the mean of their means is the
+    time-weighted mean. Percentiles and crossings need the raw readings and
+    are not available.
+    """
+    rows = [
+        row
+        for row in rows
+        if row.get("mean") is not None
+        and row.get("min") is not None
+        and row.get("max") is not None
+    ]
+    facts: dict[str, Any] = {
+        "start": _iso(start_time.timestamp()),
+        "end": _iso(end_time.timestamp()),
+        "statistics": len(rows),
+    }
+    if not rows:
+        return facts
+    starts = np.array([row["start"] for row in rows], dtype=np.float64)
+    lows = np.array([row["min"] for row in rows], dtype=np.float64)
+    highs = np.array([row["max"] for row in rows], dtype=np.float64)
+    means = np.array([row["mean"] for row in rows], dtype=np.float64)
+    facts.update(
+        {
+            "min": _extreme(lows, starts, int(np.argmin(lows))),
+            "max": _extreme(highs, starts, int(np.argmax(highs))),
+            "time_weighted_mean": _round(means.mean()),
+        }
+    )
+    return facts
+
+
+def compute_facts(
+    entity_ids: Sequence[str],
+    history_data: Mapping[str, Sequence],
+    statistics_data: Mapping[str, Sequence],
+    start_time: datetime,
+    end_time: datetime,
+    threshold: float | None = None,
+    limit: int | None = None,
+) -> dict[str, dict[str, Any]]:
+    """Return the facts of every entity, keyed by entity id.
+
+    Entities with statistics are analysed from them, the rest from their
+    states. A history cut at ``limit`` states does not reach back to
+    ``start_time``, so its facts cover only the span it does reach. CPU
+    bound, so it runs in the executor.
+    """
+    facts: dict[str, dict[str, Any]] = {}
+    for entity_id in entity_ids:
+        if rows := statistics_data.get(entity_id):
+            facts[entity_id] = analyze_statistics(rows, start_time, end_time)
+            continue
+        states = history_data.get(entity_id, [])
+        if not isinstance(states, StateColumns):
+            states = StateColumns.from_states(entity_id, states)
+        span_start = start_time
+        if limit is not None and len(states) >= limit:
+            span_start = max(start_time, states.time(0))
+        facts[entity_id] = analyze_states(states, span_start, end_time, threshold)
+    return facts
+
+
+def fact_lines(entity_id: str, facts: Mapping[str, Any]) -> list[str]:
+    """Format the facts of one entity as prompt lines."""
+    head = f"{entity_id} from {facts['start']} to {facts['end']}"
+    if "statistics" in facts:
+        if not facts["statistics"]:
+            return [f"{head}: no statistics"]
+        return [
+            (
+                f"{head} (from {facts['statistics']} statistics periods): "
+                f"min {format_number(facts['min']['value'])} in the period from "
+                f"{facts['min']['at']}, max {format_number(facts['max']['value'])} in "
+                f"the period from {facts['max']['at']}, "
+                f"mean {format_number(facts['time_weighted_mean'])}"
+            )
+        ]
+
+    if "readings" in facts:
+        low, high = facts["min"], facts["max"]
+        percentiles = facts["percentiles"]
+        text = (
+            f"{head}: {facts['readings']} readings, "
+            f"min {format_number(low['value'])} at {low['at']}, "
+            f"max {format_number(high['value'])} at {high['at']}, "
+            f"mean {format_number(facts['mean'])} "
+            f"(time-weighted {format_number(facts['time_weighted_mean'])}), "
+            f"median {format_number(percentiles['p50'])}, "
+            f"5th-95th percentile {format_number(percentiles['p5'])} to "
+            f"{format_number(percentiles['p95'])}, "
+            f"last {format_number(facts['last']['value'])}"
+        )
+        if threshold := facts.get("threshold"):
+            text += (
+                f"; above {format_number(threshold['value'])} for "
+                f"{format_duration(threshold['above_seconds'])}, crossed above "
+                f"{threshold['crossed_above']} times and below "
+                f"{threshold['crossed_below']} times"
+            )
+    elif "time_in_state" in facts:
+        entered = facts["entered"]
+        text = f"{head}: {facts['changes']} changes; " + ", ".join(
+            (
+                f"{state} {entered[state]} times for {format_duration(seconds)}"
+                if state in entered
+                # Held from the start of the window without being entered.
+                else f"{state} for {format_duration(seconds)}"
+            )
+            for state, seconds in facts["time_in_state"].items()
+        )
+        text += f"; {facts['last']['state']} since {facts['last']['since']}"
+    else:
+        text = f"{head}: no readings"
+
+    if gaps := facts.get("gaps"):
+        text += (
+            f"; without data {gaps['count']} times for "
+            f"{format_duration(gaps['seconds'])}"
+        )
+    return [text]
@@ -0,0 +1,136 @@
+"""OpenAI-compatible chat completion backends."""
+
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+import aiohttp
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, callback
+
+from .const import (
+    CONNECTOR_DNS_TTL,
+    CONNECTOR_KEEPALIVE,
+    CONNECTOR_LIMIT_PER_HOST,
+    DEFAULT_BASE_URL,
+    REQUEST_TIMEOUT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CannotConnect(Exception):
+    """Error to indicate we cannot connect to the backend."""
+
+
+class InvalidAuth(Exception):
+    """Error to indicate the API key is invalid."""
+
+
+class OpenAIBackend:
+    """An OpenAI-compatible HTTP API.
+
+    OpenAI itself by default; any server implementing ``/chat/completions``
+    and ``/models`` under ``base_url`` works the same way (llama.cpp's
+    server, vLLM, Ollama, LocalAI). Local servers usually ignore the API key.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        api_key: str | None,
+        base_url: str = DEFAULT_BASE_URL,
+    ) -> None:
+        """Initialize the backend."""
+        self.session = session
+        self._api_key = api_key
+        self.base_url = base_url.rstrip("/")
+
+    @property
+    def chat_url(self) -> str:
+        """Return the chat completions endpoint."""
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def models_url(self) -> str:
+        """Return the model list endpoint."""
+        return f"{self.base_url}/models"
+
+    @property
+    def headers(self) -> dict[str, str]:
+        """Return the request headers."""
+        headers = {"Content-Type": "application/json"}
+        if self._api_key:
+            headers["Authorization"] = f"Bearer {self._api_key}"
+        return headers
+
+    def post_chat(self, payload: dict[str, Any], timeout: aiohttp.ClientTimeout) -> Any:
+        """Start a chat completion request (an async context manager)."""
+        return self.session.post(
+            self.chat_url, json=payload, headers=self.headers, timeout=timeout
+        )
+
+    async def async_validate(self) -> None:
+        """Check that the backend is reachable and accepts the API key.
+
+        Raises ``InvalidAuth`` if the key is rejected and ``CannotConnect`` if
+        the backend cannot be reached.
+        """
+        try:
+            async with self.session.get(
+                self.models_url,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            ) as response:
+                if response.status in (401, 403):
+                    raise InvalidAuth
+                if response.status != 200:
+                    _LOGGER.error(
+                        "Unexpected status validating %s: %s",
+                        self.base_url,
+                        response.status,
+                    )
+                    raise CannotConnect
+        except (aiohttp.ClientError, TimeoutError) as err:
+            _LOGGER.error("Error connecting to %s: %s", self.base_url, err)
+            raise CannotConnect from err
+
+    async def async_warm_up(self) -> None:
+        """Open a connection ahead of the first query.
+
+        DNS resolution, TCP and TLS set-up then happen at start-up and the
+        kept-alive connection is reused by the first request. Failures are
+        only logged; the first query simply connects itself.
+        """
+        try:
+            await self.async_validate()
+        except (CannotConnect, InvalidAuth):
+            _LOGGER.debug("Could not warm up the connection to %s", self.base_url)
+        else:
+            _LOGGER.debug("Connection to %s warmed up", self.base_url)
+
+
+@callback
+def async_create_dedicated_session(
+    hass: HomeAssistant,
+) -> tuple[aiohttp.ClientSession, CALLBACK_TYPE]:
+    """Create a session with its own connection pool for the backend.
+
+    Connections are kept alive between queries, limited per host, and DNS
+    lookups are cached. Returns the session and a callback that stops the
+    automatic close at Home Assistant shutdown; the caller closes the
+    session when it is done with it.
+    """
+    connector = aiohttp.TCPConnector(
+        limit_per_host=CONNECTOR_LIMIT_PER_HOST,
+        keepalive_timeout=CONNECTOR_KEEPALIVE,
+        use_dns_cache=True,
+        ttl_dns_cache=CONNECTOR_DNS_TTL,
+    )
+    session = aiohttp.ClientSession(connector=connector)
+
+    async def _async_close(_event: Event) -> None:
+        await session.close()
+
+    return session, hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, _async_close)
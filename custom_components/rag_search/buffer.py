@@ -0,0 +1,302 @@
+"""In-memory history buffer fed by state_changed events."""
+
+from __future__ import annotations
+
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Mapping, Sequence
+from datetime import datetime
+from typing import NamedTuple
+
+from homeassistant.components.recorder import get_instance, history
+from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_state_change_event
+from homeassistant.util import dt as dt_util
+
+from .const import BUFFER_BACKFILL, BUFFER_CAPACITY
+
+_LOGGER = logging.getLogger(__name__)
+
+# Smallest intern table size at which unreferenced values are dropped.
+_MIN_COMPACT_AT = 4096
+
+
+class BufferedState(NamedTuple):
+    """A state read back from the buffer.
+
+    Has the fields the formatting helpers use, so it can stand in for a
+    recorder ``State``.
+    """
+
+    entity_id: str
+    state: str
+    last_changed: datetime
+
+
+class _EntityRing:
+    """Fixed-capacity ring of ``(timestamp, state code)`` for one entity.
+
+    Timestamps and codes live in flat ``array`` columns, so a ring costs 12
+    bytes per state instead of a Python object per state. The columns grow
+    with the states appended and only wrap once they reach the capacity.
+    """
+
+    __slots__ = ("_capacity", "_codes", "_head", "_size", "_times", "covered_from")
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._times = array("d")
+        self._codes = array("I")
+        self._head = 0
+        self._size = 0
+        # States are known from this timestamp onward; None until seeded.
+        self.covered_from: float | None = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _time_at(self, index: int) -> float:
+        return self._times[(self._head + index) % len(self._times)]
+
+    def _code_at(self, index: int) -> int:
+        return self._codes[(self._head + index) % len(self._codes)]
+
+    @property
+    def last_time(self) -> float | None:
+        return self._time_at(self._size - 1) if self._size else None
+
+    def append(self, timestamp: float, code: int) -> None:
+        """Append a newer state, evicting the oldest when full."""
+        capacity = self._capacity
+        if self._size == capacity:
+            self._head = (self._head + 1) % capacity
+            self._size -= 1
+            # The evicted state is gone, so coverage now starts at the oldest
+            # retained one.
+            self.covered_from = self._time_at(0)
+        position = (self._head + self._size) % capacity
+        if position == len(self._times):
+            # Not full yet: the head is still at 0, so grow the columns.
+            self._times.append(timestamp)
+            self._codes.append(code)
+        else:
+            self._times[position] = timestamp
+            self._codes[position] = code
+        self._size += 1
+        if self.covered_from is None:
+            self.covered_from = timestamp
+
+    def prepend(
+        self, entries: Sequence[tuple[float, int]], covered_from: float
+    ) -> None:
+        """Insert older states in front of the current contents (backfill)."""
+        oldest = self._time_at(0) if self._size else None
+        older = [e for e in entries if oldest is None or e[0] < oldest]
+        current = [(self._time_at(i), self._code_at(i)) for i in range(self._size)]
+        merged = (older + current)[-self._capacity :]
+        self._head = 0
+        self._size = len(merged)
+        self._times = array("d", (timestamp for timestamp, _code in merged))
+        self._codes = array("I", (code for _timestamp, code in merged))
+        truncated = len(merged) < len(older) + len(current)
+        self.covered_from = merged[0][0] if truncated and merged else covered_from
+
+    def codes(self) -> Iterable[int]:
+        return (self._code_at(i) for i in range(self._size))
+
+    def remap(self, mapping: Mapping[int, int]) -> None:
+        for i in range(self._size):
+            position = (self._head + i) % len(self._codes)
+            self._codes[position] = mapping[self._codes[position]]
+
+    def window(
+        self, start_ts: float, end_ts: float, limit: int | None
+    ) -> list[tuple[float, int]]:
+        """Return states in ``[start_ts, end_ts)``, plus the state at start."""
+        indexes = range(self._size)
+        first = bisect_right(indexes, start_ts, key=self._time_at)
+        last = bisect_left(indexes, end_ts, key=self._time_at)
+        if limit is not None:
+            first = max(first, last - limit)
+        entries = [(self._time_at(i), self._code_at(i)) for i in range(first, last)]
+        if first > 0 and (limit is None or len(entries) < limit):
+            # The state in effect when the window opens, like the recorder's
+            # include_start_time_state.
+            entries.insert(0, (start_ts, self._code_at(first - 1)))
+        return entries
+
+
+class HistoryBuffer:
+    """Bounded per-entity history kept in memory for the scoped entities.
+
+    Seeded from the current states, kept up to date by a ``state_changed``
+    listener and backfilled once from the recorder. Queries whose window
+    starts inside the covered range are answered without touching the
+    database. Entities that join the scope later are buffered from the
+    moment they join.
+    """
+
+    def __init__(
+        self, entity_ids: Iterable[str], capacity: int = BUFFER_CAPACITY
+    ) -> None:
+        """Initialize an empty buffer for ``entity_ids``."""
+        self._capacity = capacity
+        self._rings = {entity_id: _EntityRing(capacity) for entity_id in entity_ids}
+        self._codes: dict[str, int] = {}
+        self._values: list[str] = []
+        self._compact_at = _MIN_COMPACT_AT
+        self._hass: HomeAssistant | None = None
+        self._unsubscribe: CALLBACK_TYPE | None = None
+
+    def _intern(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def _compact(self) -> None:
+        """Drop interned values no longer referenced by any ring.
+
+        Numeric sensors intern a new value for almost every update, so without
+        this the table would keep values long after their states were evicted.
+        """
+        live = sorted({code for ring in self._rings.values() for code in ring.codes()})
+        mapping = {old: new for new, old in enumerate(live)}
+        self._values = [self._values[old] for old in live]
+        self._codes = {value: code for code, value in enumerate(self._values)}
+        for ring in self._rings.values():
+            ring.remap(mapping)
+        self._compact_at = max(2 * len(self._values), _MIN_COMPACT_AT)
+
+    def add(self, entity_id: str, state: str, when: datetime) -> None:
+        """Record a state change, ignoring out-of-order or unknown entities."""
+        ring = self._rings.get(entity_id)
+        if ring is None:
+            return
+        timestamp = when.timestamp()
+        if ring.last_time is not None and timestamp <= ring.last_time:
+            return
+        ring.append(timestamp, self._intern(state))
+        if len(self._values) > self._compact_at:
+            self._compact()
+
+    def covers(self, entity_ids: Iterable[str], start_time: datetime) -> bool:
+        """Return True if every entity is buffered from ``start_time`` onward."""
+        start_ts = start_time.timestamp()
+        for entity_id in entity_ids:
+            ring = self._rings.get(entity_id)
+            if ring is None or ring.covered_from is None:
+                return False
+            if ring.covered_from > start_ts:
+                return False
+        return True
+
+    def get_states(
+        self,
+        entity_ids: Sequence[str],
+        start_time: datetime,
+        end_time: datetime,
+        limit: int | None = None,
+    ) -> dict[str, list[BufferedState]]:
+        """Return buffered history shaped like ``get_significant_states``."""
+        start_ts = start_time.timestamp()
+        end_ts = end_time.timestamp()
+        result: dict[str, list[BufferedState]] = {}
+        for entity_id in entity_ids:
+            ring = self._rings.get(entity_id)
+            if ring is None:
+                continue
+            result[entity_id] = [
+                BufferedState(
+                    entity_id, self._values[code], dt_util.utc_from_timestamp(ts)
+                )
+                for ts, code in ring.window(start_ts, end_ts, limit)
+            ]
+        return result
+
+    @callback
+    def async_start(self, hass: HomeAssistant) -> CALLBACK_TYPE:
+        """Seed from the current states and follow state changes.
+
+        Returns a callback that stops listening.
+        """
+        self._hass = hass
+        for entity_id in self._rings:
+            if (state := hass.states.get(entity_id)) is not None:
+                self.add(entity_id, state.state, state.last_changed)
+        self._async_track()
+
+        @callback
+        def _async_stop() -> None:
+            if self._unsubscribe is not None:
+                self._unsubscribe()
+                self._unsubscribe = None
+            self._hass = None
+
+        return _async_stop
+
+    @callback
+    def async_set_entities(self, entity_ids: Iterable[str]) -> None:
+        """Buffer ``entity_ids`` from now on and drop the other entities."""
+        entity_ids = set(entity_ids)
+        if entity_ids == self._rings.keys():
+            return
+        for entity_id in self._rings.keys() - entity_ids:
+            del self._rings[entity_id]
+        for entity_id in entity_ids - self._rings.keys():
+            self._rings[entity_id] = _EntityRing(self._capacity)
+            if self._hass is not None and (state := self._hass.states.get(entity_id)):
+                self.add(entity_id, state.state, state.last_changed)
+        if self._hass is not None:
+            self._unsubscribe()
+            self._async_track()
+
+    @callback
+    def _async_track(self) -> None:
+        hass = self._hass
+
+        @callback
+        def _async_state_changed(event: Event) -> None:
+            new_state = event.data["new_state"]
+            old_state = event.data["old_state"]
+            if new_state is None:
+                return
+            if old_state is not None and old_state.state == new_state.state:
+                # Attribute-only update; not a significant change.
+                return
+            self.add(new_state.entity_id, new_state.state, new_state.last_changed)
+
+        self._unsubscribe = async_track_state_change_event(
+            hass, list(self._rings), _async_state_changed
+        )
+
+    async def async_backfill(self, hass: HomeAssistant) -> None:
+        """Load the last ``BUFFER_BACKFILL`` of history from the recorder once."""
+        if not self._rings:
+            return
+        end_time = dt_util.utcnow()
+        start_time = end_time - BUFFER_BACKFILL
+        entity_ids = list(self._rings)
+        history_data = await get_instance(hass).async_add_executor_job(
+            history.get_significant_states,
+            hass,
+            start_time,
+            end_time,
+            entity_ids,
+        )
+        # Entities that joined the scope meanwhile were not fetched.
+        for entity_id in entity_ids:
+            if (ring := self._rings.get(entity_id)) is None:
+                continue
+            entries = [
+                (state.last_changed.timestamp(), self._intern(state.state))
+                for state in history_data.get(entity_id, [])
+            ]
+            ring.prepend(entries, start_time.timestamp())
+        _LOGGER.debug(
+            "Backfilled history buffer for %d entities since %s",
+            len(entity_ids),
+            start_time,
+        )
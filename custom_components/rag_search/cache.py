@@ -0,0 +1,410 @@
+"""Answer cache for the RAG Search integration."""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from datetime import datetime
+from typing import Any, Generic, NamedTuple, TypeVar
+
+import numpy as np
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .const import (
+    CACHE_MAX_ENTRIES,
+    CACHE_SAVE_DELAY,
+    CACHE_STORAGE_KEY,
+    CACHE_STORAGE_VERSION,
+    SEMANTIC_CACHE_BITS,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_TABLES,
+    SEMANTIC_CACHE_WINDOW_SLACK,
+)
+from .retrieval import Embedder
+
+_T = TypeVar("_T")
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+# Words that do not change what a question asks. Question words and
+# negations are kept: "when" and "how long" ask different things.
+_FILLER_WORDS = frozenset(
+    {
+        "a",
+        "an",
+        "any",
+        "anyone",
+        "are",
+        "did",
+        "do",
+        "does",
+        "had",
+        "has",
+        "have",
+        "is",
+        "me",
+        "my",
+        "our",
+        "please",
+        "someone",
+        "the",
+        "was",
+        "were",
+    }
+)
+
+
+def normalize_query(query: str) -> str:
+    """Normalise a query so trivially different spellings share an entry."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def answer_key(
+    model: str,
+    entity_ids: Iterable[str],
+    start_time: datetime,
+    end_time: datetime,
+    query: str,
+    history_lines: Iterable[str],
+) -> str:
+    """Return the cache key for a query.
+
+    The digest of the formatted history is part of the key, so an answer is
+    only reused while the history it was generated from is unchanged.
+    """
+    history_digest = hashlib.sha256(
+        "\n".join(history_lines).encode("utf-8")
+    ).hexdigest()
+    material = json.dumps(
+        [
+            model,
+            sorted(entity_ids),
+            start_time.replace(microsecond=0).isoformat(),
+            end_time.replace(microsecond=0).isoformat(),
+            normalize_query(query),
+            history_digest,
+        ]
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def history_key(
+    model: str, entity_ids: Iterable[str], history_lines: Iterable[str]
+) -> str:
+    """Return the key of everything an answer depends on but the question.
+
+    Questions with the same key are asked about the same history of the same
+    entities, so their answers are interchangeable when they ask the same.
+    """
+    material = json.dumps([model, sorted(entity_ids), *history_lines])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def summary_key(model: str, instruction: str, text: str) -> str:
+    """Return the cache key for the summary of one chunk of history."""
+    material = json.dumps([model, instruction, text])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Size-bounded LRU cache of answers with a time-to-live.
+
+    Entries expire ``ttl`` seconds after they were stored. When ``persist``
+    is set the cache is saved through a ``Store`` so it survives restarts;
+    wall-clock expiry times are stored for that reason.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        ttl: float,
+        persist: bool = False,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        storage_key: str = CACHE_STORAGE_KEY,
+    ) -> None:
+        """Initialize the cache."""
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._store: Store[dict[str, Any]] | None = (
+            Store(hass, CACHE_STORAGE_VERSION, storage_key) if persist else None
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Return True if answers are cached at all."""
+        return self._ttl > 0
+
+    def __len__(self) -> int:
+        """Return the number of stored entries (including expired ones)."""
+        return len(self._entries)
+
+    def get(self, key: str) -> str | None:
+        """Return a fresh cached answer, or ``None`` on a miss."""
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: str, answer: str) -> None:
+        """Store an answer, evicting the least recently used entries."""
+        if not self.enabled:
+            return
+        self._entries[key] = (answer, time.time() + self._ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        if self._store is not None:
+            self._store.async_delay_save(self._data_to_save, CACHE_SAVE_DELAY)
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters and the current size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    async def async_load(self) -> None:
+        """Load persisted entries, dropping any that have expired."""
+        if self._store is None or not (data := await self._store.async_load()):
+            return
+        now = time.time()
+        for key, (answer, expires) in data.get("entries", {}).items():
+            if expires > now:
+                self._entries[key] = (answer, expires)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    @callback
+    def _data_to_save(self) -> dict[str, Any]:
+        now = time.time()
+        return {
+            "entries": {
+                key: list(entry)
+                for key, entry in self._entries.items()
+                if entry[1] > now
+            }
+        }
+
+
+class _SemanticEntry(NamedTuple):
+    group: str
+    start: float
+    end: float
+    numbers: frozenset[str]
+    vector: np.ndarray
+    signatures: tuple[int, ...]
+    answer: str
+    expires: float
+
+
+class SemanticCache:
+    """Answers reused for differently worded questions about the same history.
+
+    Entries are grouped by ``history_key`` and remember the window they
+    answered. A question is reduced to its content words and embedded
+    locally; random-hyperplane LSH tables (probing signatures one bit away
+    as well) find the entries with similar vectors, which are then compared
+    exactly. The closest entry of the same group, for a window whose ends
+    are within ``SEMANTIC_CACHE_WINDOW_SLACK`` of its length, asking about
+    the same numbers, is reused when its cosine similarity reaches
+    ``threshold``.
+
+    Bounded to ``max_entries`` (least recently used evicted first); entries
+    expire ``ttl`` seconds after they were stored and are not persisted.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        ttl: float,
+        threshold: float,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        tables: int = SEMANTIC_CACHE_TABLES,
+        bits: int = SEMANTIC_CACHE_BITS,
+    ) -> None:
+        """Initialize an empty cache."""
+        self._embedder = embedder
+        self._ttl = ttl
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._entries: OrderedDict[int, _SemanticEntry] = OrderedDict()
+        self._next_id = 0
+        # A fixed seed keeps the hyperplanes, and so the signatures, stable.
+        self._planes = (
+            np.random.default_rng(0)
+            .standard_normal((tables, bits, embedder.dim))
+            .astype(np.float32)
+        )
+        self._weights = 1 << np.arange(bits)
+        self._buckets: list[dict[int, set[int]]] = [{} for _ in range(tables)]
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Return True if answers are reused for similar questions at all."""
+        return self._ttl > 0 and self._threshold > 0
+
+    def __len__(self) -> int:
+        """Return the number of stored entries (including expired ones)."""
+        return len(self._entries)
+
+    def _embed(self, query: str) -> np.ndarray | None:
+        words = [
+            word
+            for word in _WORD_RE.findall(normalize_query(query))
+            if word not in _FILLER_WORDS
+        ]
+        vector = self._embedder.embed([" ".join(words)])[0]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _signatures(self, vector: np.ndarray) -> tuple[int, ...]:
+        return tuple(((self._planes @ vector > 0) @ self._weights).tolist())
+
+    def _candidates(self, signatures: tuple[int, ...]) -> set[int]:
+        candidates: set[int] = set()
+        for buckets, signature in zip(self._buckets, signatures):
+            candidates.update(buckets.get(signature, ()))
+            for bit in self._weights.tolist():
+                candidates.update(buckets.get(signature ^ bit, ()))
+        return candidates
+
+    def get(
+        self, group: str, start_time: datetime, end_time: datetime, query: str
+    ) -> tuple[str, float] | None:
+        """Return the answer of the closest similar question and its similarity."""
+        if not self.enabled:
+            return None
+        if (vector := self._embed(query)) is None:
+            self.misses += 1
+            return None
+        start, end = start_time.timestamp(), end_time.timestamp()
+        slack = SEMANTIC_CACHE_WINDOW_SLACK * max(end - start, 0)
+        numbers = frozenset(_NUMBER_RE.findall(query))
+        now = time.time()
+        best: tuple[float, int] | None = None
+        for entry_id in self._candidates(self._signatures(vector)):
+            entry = self._entries[entry_id]
+            if (
+                entry.group != group
+                or entry.expires <= now
+                or abs(entry.start - start) > slack
+                or abs(entry.end - end) > slack
+                or entry.numbers != numbers
+            ):
+                continue
+            similarity = float(entry.vector @ vector)
+            if similarity >= self._threshold and (best is None or similarity > best[0]):
+                best = (similarity, entry_id)
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(best[1])
+        return self._entries[best[1]].answer, best[0]
+
+    def set(
+        self,
+        group: str,
+        start_time: datetime,
+        end_time: datetime,
+        query: str,
+        answer: str,
+    ) -> None:
+        """Store the answer to a question, evicting the least recently used."""
+        if not self.enabled or (vector := self._embed(query)) is None:
+            return
+        signatures = self._signatures(vector)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _SemanticEntry(
+            group,
+            start_time.timestamp(),
+            end_time.timestamp(),
+            frozenset(_NUMBER_RE.findall(query)),
+            vector,
+            signatures,
+            answer,
+            time.time() + self._ttl,
+        )
+        for buckets, signature in zip(self._buckets, signatures):
+            buckets.setdefault(signature, set()).add(entry_id)
+        while len(self._entries) > self._max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for buckets, signature in zip(self._buckets, entry.signatures):
+            bucket = buckets[signature]
+            bucket.discard(entry_id)
+            if not bucket:
+                del buckets[signature]
+
+    def stats(self) -> dict[str, Any]:
+        """Return hit/miss counters, the hit rate and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "size": len(self),
+        }
+
+
+class SingleFlight(Generic[_T]):
+    """Coalesce identical concurrent requests into one execution.
+
+    The first caller for a key starts the work; callers arriving while it is
+    still running await the same result instead of repeating it. Nothing is
+    kept once the work finishes; that is what ``AnswerCache`` is for.
+    """
+
+    def __init__(self) -> None:
+        """Initialize with nothing in flight."""
+        self._inflight: dict[Hashable, asyncio.Task[_T]] = {}
+        self.shared = 0
+
+    def __len__(self) -> int:
+        """Return the number of requests in flight."""
+        return len(self._inflight)
+
+    async def run(
+        self, key: Hashable, factory: Callable[[], Awaitable[_T]]
+    ) -> tuple[_T, bool]:
+        """Return the result for ``key`` and whether it was shared.
+
+        A caller that is cancelled while waiting does not cancel the work
+        other callers are waiting on.
+        """
+        if (task := self._inflight.get(key)) is not None:
+            self.shared += 1
+            return await asyncio.shield(task), True
+
+        async def _run() -> _T:
+            return await factory()
+
+        # The dict holds the only strong reference to the task while it runs.
+        task = asyncio.get_running_loop().create_task(_run())
+        self._inflight[key] = task
+        task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task), False
+
+    def _done(self, key: Hashable, task: asyncio.Task[_T]) -> None:
+        self._inflight.pop(key, None)
+        # Every caller may have been cancelled before the work failed; the
+        # error is already logged where it happened, so mark it retrieved.
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,328 @@
+"""Columnar entity history: timestamps, interned state codes, numeric values."""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import datetime
+from typing import overload
+
+import numpy as np
+from homeassistant.components.recorder import get_instance, history
+from homeassistant.components.recorder.db_schema import States
+from homeassistant.components.recorder.util import session_scope
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from sqlalchemy import and_, func, select
+
+from .buffer import BufferedState
+
+_CODE_DTYPE = np.int32
+
+
+class StateVocabulary:
+    """Interned state strings and the number each one parses to.
+
+    Codes are only ever appended, so columns holding codes stay valid while
+    the vocabulary grows. Dropping unused strings means starting a new
+    vocabulary (see ``compact``). Loaders intern from the recorder executor
+    while the event loop reads, so additions are serialised by a lock.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty vocabulary."""
+        self.strings: list[str] = []
+        self._codes: dict[str, int] = {}
+        self._numbers: list[float] = []
+        self._array: np.ndarray | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of interned strings."""
+        return len(self.strings)
+
+    def intern(self, value: str) -> int:
+        """Return the code of ``value``, interning it if new."""
+        if (code := self._codes.get(value)) is not None:
+            return code
+        try:
+            number = float(value)
+        except ValueError:
+            number = math.nan
+        with self._lock:
+            if (code := self._codes.get(value)) is None:
+                code = len(self.strings)
+                self.strings.append(value)
+                self._numbers.append(number if math.isfinite(number) else math.nan)
+                self._array = None
+                # Published last, so a code is never seen before its string.
+                self._codes[value] = code
+        return code
+
+    def code(self, value: str) -> int | None:
+        """Return the code of ``value`` if it is interned."""
+        return self._codes.get(value)
+
+    @property
+    def numbers(self) -> np.ndarray:
+        """Return the numeric value of every code, NaN for non-numbers."""
+        with self._lock:
+            if self._array is None:
+                self._array = np.array(self._numbers, dtype=np.float64)
+            return self._array
+
+    def adopt(self, columns: StateColumns) -> StateColumns:
+        """Return ``columns`` coded in this vocabulary."""
+        if columns.vocabulary is self:
+            return columns
+        used = np.unique(columns.codes)
+        mapping = np.zeros(len(columns.vocabulary), dtype=_CODE_DTYPE)
+        mapping[used] = [
+            self.intern(columns.vocabulary.strings[code]) for code in used.tolist()
+        ]
+        return StateColumns(
+            columns.entity_id, columns.times, mapping[columns.codes], self
+        )
+
+    def compact(self, columns: Iterable[StateColumns]) -> StateVocabulary:
+        """Return a vocabulary of only the codes ``columns`` use, recoding them.
+
+        ``columns`` are updated in place; columns not passed keep this
+        vocabulary, which is left unchanged.
+        """
+        columns = list(columns)
+        used = np.unique(
+            np.concatenate([c.codes for c in columns] or [np.empty(0, _CODE_DTYPE)])
+        )
+        vocabulary = StateVocabulary()
+        for code in used.tolist():
+            vocabulary.intern(self.strings[code])
+        mapping = np.zeros(len(self.strings), dtype=_CODE_DTYPE)
+        mapping[used] = np.arange(len(used), dtype=_CODE_DTYPE)
+        for column in columns:
+            column.codes = mapping[column.codes]
+            column.vocabulary = vocabulary
+        return vocabulary
+
+
+class StateColumns(Sequence[BufferedState]):
+    """One entity's chronological history as parallel arrays.
+
+    ``times`` are POSIX timestamps of each state change and ``codes`` index
+    the shared ``vocabulary``; ``values`` gives the numeric reading of every
+    row (NaN where the state is not a number). Indexing or iterating yields
+    ``BufferedState`` rows, built only for the rows actually read; slices and
+    boolean masks return columns again without copying rows into objects.
+    """
+
+    __slots__ = ("codes", "entity_id", "times", "vocabulary")
+
+    def __init__(
+        self,
+        entity_id: str,
+        times: np.ndarray,
+        codes: np.ndarray,
+        vocabulary: StateVocabulary,
+    ) -> None:
+        """Initialize from matching ``times`` and ``codes`` arrays."""
+        self.entity_id = entity_id
+        self.times = times
+        self.codes = codes
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def empty(cls, entity_id: str, vocabulary: StateVocabulary) -> StateColumns:
+        """Return columns without rows."""
+        return cls(
+            entity_id,
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=_CODE_DTYPE),
+            vocabulary,
+        )
+
+    @classmethod
+    def from_states(
+        cls,
+        entity_id: str,
+        states: Iterable,
+        vocabulary: StateVocabulary | None = None,
+    ) -> StateColumns:
+        """Build columns from state-like objects (``state``, ``last_changed``)."""
+        if vocabulary is None:
+            vocabulary = StateVocabulary()
+        times: list[float] = []
+        codes: list[int] = []
+        for state in states:
+            times.append(state.last_changed.timestamp())
+            codes.append(vocabulary.intern(state.state))
+        return cls(
+            entity_id,
+            np.array(times, dtype=np.float64),
+            np.array(codes, dtype=_CODE_DTYPE),
+            vocabulary,
+        )
+
+    @classmethod
+    def concat(
+        cls, entity_id: str, parts: Sequence[StateColumns], vocabulary: StateVocabulary
+    ) -> StateColumns:
+        """Join columns in the given order, coded in ``vocabulary``."""
+        if not parts:
+            return cls.empty(entity_id, vocabulary)
+        parts = [vocabulary.adopt(part) for part in parts]
+        return cls(
+            entity_id,
+            np.concatenate([part.times for part in parts]),
+            np.concatenate([part.codes for part in parts]),
+            vocabulary,
+        )
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return len(self.times)
+
+    @overload
+    def __getitem__(self, index: int) -> BufferedState: ...
+
+    @overload
+    def __getitem__(self, index: slice | np.ndarray) -> StateColumns: ...
+
+    def __getitem__(self, index):
+        """Return one row, or the columns of a slice, mask or index array."""
+        if isinstance(index, (int, np.integer)):
+            return BufferedState(
+                self.entity_id,
+                self.vocabulary.strings[self.codes[index]],
+                dt_util.utc_from_timestamp(float(self.times[index])),
+            )
+        return StateColumns(
+            self.entity_id, self.times[index], self.codes[index], self.vocabulary
+        )
+
+    def __iter__(self) -> Iterator[BufferedState]:
+        """Yield the rows in order."""
+        strings = self.vocabulary.strings
+        for timestamp, code in zip(self.times.tolist(), self.codes.tolist()):
+            yield BufferedState(
+                self.entity_id, strings[code], dt_util.utc_from_timestamp(timestamp)
+            )
+
+    @property
+    def values(self) -> np.ndarray:
+        """Return the numeric value of every row, NaN for non-numbers."""
+        return self.vocabulary.numbers[self.codes]
+
+    def state(self, index: int) -> str:
+        """Return the state string of a row."""
+        return self.vocabulary.strings[self.codes[index]]
+
+    def time(self, index: int) -> datetime:
+        """Return the time of a row."""
+        return dt_util.utc_from_timestamp(float(self.times[index]))
+
+    def without(self, values: Iterable[str]) -> StateColumns:
+        """Return the rows whose state is not one of ``values``."""
+        codes = [
+            code
+            for value in values
+            if (code := self.vocabulary.code(value)) is not None
+        ]
+        if not codes:
+            return self
+        return self[~np.isin(self.codes, codes)]
+
+
+def load_columns(
+    hass: HomeAssistant,
+    start_time: datetime,
+    end_time: datetime,
+    entity_ids: Sequence[str],
+    vocabulary: StateVocabulary,
+    include_start_time_state: bool = True,
+) -> dict[str, StateColumns]:
+    """Read the state changes of a window straight into columns.
+
+    Unlike ``history.get_significant_states`` this selects only the state and
+    its timestamp: no attributes are loaded or decoded and no ``State``
+    object is built per row. Attribute-only updates are skipped, as the
+    formatting ignores attributes. With ``include_start_time_state`` the
+    state in effect at ``start_time`` opens each entity's window, stamped at
+    ``start_time``. Entities without history are left out.
+
+    Runs in the recorder executor.
+    """
+    instance = get_instance(hass)
+    if not instance.states_meta_manager.active:
+        # The states table has not been migrated to the metadata schema yet.
+        history_data = history.get_significant_states(
+            hass, start_time, end_time, list(entity_ids), None, include_start_time_state
+        )
+        return {
+            entity_id: StateColumns.from_states(entity_id, states, vocabulary)
+            for entity_id, states in history_data.items()
+            if entity_id in entity_ids
+        }
+
+    start_ts = start_time.timestamp()
+    end_ts = end_time.timestamp()
+    times: defaultdict[int, list[float]] = defaultdict(list)
+    codes: defaultdict[int, list[int]] = defaultdict(list)
+    intern = vocabulary.intern
+    with session_scope(hass=hass, read_only=True) as session:
+        metadata_ids = {
+            metadata_id: entity_id
+            for entity_id, metadata_id in instance.states_meta_manager.get_many(
+                entity_ids, session, False
+            ).items()
+            if metadata_id is not None
+        }
+        if not metadata_ids:
+            return {}
+        if include_start_time_state:
+            latest = (
+                select(
+                    States.metadata_id,
+                    func.max(States.last_updated_ts).label("last_updated_ts"),
+                )
+                .filter(States.metadata_id.in_(metadata_ids))
+                .filter(States.last_updated_ts < start_ts)
+                .group_by(States.metadata_id)
+                .subquery()
+            )
+            for metadata_id, state in session.execute(
+                select(States.metadata_id, States.state).join(
+                    latest,
+                    and_(
+                        States.metadata_id == latest.c.metadata_id,
+                        States.last_updated_ts == latest.c.last_updated_ts,
+                    ),
+                )
+            ).tuples():
+                if state and not times[metadata_id]:
+                    times[metadata_id].append(start_ts)
+                    codes[metadata_id].append(intern(state))
+        for metadata_id, state, timestamp in session.execute(
+            select(States.metadata_id, States.state, States.last_updated_ts)
+            .filter(States.metadata_id.in_(metadata_ids))
+            .filter(
+                (States.last_changed_ts == States.last_updated_ts)
+                | States.last_changed_ts.is_(None)
+            )
+            .filter(States.last_updated_ts >= start_ts)
+            .filter(States.last_updated_ts < end_ts)
+            .order_by(States.metadata_id, States.last_updated_ts)
+        ).tuples():
+            times[metadata_id].append(timestamp)
+            codes[metadata_id].append(intern(state or ""))
+
+    return {
+        metadata_ids[metadata_id]: StateColumns(
+            metadata_ids[metadata_id],
+            np.array(entity_times, dtype=np.float64),
+            np.array(codes[metadata_id], dtype=_CODE_DTYPE),
+            vocabulary,
+        )
+        for metadata_id, entity_times in times.items()
+    }
@@ -0,0 +1,189 @@
+"""History compression applied before the prompt is built."""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+from homeassistant.const import STATE_UNAVAILABLE, STATE_UNKNOWN
+from homeassistant.util import dt as dt_util
+
+from .columns import StateColumns
+from .const import FLAP_SECONDS
+
+NOISE_STATES = frozenset({STATE_UNAVAILABLE, STATE_UNKNOWN, ""})
+
+
+class Record(NamedTuple):
+    """One line of history, the time it sorts at and the entity it describes."""
+
+    when: datetime
+    entity_id: str
+    text: str
+
+
+class _Run(NamedTuple):
+    state: str
+    start: datetime
+    end: datetime
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration compactly, e.g. ``2h 5m`` or ``40s``."""
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    parts = [f"{days}d"] if days else []
+    if hours:
+        parts.append(f"{hours}h")
+    if minutes and not days:
+        parts.append(f"{minutes}m")
+    if not parts:
+        parts.append(f"{seconds}s")
+    return " ".join(parts)
+
+
+def format_number(value: float) -> str:
+    """Format a reading compactly, to at most two decimals, e.g. ``21.5``."""
+    return f"{round(value, 2):g}"
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of ``threshold`` points that preserve the visual shape
+    of the series (peaks, troughs and steps), always keeping the first and
+    last point.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1], dtype=np.intp)[:threshold]
+
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_start = end
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def _runs(columns: StateColumns, window_end: datetime) -> list[_Run]:
+    """Collapse consecutive repeats into runs lasting until the next change."""
+    codes = columns.codes
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    times = [dt_util.utc_from_timestamp(t) for t in columns.times[starts].tolist()]
+    return [
+        _Run(columns.state(index), start, end)
+        for index, start, end in zip(starts.tolist(), times, times[1:] + [window_end])
+    ]
+
+
+def _collapse_flapping(runs: list[_Run]) -> list[_Run | list[_Run]]:
+    """Group bursts of three or more runs shorter than ``FLAP_SECONDS``."""
+    grouped: list[_Run | list[_Run]] = []
+    burst: list[_Run] = []
+
+    def _flush() -> None:
+        if len(burst) > 2:
+            grouped.append(list(burst))
+        else:
+            grouped.extend(burst)
+        burst.clear()
+
+    for run in runs:
+        if (run.end - run.start).total_seconds() < FLAP_SECONDS:
+            burst.append(run)
+            continue
+        _flush()
+        grouped.append(run)
+    _flush()
+    return grouped
+
+
+def _run_record(entity_id: str, item: _Run | list[_Run]) -> Record:
+    if isinstance(item, list):
+        values = ", ".join(sorted({run.state for run in item}))
+        return Record(
+            item[0].start,
+            entity_id,
+            f"{entity_id} flapped {len(item)} times between {values} "
+            f"from {item[0].start} to {item[-1].end}",
+        )
+    duration = format_duration((item.end - item.start).total_seconds())
+    return Record(
+        item.start,
+        entity_id,
+        f"{entity_id} was {item.state} from {item.start} to {item.end} ({duration})",
+    )
+
+
+def _reading(entity_id: str, state) -> Record:
+    return Record(
+        state.last_changed,
+        entity_id,
+        f"{entity_id} was {state.state} at {state.last_changed}",
+    )
+
+
+def compress_states(
+    states: Sequence, window_end: datetime, budget: int | None = None
+) -> list[Record]:
+    """Compress one entity's chronological states into at most ``budget`` records.
+
+    ``unavailable``/``unknown`` readings are dropped. Numeric series are
+    downsampled with LTTB and summarised; other series become runs with
+    durations, with bursts of very short runs (a flapping sensor) collapsed
+    into a single line. Without a budget nothing is downsampled.
+
+    The work is done on ``StateColumns``; other sequences of states are
+    converted first. Records are only built for the rows that are kept.
+    """
+    if not isinstance(states, StateColumns):
+        if not states:
+            return []
+        states = StateColumns.from_states(states[0].entity_id, states)
+    states = states.without(NOISE_STATES)
+    if not states or budget == 0:
+        return []
+    entity_id = states.entity_id
+
+    values = states.values
+    if np.isfinite(values).all():
+        if budget is None or len(states) <= budget:
+            return [_reading(entity_id, state) for state in states]
+        # One record goes to the summary line.
+        keep = lttb(states.times, values, budget - 1)
+        summary = Record(
+            states.time(0),
+            entity_id,
+            f"{entity_id} had {len(states)} readings from {states.time(0)} "
+            f"to {states.time(-1)} (min {values.min():g}, "
+            f"max {values.max():g}, mean {values.mean():.2f}); "
+            f"{len(keep)} representative readings follow",
+        )
+        return [summary] + [_reading(entity_id, states[i]) for i in keep.tolist()]
+
+    runs = _runs(states, window_end)
+    items: list[_Run | list[_Run]] = list(runs)
+    if budget is not None and len(items) > budget:
+        items = _collapse_flapping(runs)
+        # Still too long: keep the most recent part of the window.
+        items = items[-budget:]
+    return [_run_record(entity_id, item) for item in items]
@@ -5,7 +5,6 @@ from __future__ import annotations
 import logging
 from typing import Any
 
-import aiohttp
 import voluptuous as vol
 from homeassistant.config_entries import (
     ConfigEntry,
@@ -15,47 +14,57 @@ from homeassistant.config_entries import (
 from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers import selector
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
+from .backend import CannotConnect, InvalidAuth, OpenAIBackend
 from .const import (
+    CONF_BASE_URL,
+    CONF_CACHE_PERSIST,
+    CONF_CACHE_TTL,
+    CONF_COMPRESS,
+    CONF_DEDICATED_CONNECTOR,
     CONF_ENTITY_SCOPE,
+    CONF_FACTS,
     CONF_MAX_ITEMS,
+    CONF_MAX_TOKENS,
     CONF_OPENAI_API_KEY,
     CONF_OPENAI_MODEL,
+    CONF_PROMPT_TOKENS,
+    CONF_SCHEDULED_QUERIES,
+    CONF_SEMANTIC_THRESHOLD,
+    CONF_STREAM,
+    DEFAULT_BASE_URL,
+    DEFAULT_CACHE_PERSIST,
+    DEFAULT_CACHE_TTL,
+    DEFAULT_COMPRESS,
+    DEFAULT_DEDICATED_CONNECTOR,
+    DEFAULT_FACTS,
     DEFAULT_MAX_ITEMS,
+    DEFAULT_MAX_TOKENS,
     DEFAULT_MODEL,
+    DEFAULT_PROMPT_TOKENS,
+    DEFAULT_SEMANTIC_THRESHOLD,
+    DEFAULT_STREAM,
     DOMAIN,
-    OPENAI_MODELS_URL,
-    REQUEST_TIMEOUT,
+    MIN_PROMPT_TOKENS,
 )
+from .scheduled import SCHEDULED_QUERIES_SCHEMA
 
 _LOGGER = logging.getLogger(__name__)
 
 
-async def _validate_api_key(hass, api_key: str) -> None:
-    """Validate the OpenAI API key.
+async def _validate_api_key(
+    hass, api_key: str, base_url: str = DEFAULT_BASE_URL
+) -> None:
+    """Validate the API key against the configured backend.
 
     Raises ``InvalidAuth`` if the key is rejected and ``CannotConnect`` if the
-    OpenAI API cannot be reached.
+    backend cannot be reached.
     """
-    session = async_get_clientsession(hass)
-    headers = {"Authorization": f"Bearer {api_key}"}
-    try:
-        async with session.get(
-            OPENAI_MODELS_URL,
-            headers=headers,
-            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
-        ) as response:
-            if response.status in (401, 403):
-                raise InvalidAuth
-            if response.status != 200:
-                _LOGGER.error(
-                    "Unexpected status validating OpenAI key: %s", response.status
-                )
-                raise CannotConnect
-    except aiohttp.ClientError as err:
-        _LOGGER.error("Error connecting to OpenAI: %s", err)
-        raise CannotConnect from err
+    await OpenAIBackend(
+        async_get_clientsession(hass), api_key, base_url
+    ).async_validate()
 
 
 def _user_schema(defaults: dict[str, Any] | None = None) -> vol.Schema:
@@ -71,6 +80,10 @@ def _user_schema(defaults: dict[str, Any] | None = None) -> vol.Schema:
                 CONF_OPENAI_MODEL,
                 default=defaults.get(CONF_OPENAI_MODEL, DEFAULT_MODEL),
             ): cv.string,
+            vol.Optional(
+                CONF_BASE_URL,
+                default=defaults.get(CONF_BASE_URL, DEFAULT_BASE_URL),
+            ): cv.url,
             vol.Optional(
                 CONF_ENTITY_SCOPE,
                 default=defaults.get(CONF_ENTITY_SCOPE, []),
@@ -99,7 +112,11 @@ class RagSearchConfigFlow(ConfigFlow, domain=DOMAIN):
 
         if user_input is not None:
             try:
-                await _validate_api_key(self.hass, user_input[CONF_OPENAI_API_KEY])
+                await _validate_api_key(
+                    self.hass,
+                    user_input[CONF_OPENAI_API_KEY],
+                    user_input.get(CONF_BASE_URL, DEFAULT_BASE_URL),
+                )
             except InvalidAuth:
                 errors["base"] = "invalid_auth"
             except CannotConnect:
@@ -140,16 +157,45 @@ class RagSearchOptionsFlow(OptionsFlow):
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
         """Manage the options."""
+        current = {**self._config_entry.data, **self._config_entry.options}
+        errors: dict[str, str] = {}
         if user_input is not None:
-            return self.async_create_entry(title="", data=user_input)
+            base_url = user_input.get(CONF_BASE_URL, DEFAULT_BASE_URL)
+            try:
+                user_input[CONF_SCHEDULED_QUERIES] = SCHEDULED_QUERIES_SCHEMA(
+                    user_input.get(CONF_SCHEDULED_QUERIES, [])
+                )
+                # Only a new backend needs checking; the key is unchanged.
+                if base_url != current.get(CONF_BASE_URL, DEFAULT_BASE_URL):
+                    await _validate_api_key(
+                        self.hass, current[CONF_OPENAI_API_KEY], base_url
+                    )
+            except vol.Invalid:
+                errors[CONF_SCHEDULED_QUERIES] = "invalid_scheduled_queries"
+            except InvalidAuth:
+                errors["base"] = "invalid_auth"
+            except CannotConnect:
+                errors["base"] = "cannot_connect"
+            else:
+                return self.async_create_entry(title="", data=user_input)
+            current = {**current, **user_input}
 
-        current = {**self._config_entry.data, **self._config_entry.options}
         schema = vol.Schema(
             {
                 vol.Optional(
                     CONF_OPENAI_MODEL,
                     default=current.get(CONF_OPENAI_MODEL, DEFAULT_MODEL),
                 ): cv.string,
+                vol.Optional(
+                    CONF_BASE_URL,
+                    default=current.get(CONF_BASE_URL, DEFAULT_BASE_URL),
+                ): cv.url,
+                vol.Optional(
+                    CONF_DEDICATED_CONNECTOR,
+                    default=current.get(
+                        CONF_DEDICATED_CONNECTOR, DEFAULT_DEDICATED_CONNECTOR
+                    ),
+                ): cv.boolean,
                 vol.Optional(
                     CONF_ENTITY_SCOPE,
                     default=current.get(CONF_ENTITY_SCOPE, []),
@@ -158,14 +204,45 @@ class RagSearchOptionsFlow(OptionsFlow):
                     CONF_MAX_ITEMS,
                     default=current.get(CONF_MAX_ITEMS, DEFAULT_MAX_ITEMS),
                 ): cv.positive_int,
+                vol.Optional(
+                    CONF_PROMPT_TOKENS,
+                    default=current.get(CONF_PROMPT_TOKENS, DEFAULT_PROMPT_TOKENS),
+                ): vol.All(vol.Coerce(int), vol.Range(min=MIN_PROMPT_TOKENS)),
+                vol.Optional(
+                    CONF_MAX_TOKENS,
+                    default=current.get(CONF_MAX_TOKENS, DEFAULT_MAX_TOKENS),
+                ): cv.positive_int,
+                vol.Optional(
+                    CONF_STREAM,
+                    default=current.get(CONF_STREAM, DEFAULT_STREAM),
+                ): cv.boolean,
+                vol.Optional(
+                    CONF_COMPRESS,
+                    default=current.get(CONF_COMPRESS, DEFAULT_COMPRESS),
+                ): cv.boolean,
+                vol.Optional(
+                    CONF_FACTS,
+                    default=current.get(CONF_FACTS, DEFAULT_FACTS),
+                ): cv.boolean,
+                vol.Optional(
+                    CONF_CACHE_TTL,
+                    default=current.get(CONF_CACHE_TTL, DEFAULT_CACHE_TTL),
+                ): cv.positive_int,
+                vol.Optional(
+                    CONF_CACHE_PERSIST,
+                    default=current.get(CONF_CACHE_PERSIST, DEFAULT_CACHE_PERSIST),
+                ): cv.boolean,
+                vol.Optional(
+                    CONF_SEMANTIC_THRESHOLD,
+                    default=current.get(
+                        CONF_SEMANTIC_THRESHOLD, DEFAULT_SEMANTIC_THRESHOLD
+                    ),
+                ): vol.All(vol.Coerce(float), vol.Range(min=0, max=1)),
+                # A list of queries; see SCHEDULED_QUERY_SCHEMA.
+                vol.Optional(
+                    CONF_SCHEDULED_QUERIES,
+                    default=current.get(CONF_SCHEDULED_QUERIES, []),
+                ): selector.ObjectSelector(),
             }
         )
-        return self.async_show_form(step_id="init", data_schema=schema)
-
-
-class CannotConnect(Exception):
-    """Error to indicate we cannot connect to OpenAI."""
-
-
-class InvalidAuth(Exception):
-    """Error to indicate the OpenAI API key is invalid."""
+        return self.async_show_form(step_id="init", data_schema=schema, errors=errors)
@@ -1,29 +1,240 @@
 """Constants for the RAG Search integration."""
 
+from datetime import timedelta
+
 DOMAIN = "rag_search"
 
 # Services
 SERVICE_SEARCH_HISTORY = "search_history"
+SERVICE_SEARCH_HISTORY_BATCH = "search_history_batch"
+
+# Service fields
+ATTR_MODE = "mode"
+# A room, device or entity name resolved to entity ids by the routing index.
+ATTR_NAME = "name"
+ATTR_QUERIES = "queries"
+ATTR_THRESHOLD = "threshold"
+# A conversation whose history and turns are kept for follow-up questions.
+ATTR_SESSION_ID = "session_id"
+
+# History selection modes for search_history
+MODE_RECENT = "recent"
+MODE_RELEVANT = "relevant"
+MODE_MAP_REDUCE = "map_reduce"
+# Facts computed locally, returned without calling OpenAI.
+MODE_STRUCTURED = "structured"
 
 # Configuration keys
 CONF_OPENAI_API_KEY = "openai_api_key"
 CONF_OPENAI_MODEL = "openai_model"
 CONF_ENTITY_SCOPE = "entity_scope"
 CONF_MAX_ITEMS = "max_items"
+CONF_CACHE_TTL = "cache_ttl"
+CONF_CACHE_PERSIST = "cache_persist"
+CONF_SEMANTIC_THRESHOLD = "semantic_cache_threshold"
+CONF_COMPRESS = "compress_history"
+CONF_FACTS = "precompute_facts"
+CONF_PROMPT_TOKENS = "prompt_tokens"
+CONF_MAX_TOKENS = "max_tokens"
+CONF_STREAM = "stream"
+CONF_BASE_URL = "base_url"
+CONF_DEDICATED_CONNECTOR = "dedicated_connector"
+CONF_SCHEDULED_QUERIES = "scheduled_queries"
+# Keys of a scheduled query
+CONF_AT = "at"
+CONF_INTERVAL = "interval"
+CONF_WINDOW = "window"
 
 # Defaults
 DEFAULT_MODEL = "gpt-4o-mini"
 DEFAULT_MAX_ITEMS = 50
+DEFAULT_CACHE_TTL = 300  # seconds; 0 disables the answer cache
+DEFAULT_CACHE_PERSIST = False
+# Cosine similarity above which a cached answer is reused for a differently
+# worded question over the same history; 0 disables the semantic cache.
+DEFAULT_SEMANTIC_THRESHOLD = 0.85
+DEFAULT_COMPRESS = True
+DEFAULT_FACTS = True
+DEFAULT_PROMPT_TOKENS = 2000  # history + query tokens sent per request
+# Below this a question, its prefix and a session's system prompt may not fit.
+MIN_PROMPT_TOKENS = 200
+DEFAULT_MAX_TOKENS = 150  # completion tokens requested per answer
+DEFAULT_STREAM = False
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_DEDICATED_CONNECTOR = False
+
+# Answer cache
+CACHE_MAX_ENTRIES = 256
+CACHE_STORAGE_KEY = "rag_search.answer_cache"
+CACHE_STORAGE_VERSION = 1
+CACHE_SAVE_DELAY = 30  # seconds
+
+# Semantic answer cache (answers of paraphrased questions). Entries expire
+# with the answer cache's TTL and are looked up with random-hyperplane LSH:
+# SEMANTIC_CACHE_TABLES tables of SEMANTIC_CACHE_BITS-bit signatures, probing
+# the signatures one bit away as well.
+SEMANTIC_CACHE_MAX_ENTRIES = 512
+SEMANTIC_CACHE_TABLES = 4
+SEMANTIC_CACHE_BITS = 8
+# Both ends of a cached window may differ by this share of its length.
+SEMANTIC_CACHE_WINDOW_SLACK = 0.05
+
+# In-memory history buffer for the scoped entities
+BUFFER_CAPACITY = 10_000  # states kept per entity
+BUFFER_BACKFILL = timedelta(hours=24)
+
+# Segment cache for recorder history
+SEGMENT_CACHE_MAX_STATES = 200_000
+# History newer than this may not be committed by the recorder yet, so it is
+# never treated as final by the segment cache.
+SEGMENT_SETTLE_TIME = timedelta(seconds=30)
+
+# History compression
+# With compression on, this many times num_items raw states are fetched and
+# then compressed down to num_items lines.
+COMPRESS_FETCH_FACTOR = 20
+# Runs shorter than this are treated as flapping when collapsing bursts.
+FLAP_SECONDS = 60
+
+# Long-term statistics for numeric sensors
+# Windows at least this long read sensors with state_class: measurement from
+# the statistics tables instead of raw states.
+STATISTICS_MIN_WINDOW = timedelta(days=1)
+# Up to this window length 5-minute statistics are used, beyond it hourly.
+STATISTICS_SHORT_TERM_MAX_WINDOW = timedelta(days=3)
+
+# Daily digests of the scoped entities, built off-peak (local time)
+DIGEST_BUILD_HOUR = 3
+DIGEST_BUILD_MINUTE = 17
+# Windows at least this long read finished days from the digests.
+DIGEST_MIN_WINDOW = timedelta(days=7)
+DIGEST_RETENTION_DAYS = 400
+# Notable transitions kept per non-numeric digest.
+DIGEST_MAX_TRANSITIONS = 6
+DIGEST_STORAGE_KEY = "rag_search.digests"
+DIGEST_STORAGE_VERSION = 1
+DIGEST_SAVE_DELAY = 30  # seconds
+
+# Map-reduce summarisation (mode: map_reduce)
+# The window is chunked by aligned periods of one day or more, doubled until
+# there are at most this many; chunks larger than the prompt budget are split.
+MAP_REDUCE_MAX_CHUNKS = 16
+# Chunks summarised at the same time.
+MAP_REDUCE_CONCURRENCY = 4
+# Completion tokens requested per chunk summary.
+MAP_REDUCE_SUMMARY_TOKENS = 200
+# Times summaries that still exceed the budget are combined again.
+MAP_REDUCE_MAX_LEVELS = 2
+# Chunk summaries are cached by the digest of their content.
+SUMMARY_CACHE_MAX_ENTRIES = 512
+SUMMARY_CACHE_TTL = 7 * 24 * 3600  # seconds
+SUMMARY_CACHE_STORAGE_KEY = "rag_search.summary_cache"
 
-# OpenAI API
-OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
-OPENAI_MODELS_URL = "https://api.openai.com/v1/models"
-OPENAI_MAX_TOKENS = 150
+# Scheduled queries (option scheduled_queries)
+# A daily query runs up to this long before its time; an interval query up to
+# a tenth of its interval early.
+SCHEDULED_JITTER = 600  # seconds
+# After start-up, every query is answered within this delay.
+SCHEDULED_STARTUP_DELAY = 60  # seconds
+SCHEDULED_MAX_CONCURRENCY = 2
+SCHEDULED_MIN_INTERVAL = 5  # minutes
+DEFAULT_SCHEDULED_WINDOW = 24  # hours of history before each run
+SIGNAL_SCHEDULED_UPDATED = f"{DOMAIN}_scheduled_updated"
+
+# search_history_batch: items answered at the same time
+BATCH_MAX_CONCURRENCY = 4
+
+# Entity routing index (field: name)
+# Words at least this long also match the indexed words they start.
+ROUTING_PREFIX_MIN_LENGTH = 3
+# Otherwise they match indexed words sharing this share of their trigrams.
+ROUTING_FUZZY_SIMILARITY = 0.5
+
+# Conversational sessions (field: session_id)
+SESSION_IDLE_TIMEOUT = 900  # seconds a session is kept after its last turn
+SESSION_MAX_SESSIONS = 16
+# Tokens the chat format adds around each message of a session.
+SESSION_MESSAGE_TOKENS = 4
+
+# Local retrieval index (mode: relevant)
+RETRIEVAL_CHUNK_LINES = 10
+RETRIEVAL_EMBEDDING_DIM = 1024
+
+# Prompt token budget
+# Context window per model family, matched by the longest prefix of the model
+# name. The prompt budget is clamped so prompt + completion always fit.
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16_385,
+    "gpt-4": 8_192,
+    "gpt-4-turbo": 128_000,
+    "gpt-4o": 128_000,
+    "gpt-4.1": 1_047_576,
+    "o1": 200_000,
+    "o3": 200_000,
+    "o4-mini": 200_000,
+}
+DEFAULT_CONTEXT_TOKENS = 8_192  # unknown models
+# Tokens the chat format adds around a single user message.
+PROMPT_OVERHEAD_TOKENS = 8
+
+# OpenAI API (the default base URL; any OpenAI-compatible server can be used)
+OPENAI_CHAT_URL = f"{DEFAULT_BASE_URL}/chat/completions"
+OPENAI_MODELS_URL = f"{DEFAULT_BASE_URL}/models"
+
+# Dedicated connection pool (option dedicated_connector)
+CONNECTOR_LIMIT_PER_HOST = 8
+CONNECTOR_KEEPALIVE = 60  # seconds an idle connection is kept open
+CONNECTOR_DNS_TTL = 300  # seconds a DNS lookup is cached
 
 # Networking behaviour for the raw aiohttp OpenAI calls
 REQUEST_TIMEOUT = 30
 MAX_RETRIES = 3
+# Exponential backoff with jitter: the ceiling doubles from RETRY_BACKOFF_SECONDS
+# per attempt up to RETRY_BACKOFF_MAX_SECONDS. A Retry-After header wins.
 RETRY_BACKOFF_SECONDS = 1
+RETRY_BACKOFF_MAX_SECONDS = 20
+
+# Request scheduler shared by all OpenAI calls of the config entry
+SCHEDULER_MAX_CONCURRENCY = 4
+# End-to-end bound for one answer (queueing, rate limit waits and retries).
+SCHEDULER_DEADLINE = 90  # seconds
+# Priority classes; lower is served first. Calls made by a user (UI, voice)
+# are interactive, calls from automations and scripts are background.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Streaming answers: the result entity is updated at most this often (or
+# every this many chunks), and an event is fired for every chunk.
+STREAM_PUBLISH_INTERVAL = 0.25  # seconds
+STREAM_PUBLISH_CHUNKS = 20
+EVENT_PARTIAL_RESULT = "rag_search_partial_result"
 
 # Entity that stores the last query result
 RESULT_ENTITY = "rag_search.last_query_result"
+
+# Query instrumentation. Every search_history call is timed per stage; the
+# histograms describe the most recent METRICS_WINDOW queries.
+STAGE_VALIDATION = "validation"
+STAGE_FETCH = "fetch"
+STAGE_FORMAT = "format"
+STAGE_SUMMARIZE = "summarize"  # mode: map_reduce only
+STAGE_PROMPT = "prompt"
+STAGE_LLM_FIRST_BYTE = "llm_first_byte"
+STAGE_LLM = "llm"
+STAGE_TOTAL = "total"
+STAGES = (
+    STAGE_VALIDATION,
+    STAGE_FETCH,
+    STAGE_FORMAT,
+    STAGE_SUMMARIZE,
+    STAGE_PROMPT,
+    STAGE_LLM_FIRST_BYTE,
+    STAGE_LLM,
+    STAGE_TOTAL,
+)
+METRICS_WINDOW = 500
+# Histogram bucket upper bounds; the last bucket is unbounded.
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+RETRY_BUCKETS = (0, 1, 2)
+SIGNAL_METRICS_UPDATED = f"{DOMAIN}_metrics_updated"
@@ -0,0 +1,34 @@
+"""Diagnostics support for RAG Search."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_OPENAI_API_KEY, DOMAIN
+
+TO_REDACT = {CONF_OPENAI_API_KEY}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return the entry's settings, query metrics and cache statistics."""
+    data = hass.data[DOMAIN]
+    return {
+        "entry": {
+            "data": async_redact_data(dict(entry.data), TO_REDACT),
+            "options": async_redact_data(dict(entry.options), TO_REDACT),
+        },
+        "metrics": data["metrics"].summary(),
+        "answer_cache": data["cache"].stats(),
+        "semantic_cache": data["semantic"].stats(),
+        "summary_cache": data["summaries"].stats(),
+        "digests": len(data["digests"]),
+        "queries_in_flight": len(data["inflight"]),
+        "sessions": len(data["sessions"]),
+        "scheduled_queries": data["scheduled"].results,
+    }
@@ -0,0 +1,284 @@
+"""Daily per-entity digests built in the background."""
+
+from __future__ import annotations
+
+import logging
+from collections import Counter
+from collections.abc import Iterable, Sequence
+from datetime import date, datetime, timedelta
+from typing import Any
+
+from homeassistant.components.recorder import get_instance, history
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .compress import NOISE_STATES, Record, format_duration, format_number
+from .const import (
+    DIGEST_MAX_TRANSITIONS,
+    DIGEST_RETENTION_DAYS,
+    DIGEST_SAVE_DELAY,
+    DIGEST_STORAGE_KEY,
+    DIGEST_STORAGE_VERSION,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _day_bounds(day: date) -> tuple[datetime, datetime]:
+    """Return the start and end of a local day, DST transitions included."""
+    return (
+        dt_util.start_of_local_day(day),
+        dt_util.start_of_local_day(day + timedelta(days=1)),
+    )
+
+
+def _clock(when: datetime) -> str:
+    return dt_util.as_local(when).strftime("%H:%M")
+
+
+def build_digest(
+    states: Sequence, day_start: datetime, day_end: datetime
+) -> dict[str, Any]:
+    """Condense one entity's states over a day into a digest.
+
+    ``states`` are chronological and start with the state in effect at
+    ``day_start``, as the recorder's ``include_start_time_state`` returns
+    them. Numeric entities get the number of readings, min/max with their
+    times and the time-weighted mean; other entities the number of changes,
+    the time spent in each state and a few notable transitions (into the
+    states the entity spent the least time in).
+    """
+    states = [state for state in states if state.state not in NOISE_STATES]
+    if not states:
+        return {"changes": 0}
+    starts = [max(state.last_changed, day_start) for state in states]
+    durations = [
+        (end - start).total_seconds()
+        for start, end in zip(starts, starts[1:] + [day_end])
+    ]
+    changes = sum(start > day_start for start in starts)
+
+    try:
+        values = [float(state.state) for state in states]
+    except ValueError:
+        values = None
+    if values is not None:
+        low = min(range(len(values)), key=values.__getitem__)
+        high = max(range(len(values)), key=values.__getitem__)
+        total = sum(durations)
+        mean = (
+            sum(v * d for v, d in zip(values, durations)) / total
+            if total > 0
+            else sum(values) / len(values)
+        )
+        return {
+            "changes": changes,
+            "mean": mean,
+            "min": [values[low], _clock(starts[low])],
+            "max": [values[high], _clock(starts[high])],
+        }
+
+    time_in_state: Counter[str] = Counter()
+    transitions: list[tuple[datetime, str]] = []
+    previous: str | None = None
+    for state, start, duration in zip(states, starts, durations):
+        time_in_state[state.state] += duration
+        if previous is not None and state.state != previous:
+            transitions.append((start, state.state))
+        previous = state.state
+    if len(transitions) > DIGEST_MAX_TRANSITIONS:
+        rarest = sorted(
+            range(len(transitions)),
+            key=lambda i: (time_in_state[transitions[i][1]], i),
+        )[:DIGEST_MAX_TRANSITIONS]
+        transitions = [transitions[i] for i in sorted(rarest)]
+    return {
+        "changes": changes,
+        "time": dict(time_in_state.most_common()),
+        "notable": [[_clock(when), state] for when, state in transitions],
+    }
+
+
+def digest_text(entity_id: str, day: str, digest: dict[str, Any]) -> str | None:
+    """Format a digest as one history line, or ``None`` for a day without data."""
+    if "mean" in digest:
+        low, low_at = digest["min"]
+        high, high_at = digest["max"]
+        return (
+            f"{entity_id} on {day}: mean {format_number(digest['mean'])}, "
+            f"min {format_number(low)} at {low_at}, max {format_number(high)} at {high_at} "
+            f"({digest['changes']} readings)"
+        )
+    if not digest.get("time"):
+        return None
+    text = f"{entity_id} on {day}: {digest['changes']} changes; " + ", ".join(
+        f"{state} {format_duration(seconds)}"
+        for state, seconds in digest["time"].items()
+    )
+    if digest.get("notable"):
+        text += "; " + ", ".join(f"{state} at {at}" for at, state in digest["notable"])
+    return text
+
+
+def _steady_state(digest: dict[str, Any]) -> str | None:
+    """Return the state a non-numeric entity kept all day, if it never changed."""
+    if digest.get("changes") or "mean" in digest or len(digest.get("time", {})) != 1:
+        return None
+    return next(iter(digest["time"]))
+
+
+def _steady_record(
+    entity_id: str, state: str, first: str, when: datetime, last: str
+) -> Record:
+    if first == last:
+        return Record(when, entity_id, f"{entity_id} was {state} all day on {first}")
+    return Record(
+        when, entity_id, f"{entity_id} was {state} all day from {first} to {last}"
+    )
+
+
+class DigestStore:
+    """Daily digests of the scoped entities, persisted through a ``Store``.
+
+    ``async_update`` builds the digests of every finished day the recorder
+    still has and that is not digested yet, one recorder query per day; it is
+    meant to run off-peak. Digests are kept for ``DIGEST_RETENTION_DAYS``, far
+    longer than the recorder keeps states, so long windows read one line per
+    entity and day instead of every state.
+    """
+
+    def __init__(self, hass: HomeAssistant, entity_ids: Iterable[str]) -> None:
+        """Initialize the store for the given entities."""
+        self._store: Store[dict[str, Any]] = Store(
+            hass, DIGEST_STORAGE_VERSION, DIGEST_STORAGE_KEY
+        )
+        self._entity_ids = sorted(entity_ids)
+        # entity_id -> ISO local date -> digest
+        self._digests: dict[str, dict[str, dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        """Return the number of stored digests."""
+        return sum(len(days) for days in self._digests.values())
+
+    @callback
+    def async_set_entities(self, entity_ids: Iterable[str]) -> None:
+        """Digest ``entity_ids`` from the next update on."""
+        self._entity_ids = sorted(entity_ids)
+
+    def get(self, entity_id: str, day: date) -> dict[str, Any] | None:
+        """Return the digest of an entity's local day, if built."""
+        return self._digests.get(entity_id, {}).get(day.isoformat())
+
+    async def async_load(self) -> None:
+        """Load persisted digests."""
+        if data := await self._store.async_load():
+            self._digests = data.get("digests", {})
+
+    async def async_update(self, hass: HomeAssistant) -> int:
+        """Digest the finished days that are missing; return how many were read."""
+        today = dt_util.start_of_local_day().date()
+        # The oldest retained day is partially purged, so start the day after.
+        day = today - timedelta(days=get_instance(hass).keep_days - 1)
+        built = 0
+        while day < today:
+            missing = [e for e in self._entity_ids if self.get(e, day) is None]
+            if missing:
+                day_start, day_end = _day_bounds(day)
+                history_data = await get_instance(hass).async_add_executor_job(
+                    history.get_significant_states,
+                    hass,
+                    day_start,
+                    day_end,
+                    missing,
+                    None,
+                    True,
+                )
+                for entity_id in missing:
+                    self._digests.setdefault(entity_id, {})[day.isoformat()] = (
+                        build_digest(
+                            history_data.get(entity_id, []), day_start, day_end
+                        )
+                    )
+                built += 1
+            day += timedelta(days=1)
+
+        oldest = (today - timedelta(days=DIGEST_RETENTION_DAYS)).isoformat()
+        for days in self._digests.values():
+            for key in [key for key in days if key < oldest]:
+                del days[key]
+        if built:
+            _LOGGER.debug("Built digests for %d days", built)
+            self._store.async_delay_save(self._data_to_save, DIGEST_SAVE_DELAY)
+        return built
+
+    def plan(
+        self,
+        entity_ids: Sequence[str],
+        start_time: datetime,
+        end_time: datetime,
+        retained_from: datetime,
+    ) -> tuple[list[Record], datetime, datetime] | None:
+        """Cover the finished days of a window with digests.
+
+        Returns the digest records, the start of the first digested day and
+        the time from which raw history is needed again, or ``None`` if
+        digests cannot be used: a day the recorder still has is not digested
+        for every entity, or no day of the window is digested at all. Days
+        older than the recorder's retention without a digest have no history
+        anywhere and are skipped. A digest covers its whole day, so only the
+        days inside the window are used; the part of the first day after the
+        window starts is left to raw history.
+        """
+        limit = min(end_time, dt_util.start_of_local_day())
+        day = dt_util.as_local(start_time).date()
+        if _day_bounds(day)[0] < start_time:
+            day += timedelta(days=1)
+        digests_from = _day_bounds(day)[0]
+        covered: list[tuple[date, datetime]] = []
+        history_from: datetime | None = None
+        while (bounds := _day_bounds(day))[1] <= limit:
+            day_start, day_end = bounds
+            if all(self.get(entity_id, day) is not None for entity_id in entity_ids):
+                covered.append((day, day_start))
+            elif day_end > retained_from:
+                return None
+            history_from = day_end
+            day += timedelta(days=1)
+        if not covered or history_from is None:
+            return None
+        return self._records(entity_ids, covered), digests_from, history_from
+
+    def _records(
+        self, entity_ids: Sequence[str], days: Sequence[tuple[date, datetime]]
+    ) -> list[Record]:
+        """Format the digests of ``days`` as time-ordered history records.
+
+        Consecutive days on which an entity stayed in one state become a
+        single line.
+        """
+        records: list[Record] = []
+        for entity_id in entity_ids:
+            # (state, first day, its start, last day) of the current steady run
+            steady: tuple[str, str, datetime, str] | None = None
+            for day, day_start in days:
+                digest = self._digests[entity_id][day.isoformat()]
+                state = _steady_state(digest)
+                if steady is not None and steady[0] == state:
+                    steady = (*steady[:3], day.isoformat())
+                    continue
+                if steady is not None:
+                    records.append(_steady_record(entity_id, *steady))
+                    steady = None
+                if state is not None:
+                    steady = (state, day.isoformat(), day_start, day.isoformat())
+                elif text := digest_text(entity_id, day.isoformat(), digest):
+                    records.append(Record(day_start, entity_id, text))
+            if steady is not None:
+                records.append(_steady_record(entity_id, *steady))
+        records.sort(key=lambda record: record.when)
+        return records
+
+    @callback
+    def _data_to_save(self) -> dict[str, Any]:
+        return {"digests": self._digests}
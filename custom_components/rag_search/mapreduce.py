@@ -0,0 +1,148 @@
+"""Map-reduce summarisation of histories too long for a single prompt."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Sequence
+from datetime import datetime, timedelta
+
+from .cache import AnswerCache, summary_key
+from .compress import Record
+from .const import MAP_REDUCE_CONCURRENCY, MAP_REDUCE_MAX_CHUNKS, MAP_REDUCE_MAX_LEVELS
+from .prompt import estimate_tokens
+
+_LOGGER = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTION = (
+    "Summarise the Home Assistant history above for answering questions about "
+    "it later. Keep the times of notable changes, extremes, durations and "
+    "anything unusual. Be concise."
+)
+COMBINE_INSTRUCTION = (
+    "Combine the summaries of consecutive Home Assistant history periods above "
+    "into one summary. Keep the times of notable changes, extremes, durations "
+    "and anything unusual. Be concise."
+)
+
+# Completes a prompt with the model; ``None`` on failure.
+Complete = Callable[[str], Awaitable[str | None]]
+
+
+def chunk_period(start_time: datetime, end_time: datetime) -> timedelta:
+    """Return the length of the periods the window is chunked by.
+
+    One day, doubled until the window spans at most ``MAP_REDUCE_MAX_CHUNKS``
+    periods. Periods are aligned to the epoch, so overlapping windows of a
+    similar length share most of their chunks and the cached summaries.
+    """
+    period = timedelta(days=1)
+    while (end_time - start_time) / period > MAP_REDUCE_MAX_CHUNKS:
+        period *= 2
+    return period
+
+
+def chunk_records(
+    records: Sequence[Record], budget: int, period: timedelta | None = None
+) -> list[list[Record]]:
+    """Split chronological records into chunks of at most ``budget`` tokens.
+
+    A chunk never crosses a ``period`` boundary. A single record larger than
+    the budget gets a chunk of its own.
+    """
+    chunks: list[list[Record]] = []
+    current: list[Record] = []
+    used = 0
+    current_bucket: int | None = None
+    seconds = period.total_seconds() if period is not None else None
+    for record in records:
+        bucket = int(record.when.timestamp() // seconds) if seconds else None
+        # One extra token for the newline joining the lines.
+        cost = estimate_tokens(record.text) + 1
+        if current and (bucket != current_bucket or used + cost > budget):
+            chunks.append(current)
+            current = []
+            used = 0
+        current.append(record)
+        used += cost
+        current_bucket = bucket
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def async_summarize(
+    chunks: Sequence[Sequence[Record]],
+    instruction: str,
+    complete: Complete,
+    cache: AnswerCache,
+    model: str,
+) -> list[Record] | None:
+    """Summarise every chunk, at most ``MAP_REDUCE_CONCURRENCY`` at a time.
+
+    Summaries are looked up and stored by the digest of their chunk, so a
+    chunk that was summarised before (by an overlapping window, or another
+    question about the same one) costs nothing. Returns one record per chunk,
+    or ``None`` if any summary failed.
+    """
+    semaphore = asyncio.Semaphore(MAP_REDUCE_CONCURRENCY)
+
+    async def _summarize(chunk: Sequence[Record]) -> Record | None:
+        text = "\n".join(record.text for record in chunk)
+        key = summary_key(model, instruction, text)
+        if (summary := cache.get(key)) is None:
+            async with semaphore:
+                summary = await complete(f"{text}\n\n{instruction}")
+            if summary is None:
+                return None
+            cache.set(key, summary)
+        return Record(
+            chunk[0].when,
+            "",
+            f"From {chunk[0].when} to {chunk[-1].when}: {summary}",
+        )
+
+    summaries = await asyncio.gather(*(_summarize(chunk) for chunk in chunks))
+    if any(summary is None for summary in summaries):
+        return None
+    return list(summaries)
+
+
+async def async_map_reduce(
+    records: Sequence[Record],
+    start_time: datetime,
+    end_time: datetime,
+    chunk_budget: int,
+    budget: int,
+    complete: Complete,
+    cache: AnswerCache,
+    model: str,
+) -> list[str] | None:
+    """Reduce ``records`` to summaries that fit in ``budget`` tokens.
+
+    The records are chunked by period and ``chunk_budget`` and each chunk is
+    summarised (map). While the summaries together still exceed ``budget``
+    they are grouped and summarised again, up to ``MAP_REDUCE_MAX_LEVELS``
+    times. Returns the summary lines in time order, or ``None`` on failure.
+    """
+    chunks = chunk_records(records, chunk_budget, chunk_period(start_time, end_time))
+    _LOGGER.debug("Summarising %d records in %d chunks", len(records), len(chunks))
+    summaries = await async_summarize(
+        chunks, SUMMARY_INSTRUCTION, complete, cache, model
+    )
+    for _level in range(MAP_REDUCE_MAX_LEVELS):
+        if summaries is None or len(summaries) <= 1:
+            break
+        if sum(estimate_tokens(s.text) + 1 for s in summaries) <= budget:
+            break
+        groups = chunk_records(summaries, chunk_budget)
+        if len(groups) == len(summaries):
+            # No two summaries fit one prompt; combining cannot shrink them.
+            break
+        _LOGGER.debug("Combining %d summaries into %d", len(summaries), len(groups))
+        summaries = await async_summarize(
+            groups, COMBINE_INSTRUCTION, complete, cache, model
+        )
+    if summaries is None:
+        return None
+    return [summary.text for summary in summaries]
@@ -0,0 +1,180 @@
+"""Per-stage timing and token usage of search_history queries."""
+
+from __future__ import annotations
+
+import bisect
+import math
+import time
+from collections import deque
+from collections.abc import Mapping, Sequence
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+
+from .const import (
+    LATENCY_BUCKETS_MS,
+    METRICS_WINDOW,
+    RETRY_BUCKETS,
+    SIGNAL_METRICS_UPDATED,
+    STAGE_TOTAL,
+    STAGES,
+    TOKEN_BUCKETS,
+)
+
+# Token counts reported in the completion's ``usage``.
+USAGE_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+class RollingHistogram:
+    """The distribution of the last ``size`` values of one measurement.
+
+    ``bounds`` are the upper bounds of the buckets; values above the last
+    bound fall into a final, unbounded bucket. ``count`` keeps counting past
+    the window.
+    """
+
+    def __init__(self, bounds: Sequence[float], size: int = METRICS_WINDOW) -> None:
+        """Initialize an empty histogram."""
+        self._bounds = tuple(bounds)
+        self._values: deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def __len__(self) -> int:
+        """Return the number of values in the window."""
+        return len(self._values)
+
+    def add(self, value: float) -> None:
+        """Record one value."""
+        self._values.append(value)
+        self.count += 1
+
+    def percentile(self, percent: float) -> float | None:
+        """Return the nearest-rank percentile of the window, if not empty."""
+        if not self._values:
+            return None
+        ordered = sorted(self._values)
+        rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+        return ordered[rank - 1]
+
+    def buckets(self) -> dict[str, int]:
+        """Return how many values of the window fall into each bucket."""
+        counts = [0] * (len(self._bounds) + 1)
+        for value in self._values:
+            counts[bisect.bisect_left(self._bounds, value)] += 1
+        labels = [f"le_{bound:g}" for bound in self._bounds] + ["inf"]
+        return dict(zip(labels, counts))
+
+    def summary(self) -> dict[str, Any]:
+        """Return the count, mean, max, p50/p95/p99 and bucket counts."""
+        values = self._values
+        return {
+            "count": self.count,
+            "window": len(values),
+            "mean": round(sum(values) / len(values), 2) if values else None,
+            "max": max(values, default=None),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": self.buckets(),
+        }
+
+
+class QueryTrace:
+    """What one query spent its time and tokens on.
+
+    Sequential stages are timed with ``lap``: each call charges the time
+    since the previous one (or the start of the trace) to a stage. The LLM
+    stages, retries and token usage are filled in by the completion call.
+    """
+
+    def __init__(self) -> None:
+        """Start timing."""
+        self.started = self._mark = time.monotonic()
+        self.stages: dict[str, float] = {}
+        self.usage: dict[str, int] = {}
+        self.retries: int | None = None
+
+    def lap(self, stage: str | None) -> None:
+        """Charge the time since the last lap to ``stage`` (``None``: to no stage)."""
+        now = time.monotonic()
+        if stage is not None:
+            self.add(stage, (now - self._mark) * 1000)
+        self._mark = now
+
+    def add(self, stage: str, milliseconds: float) -> None:
+        """Charge ``milliseconds`` to ``stage``."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + milliseconds
+
+    def set_usage(self, usage: Mapping[str, Any] | None) -> None:
+        """Keep the token counts of a completion's ``usage``.
+
+        The prompt tokens served from the provider's prompt cache are read
+        from ``prompt_tokens_details``.
+        """
+        usage = usage or {}
+        usage = {**usage, **(usage.get("prompt_tokens_details") or {})}
+        for key in USAGE_KEYS:
+            if isinstance(value := usage.get(key), int):
+                self.usage[key] = value
+
+
+class QueryMetrics:
+    """Rolling histograms of the stages and token usage of recent queries.
+
+    Every recorded query notifies ``SIGNAL_METRICS_UPDATED`` so the
+    diagnostic sensors refresh.
+    """
+
+    def __init__(self, hass: HomeAssistant, size: int = METRICS_WINDOW) -> None:
+        """Initialize with no queries recorded."""
+        self._hass = hass
+        self.stages = {
+            stage: RollingHistogram(LATENCY_BUCKETS_MS, size) for stage in STAGES
+        }
+        self.tokens = {key: RollingHistogram(TOKEN_BUCKETS, size) for key in USAGE_KEYS}
+        self.retries = RollingHistogram(RETRY_BUCKETS, size)
+        self.queries = 0
+        self.failed = 0
+        self.cached = 0
+        self.semantic_cached = 0
+        self.shared = 0
+
+    @callback
+    def async_record(self, trace: QueryTrace, result: Mapping[str, Any]) -> None:
+        """Add a finished query and its result.
+
+        A query that joined an identical one in flight is only counted: its
+        work, timed in the trace of the query it joined, is recorded there.
+        """
+        if not result.get("shared"):
+            trace.stages[STAGE_TOTAL] = (time.monotonic() - trace.started) * 1000
+            for stage, milliseconds in trace.stages.items():
+                self.stages[stage].add(milliseconds)
+            for key, value in trace.usage.items():
+                self.tokens[key].add(value)
+            if trace.retries is not None:
+                self.retries.add(trace.retries)
+        self.queries += 1
+        self.failed += result.get("answer") is None
+        self.cached += bool(result.get("cached"))
+        self.semantic_cached += "cache_similarity" in result
+        self.shared += bool(result.get("shared"))
+        async_dispatcher_send(self._hass, SIGNAL_METRICS_UPDATED)
+
+    def summary(self) -> dict[str, Any]:
+        """Return every histogram and counter."""
+        return {
+            "queries": self.queries,
+            "failed": self.failed,
+            "cached": self.cached,
+            "semantic_cached": self.semantic_cached,
+            "shared": self.shared,
+            "stages_ms": {
+                stage: histogram.summary() for stage, histogram in self.stages.items()
+            },
+            "tokens": {
+                key: histogram.summary() for key, histogram in self.tokens.items()
+            },
+            "retries": self.retries.summary(),
+        }
@@ -0,0 +1,136 @@
+"""Plan where history comes from: raw states or long-term statistics."""
+
+from __future__ import annotations
+
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta
+from typing import Literal, NamedTuple
+
+from homeassistant.components.recorder import get_instance, statistics
+from homeassistant.components.sensor import ATTR_STATE_CLASS, SensorStateClass
+from homeassistant.core import HomeAssistant, split_entity_id
+from homeassistant.util import dt as dt_util
+
+from .compress import Record, format_number
+from .const import STATISTICS_MIN_WINDOW, STATISTICS_SHORT_TERM_MAX_WINDOW
+
+StatisticsPeriod = Literal["5minute", "hour"]
+
+
+class HistoryPlan(NamedTuple):
+    """Which entities are read from raw states and which from statistics."""
+
+    raw: list[str]
+    statistics: list[str]
+    period: StatisticsPeriod | None
+
+
+def plan_history(
+    hass: HomeAssistant,
+    entity_ids: Sequence[str],
+    start_time: datetime,
+    end_time: datetime,
+) -> HistoryPlan:
+    """Route numeric sensors over long windows to the statistics tables.
+
+    Sensors with ``state_class: measurement`` have 5-minute and hourly
+    mean/min/max statistics compiled by the recorder. For windows longer than
+    ``STATISTICS_MIN_WINDOW`` reading those costs one row per period instead
+    of one per update. Short windows and every other entity use raw states.
+    """
+    if end_time - start_time < STATISTICS_MIN_WINDOW:
+        return HistoryPlan(list(entity_ids), [], None)
+
+    numeric: list[str] = []
+    raw: list[str] = []
+    for entity_id in entity_ids:
+        state = hass.states.get(entity_id)
+        if (
+            split_entity_id(entity_id)[0] == "sensor"
+            and state is not None
+            and state.attributes.get(ATTR_STATE_CLASS) == SensorStateClass.MEASUREMENT
+        ):
+            numeric.append(entity_id)
+        else:
+            raw.append(entity_id)
+    if not numeric:
+        return HistoryPlan(raw, [], None)
+
+    # Short-term statistics are purged along with the states, so only use
+    # them when the whole window is still retained.
+    retained_from = dt_util.utcnow() - timedelta(days=get_instance(hass).keep_days)
+    period: StatisticsPeriod = (
+        "5minute"
+        if end_time - start_time <= STATISTICS_SHORT_TERM_MAX_WINDOW
+        and start_time >= retained_from
+        else "hour"
+    )
+    return HistoryPlan(raw, numeric, period)
+
+
+async def async_get_statistics(
+    hass: HomeAssistant,
+    entity_ids: Sequence[str],
+    start_time: datetime,
+    end_time: datetime,
+    period: StatisticsPeriod,
+) -> dict[str, list[statistics.StatisticsRow]]:
+    """Fetch mean/min/max statistics for all entities in one recorder job."""
+    return await get_instance(hass).async_add_executor_job(
+        statistics.statistics_during_period,
+        hass,
+        start_time,
+        end_time,
+        set(entity_ids),
+        period,
+        None,
+        {"mean", "min", "max"},
+    )
+
+
+def _merge_rows(rows: Sequence[Mapping]) -> dict[str, float]:
+    """Combine consecutive statistics rows into one covering their span."""
+    return {
+        "start": rows[0]["start"],
+        "end": rows[-1]["end"],
+        "mean": sum(row["mean"] for row in rows) / len(rows),
+        "min": min(row["min"] for row in rows),
+        "max": max(row["max"] for row in rows),
+    }
+
+
+def statistics_records(
+    entity_id: str, rows: Sequence[Mapping], budget: int | None = None
+) -> list[Record]:
+    """Format statistics rows as history records, at most ``budget`` of them.
+
+    Over budget, consecutive rows are merged into equal-sized buckets (mean of
+    the means, min of the minimums, max of the maximums), so the records still
+    cover the whole window.
+    """
+    rows = [
+        row
+        for row in rows
+        if row.get("mean") is not None
+        and row.get("min") is not None
+        and row.get("max") is not None
+    ]
+    if budget is not None and len(rows) > budget:
+        if budget <= 0:
+            return []
+        edges = [len(rows) * i // budget for i in range(budget + 1)]
+        rows = [_merge_rows(rows[edges[i] : edges[i + 1]]) for i in range(budget)]
+    records: list[Record] = []
+    for row in rows:
+        start = dt_util.utc_from_timestamp(row["start"])
+        end = dt_util.utc_from_timestamp(row["end"])
+        records.append(
+            Record(
+                start,
+                entity_id,
+                f"{entity_id} averaged {format_number(row['mean'])} "
+                f"(min {format_number(row['min'])}, max {format_number(row['max'])}) "
+                f"from {start} to {end}",
+            )
+        )
+    return records
@@ -0,0 +1,107 @@
+"""Token-budgeted prompt construction for the RAG Search integration."""
+
+from __future__ import annotations
+
+import re
+from collections import Counter
+from collections.abc import Sequence
+
+from .const import DEFAULT_CONTEXT_TOKENS, MODEL_CONTEXT_TOKENS, PROMPT_OVERHEAD_TOKENS
+
+# Letter runs, digit runs, then any other single non-space character.
+_PIECE_RE = re.compile(r"[^\W\d_]+|\d+|\S")
+
+QUERY_PREFIX = "\n\nUser Query: "
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate how many tokens ``text`` encodes to, erring on the high side.
+
+    A heuristic, not a tokenizer: an ASCII word is one token plus one per
+    further eight letters, digits are grouped in threes, every other symbol
+    is a token of its own and non-ASCII letters count one each. Splitting
+    digits and symbols apart is what keeps the estimate high for the text
+    these prompts contain (entity ids, states, timestamps).
+    """
+    tokens = 0
+    for match in _PIECE_RE.finditer(text):
+        piece = match.group()
+        if piece.isdigit():
+            tokens += (len(piece) + 2) // 3
+        elif piece.isalpha():
+            tokens += 1 + (len(piece) - 1) // 8 if piece.isascii() else len(piece)
+        else:
+            tokens += 1
+    return tokens
+
+
+def context_window(model: str) -> int:
+    """Return the context window of ``model`` (longest known name prefix)."""
+    matches = [prefix for prefix in MODEL_CONTEXT_TOKENS if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CONTEXT_TOKENS
+    return MODEL_CONTEXT_TOKENS[max(matches, key=len)]
+
+
+def prompt_budget(model: str, prompt_tokens: int, max_tokens: int) -> int:
+    """Return the prompt token budget for ``model``.
+
+    The configured budget, clamped so that prompt, chat framing and the
+    requested completion always fit in the model's context window.
+    """
+    return max(
+        min(prompt_tokens, context_window(model) - max_tokens - PROMPT_OVERHEAD_TOKENS),
+        0,
+    )
+
+
+def recency_priorities(keys: Sequence[str]) -> list[float]:
+    """Prioritise chronological lines newest first, round-robin across ``keys``.
+
+    ``keys[i]`` is the entity line ``i`` belongs to. The newest line of every
+    entity ranks above the second newest of any entity, so a chatty entity
+    cannot crowd a quiet one out of the budget.
+    """
+    seen: Counter[str] = Counter()
+    priorities = [0.0] * len(keys)
+    for index in range(len(keys) - 1, -1, -1):
+        priorities[index] = -float(seen[keys[index]])
+        seen[keys[index]] += 1
+    return priorities
+
+
+def pack_lines(
+    lines: Sequence[str], priorities: Sequence[float], budget: int
+) -> list[str]:
+    """Greedily pack the highest-priority lines into ``budget`` tokens.
+
+    Ties go to the newer line. A line that does not fit is skipped and smaller
+    ones are still tried. The packed lines keep their original order.
+    """
+    order = sorted(range(len(lines)), key=lambda i: (priorities[i], i), reverse=True)
+    chosen: list[int] = []
+    used = 0
+    for index in order:
+        # One extra token for the newline joining the lines.
+        cost = estimate_tokens(lines[index]) + 1
+        if used + cost > budget:
+            continue
+        chosen.append(index)
+        used += cost
+    return [lines[index] for index in sorted(chosen)]
+
+
+def build_prompt(
+    lines: Sequence[str], priorities: Sequence[float], query: str, budget: int
+) -> tuple[str, list[str]] | None:
+    """Build a prompt of at most ``budget`` estimated tokens.
+
+    Returns the prompt and the history lines that made it in, or ``None`` if
+    the query alone does not fit.
+    """
+    suffix = QUERY_PREFIX + query
+    remaining = budget - estimate_tokens(suffix)
+    if remaining < 0:
+        return None
+    packed = pack_lines(lines, priorities, remaining)
+    return "\n".join(packed) + suffix, packed
@@ -0,0 +1,173 @@
+"""Local embedding index used to retrieve the history relevant to a query."""
+
+from __future__ import annotations
+
+import math
+import re
+import zlib
+from collections.abc import Sequence
+from datetime import datetime
+from itertools import pairwise
+from typing import Protocol
+
+import numpy as np
+from homeassistant.util import dt as dt_util
+
+from .const import RETRIEVAL_CHUNK_LINES, RETRIEVAL_EMBEDDING_DIM
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class Embedder(Protocol):
+    """Turn texts into fixed-size vectors.
+
+    Any local model can be plugged in by storing an object with this interface
+    under ``hass.data[DOMAIN]["embedder"]``.
+    """
+
+    dim: int
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return a ``(len(texts), dim)`` float32 matrix."""
+
+
+def _tokenize(text: str) -> list[str]:
+    """Lower-case word tokens; entity ids split on ``.`` and ``_``."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class HashingEmbedder:
+    """Feature-hashing bag of words that needs no model and no network.
+
+    Word unigrams, bigrams and character trigrams are hashed into ``dim``
+    buckets with sub-linear term frequency. Combined with the inverse document
+    frequency weighting applied by ``VectorIndex`` this is a hashed TF-IDF.
+    """
+
+    def __init__(self, dim: int = RETRIEVAL_EMBEDDING_DIM) -> None:
+        """Initialize the embedder."""
+        self.dim = dim
+
+    def _features(self, text: str) -> list[str]:
+        words = _tokenize(text)
+        features = list(words)
+        features.extend(f"{a} {b}" for a, b in pairwise(words))
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts into hashed, sub-linear term-frequency vectors."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            # crc32 rather than hash() so vectors are stable across restarts.
+            buckets = [
+                zlib.crc32(feature.encode()) % self.dim
+                for feature in self._features(text)
+            ]
+            if buckets:
+                np.add.at(matrix[row], buckets, 1.0)
+        return np.log1p(matrix, out=matrix)
+
+
+class VectorIndex:
+    """Dense NumPy matrix of chunk embeddings with cosine top-k search."""
+
+    def __init__(self, embedder: Embedder) -> None:
+        """Initialize an empty index."""
+        self._embedder = embedder
+        self._matrix = np.zeros((0, embedder.dim), dtype=np.float32)
+        self._idf = np.ones(embedder.dim, dtype=np.float32)
+
+    def __len__(self) -> int:
+        """Return the number of indexed documents."""
+        return self._matrix.shape[0]
+
+    def build(self, documents: Sequence[str]) -> None:
+        """Embed and index ``documents``, replacing any previous contents."""
+        matrix = self._embedder.embed(documents)
+        if isinstance(self._embedder, HashingEmbedder) and len(documents):
+            # Down-weight buckets that occur in most chunks (entity ids, "changed
+            # to", the year) so the query's distinctive words dominate.
+            df = np.count_nonzero(matrix, axis=0)
+            self._idf = (np.log((1 + len(documents)) / (1 + df)) + 1).astype(np.float32)
+            matrix *= self._idf
+        self._matrix = _normalize(matrix)
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """Return up to ``k`` ``(document index, cosine score)`` pairs, best first."""
+        if not len(self) or k <= 0:
+            return []
+        vector = _normalize(self._embedder.embed([query]) * self._idf)[0]
+        scores = self._matrix @ vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalise rows, leaving all-zero rows untouched."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _describe_time(when: datetime) -> str:
+    """Words for a timestamp, so queries like "monday morning" can match."""
+    when = dt_util.as_local(when)
+    if when.hour < 6:
+        part = "night"
+    elif when.hour < 12:
+        part = "morning"
+    elif when.hour < 18:
+        part = "afternoon"
+    else:
+        part = "evening night"
+    return f"{when:%A %B} {when.day} {part}"
+
+
+def rank_relevant(
+    embedder: Embedder,
+    lines: Sequence[str],
+    times: Sequence[datetime],
+    query: str,
+    limit: int,
+    chunk_lines: int = RETRIEVAL_CHUNK_LINES,
+) -> list[tuple[str, float]]:
+    """Return at most ``limit`` ``(line, score)`` pairs closest to ``query``.
+
+    ``lines`` must be in chronological order with ``times`` giving the time of
+    each line. The lines are grouped into windows of ``chunk_lines``, indexed,
+    and the lines of the top-scoring windows are returned in chronological
+    order, each with the cosine score of its window. Lines that were not
+    ranked (short history, or no match at all) score 0.
+    """
+    if len(lines) <= limit:
+        return [(line, 0.0) for line in lines]
+
+    starts = range(0, len(lines), chunk_lines)
+    documents = [
+        "\n".join(lines[start : start + chunk_lines])
+        + "\n"
+        + " ".join(
+            sorted(
+                {_describe_time(when) for when in times[start : start + chunk_lines]}
+            )
+        )
+        for start in starts
+    ]
+    index = VectorIndex(embedder)
+    index.build(documents)
+    hits = index.search(query, math.ceil(limit / chunk_lines))
+    if not any(score > 0 for _chunk, score in hits):
+        # Nothing in the query matches the history; recency is the best guess.
+        return [(line, 0.0) for line in lines[-limit:]]
+
+    selected: list[tuple[str, float]] = []
+    for chunk, score in sorted(hits):
+        selected.extend(
+            (line, score) for line in lines[starts[chunk] : starts[chunk] + chunk_lines]
+        )
+    return selected[:limit]
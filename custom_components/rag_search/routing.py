@@ -0,0 +1,297 @@
+"""Local inverted index resolving room, device and entity names to entity ids."""
+
+from __future__ import annotations
+
+import logging
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Collection, Iterable
+
+from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, callback
+from homeassistant.helpers import (
+    area_registry as ar,
+    device_registry as dr,
+    entity_registry as er,
+    label_registry as lr,
+)
+from homeassistant.helpers.start import async_at_started
+
+from .const import ROUTING_FUZZY_SIMILARITY, ROUTING_PREFIX_MIN_LENGTH
+
+_LOGGER = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# Words that name nothing; ignored in names to resolve.
+STOPWORDS = frozenset(
+    {"a", "all", "an", "and", "at", "in", "my", "of", "on", "the", "to"}
+)
+
+
+def _stem(token: str) -> str:
+    """Fold simple plurals, so "lights" finds "light"."""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    """Split ``text`` into lower-case, accent-free, singular words."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [_stem(word) for word in _WORD_RE.findall(text)]
+
+
+def _trigrams(token: str) -> frozenset[str]:
+    padded = f"#{token}#"
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+class EntityIndex:
+    """Inverted index from name words to the entities they describe.
+
+    Every entity is indexed under the words of its id, friendly name,
+    registry name and aliases, device name, area name and aliases, labels and
+    device class. A word of a name that is not indexed as such matches the
+    indexed words it is a prefix of, or failing that the ones sharing most
+    of its character trigrams (typos, other inflections). Each word of the
+    name narrows the candidates; the index follows the entity, device, area
+    and label registries.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty index."""
+        self._postings: defaultdict[str, set[str]] = defaultdict(set)
+        self._terms: dict[str, frozenset[str]] = {}
+        # Derived from the postings on first use after a change.
+        self._words: list[str] | None = None
+        self._trigram_postings: dict[str, set[str]] | None = None
+
+    def __len__(self) -> int:
+        """Return the number of indexed entities."""
+        return len(self._terms)
+
+    def add(self, entity_id: str, texts: Iterable[str]) -> None:
+        """Index ``entity_id`` under the words of ``texts``, replacing old ones."""
+        terms = frozenset(word for text in texts for word in tokenize(text))
+        old = self._terms.get(entity_id, frozenset())
+        if terms == old:
+            return
+        self.remove(entity_id)
+        for term in terms:
+            self._postings[term].add(entity_id)
+        self._terms[entity_id] = terms
+        self._words = self._trigram_postings = None
+
+    def remove(self, entity_id: str) -> None:
+        """Drop ``entity_id`` from the index."""
+        for term in self._terms.pop(entity_id, ()):
+            postings = self._postings[term]
+            postings.discard(entity_id)
+            if not postings:
+                del self._postings[term]
+        self._words = self._trigram_postings = None
+
+    def _matches(self, word: str) -> set[str]:
+        """Return the entities ``word`` refers to."""
+        if (postings := self._postings.get(word)) is not None:
+            return postings
+        if self._words is None:
+            self._words = sorted(self._postings)
+        matched: set[str] = set()
+        if len(word) >= ROUTING_PREFIX_MIN_LENGTH:
+            index = bisect_left(self._words, word)
+            while index < len(self._words) and self._words[index].startswith(word):
+                matched |= self._postings[self._words[index]]
+                index += 1
+            if matched:
+                return matched
+
+        if self._trigram_postings is None:
+            self._trigram_postings = defaultdict(set)
+            for term in self._words:
+                for trigram in _trigrams(term):
+                    self._trigram_postings[trigram].add(term)
+        trigrams = _trigrams(word)
+        shared: defaultdict[str, int] = defaultdict(int)
+        for trigram in trigrams:
+            for term in self._trigram_postings.get(trigram, ()):
+                shared[term] += 1
+        for term, count in shared.items():
+            similarity = count / (len(trigrams) + len(_trigrams(term)) - count)
+            if similarity >= ROUTING_FUZZY_SIMILARITY:
+                matched |= self._postings[term]
+        return matched
+
+    def resolve(self, name: str, scope: Collection[str] | None = None) -> list[str]:
+        """Return the entities ``name`` describes, limited to ``scope``.
+
+        Entities matching every word of the name win. When none does, those
+        matching the most words are returned. Words that match nothing at
+        all (and stopwords) are ignored.
+        """
+        counts: defaultdict[str, int] = defaultdict(int)
+        words = 0
+        for word in dict.fromkeys(tokenize(name)):
+            if word in STOPWORDS:
+                continue
+            matched = self._matches(word)
+            if scope is not None:
+                matched = matched.intersection(scope)
+            if not matched:
+                continue
+            words += 1
+            for entity_id in matched:
+                counts[entity_id] += 1
+        if not counts:
+            return []
+        best = max(counts.values())
+        if best < words:
+            _LOGGER.debug("No entity matches every word of %r", name)
+        return sorted(e for e, count in counts.items() if count == best)
+
+    @callback
+    def async_index_entity(self, hass: HomeAssistant, entity_id: str) -> None:
+        """(Re)index one entity from the registries and the state machine."""
+        texts = [entity_id.replace(".", " ")]
+        if (state := hass.states.get(entity_id)) is not None:
+            texts.append(state.name)
+        if (entry := er.async_get(hass).async_get(entity_id)) is not None:
+            device = (
+                dr.async_get(hass).async_get(entry.device_id)
+                if entry.device_id
+                else None
+            )
+            texts.extend(
+                text
+                for text in (
+                    entry.name,
+                    entry.original_name,
+                    entry.device_class or entry.original_device_class,
+                    *entry.aliases,
+                )
+                if text
+            )
+            labels = set(entry.labels)
+            area_id = entry.area_id
+            if device is not None:
+                texts.extend(
+                    text for text in (device.name_by_user, device.name) if text
+                )
+                labels |= device.labels
+                area_id = area_id or device.area_id
+            if area_id and (area := ar.async_get(hass).async_get_area(area_id)):
+                texts.extend((area.name, *area.aliases))
+            label_registry = lr.async_get(hass)
+            texts.extend(
+                label.name
+                for label_id in labels
+                if (label := label_registry.async_get_label(label_id)) is not None
+            )
+        elif state is None:
+            self.remove(entity_id)
+            return
+        self.add(entity_id, texts)
+
+    @callback
+    def async_build(self, hass: HomeAssistant) -> None:
+        """Index every entity in the entity registry and the state machine."""
+        entity_ids = set(er.async_get(hass).entities) | set(
+            hass.states.async_entity_ids()
+        )
+        for entity_id in entity_ids:
+            self.async_index_entity(hass, entity_id)
+        for entity_id in set(self._terms) - entity_ids:
+            self.remove(entity_id)
+        _LOGGER.debug("Indexed %d entities", len(self))
+
+    @callback
+    def async_start(self, hass: HomeAssistant) -> CALLBACK_TYPE:
+        """Build the index and keep it up to date with the registries.
+
+        Only the entities a registry change touches are reindexed. The index
+        is built again once Home Assistant has started, when every
+        integration has created its states. Returns a callback that stops
+        listening.
+        """
+        entity_registry = er.async_get(hass)
+        device_registry = dr.async_get(hass)
+        self.async_build(hass)
+
+        @callback
+        def _async_reindex(entity_ids: Iterable[str]) -> None:
+            for entity_id in entity_ids:
+                self.async_index_entity(hass, entity_id)
+
+        def _device_entities(device_ids: Iterable[str]) -> list[str]:
+            return [
+                entry.entity_id
+                for device_id in device_ids
+                for entry in er.async_entries_for_device(
+                    entity_registry, device_id, include_disabled_entities=True
+                )
+            ]
+
+        @callback
+        def _async_entity_updated(event: Event) -> None:
+            if old_entity_id := event.data.get("old_entity_id"):
+                self.remove(old_entity_id)
+            if event.data["action"] == "remove":
+                self.remove(event.data["entity_id"])
+            else:
+                _async_reindex([event.data["entity_id"]])
+
+        @callback
+        def _async_device_updated(event: Event) -> None:
+            _async_reindex(_device_entities([event.data["device_id"]]))
+
+        @callback
+        def _async_area_updated(event: Event) -> None:
+            area_id = event.data["area_id"]
+            _async_reindex(
+                [
+                    entry.entity_id
+                    for entry in er.async_entries_for_area(entity_registry, area_id)
+                ]
+                + _device_entities(
+                    device.id
+                    for device in dr.async_entries_for_area(device_registry, area_id)
+                )
+            )
+
+        @callback
+        def _async_label_updated(event: Event) -> None:
+            label_id = event.data["label_id"]
+            _async_reindex(
+                [
+                    entry.entity_id
+                    for entry in er.async_entries_for_label(entity_registry, label_id)
+                ]
+                + _device_entities(
+                    device.id
+                    for device in dr.async_entries_for_label(device_registry, label_id)
+                )
+            )
+
+        unsubscribes = [
+            hass.bus.async_listen(
+                er.EVENT_ENTITY_REGISTRY_UPDATED, _async_entity_updated
+            ),
+            hass.bus.async_listen(
+                dr.EVENT_DEVICE_REGISTRY_UPDATED, _async_device_updated
+            ),
+            hass.bus.async_listen(ar.EVENT_AREA_REGISTRY_UPDATED, _async_area_updated),
+            hass.bus.async_listen(
+                lr.EVENT_LABEL_REGISTRY_UPDATED, _async_label_updated
+            ),
+            async_at_started(hass, self.async_build),
+        ]
+
+        @callback
+        def _async_stop() -> None:
+            for unsubscribe in unsubscribes:
+                unsubscribe()
+
+        return _async_stop
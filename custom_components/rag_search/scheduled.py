@@ -0,0 +1,244 @@
+"""Recurring search_history queries answered ahead of time."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from collections.abc import Mapping, Sequence
+from datetime import datetime, time, timedelta
+from typing import Any, NamedTuple
+
+import voluptuous as vol
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import ATTR_ENTITY_ID, CONF_NAME
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_track_point_in_utc_time
+from homeassistant.helpers.start import async_at_started
+from homeassistant.util import dt as dt_util
+from homeassistant.util import slugify
+
+from .const import (
+    ATTR_MODE,
+    CONF_AT,
+    CONF_INTERVAL,
+    CONF_WINDOW,
+    DEFAULT_SCHEDULED_WINDOW,
+    DOMAIN,
+    MODE_MAP_REDUCE,
+    MODE_RECENT,
+    MODE_RELEVANT,
+    MODE_STRUCTURED,
+    SCHEDULED_JITTER,
+    SCHEDULED_MAX_CONCURRENCY,
+    SCHEDULED_MIN_INTERVAL,
+    SCHEDULED_STARTUP_DELAY,
+    SIGNAL_SCHEDULED_UPDATED,
+)
+from .search import SearchError, async_answer, parse_request
+
+_LOGGER = logging.getLogger(__name__)
+
+SCHEDULED_QUERY_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Required(CONF_NAME): cv.string,
+            vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+            vol.Required("query"): cv.string,
+            # Kept as a string, so the validated queries can be stored.
+            vol.Exclusive(CONF_AT, "schedule"): vol.All(cv.time, time.isoformat),
+            vol.Exclusive(CONF_INTERVAL, "schedule"): vol.All(
+                vol.Coerce(int), vol.Range(min=SCHEDULED_MIN_INTERVAL)
+            ),
+            vol.Optional(CONF_WINDOW, default=DEFAULT_SCHEDULED_WINDOW): vol.All(
+                vol.Coerce(float), vol.Range(min=0.1)
+            ),
+            vol.Optional(ATTR_MODE, default=MODE_RECENT): vol.In(
+                [MODE_RECENT, MODE_RELEVANT, MODE_MAP_REDUCE, MODE_STRUCTURED]
+            ),
+        }
+    ),
+    cv.has_at_least_one_key(CONF_AT, CONF_INTERVAL),
+)
+
+
+def _unique_names(queries: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    slugs = [slugify(query[CONF_NAME]) for query in queries]
+    if len(set(slugs)) != len(slugs):
+        raise vol.Invalid("Scheduled query names must be unique")
+    return queries
+
+
+SCHEDULED_QUERIES_SCHEMA = vol.All(
+    cv.ensure_list, [SCHEDULED_QUERY_SCHEMA], _unique_names
+)
+
+
+class ScheduledQuery(NamedTuple):
+    """A validated scheduled query."""
+
+    key: str
+    name: str
+    entity_ids: list[str]
+    query: str
+    at: time | None
+    interval: timedelta | None
+    window: timedelta
+    mode: str
+
+
+class ScheduledQueries:
+    """Recurring queries answered ahead of time, with their latest answers.
+
+    A query with ``at`` (a local time of day) is answered daily at a random
+    moment up to ``SCHEDULED_JITTER`` before it, so its answer is ready when
+    automations read it; one with an ``interval`` (minutes) runs every
+    interval, up to a tenth of it early. Runs are spread at random so they do
+    not all reach the backend at once, and at most
+    ``SCHEDULED_MAX_CONCURRENCY`` run at a time, queued behind interactive
+    calls. Each run covers the ``window`` hours before it. A failed run keeps
+    the previous answer and reports the error. Answers are not persisted;
+    every query runs once shortly after start-up.
+    """
+
+    def __init__(self, specs: Sequence[Mapping[str, Any]]) -> None:
+        """Validate the queries; invalid ones are logged and left out."""
+        self.queries: list[ScheduledQuery] = []
+        for spec in cv.ensure_list(specs):
+            try:
+                spec = SCHEDULED_QUERY_SCHEMA(dict(spec))
+            except vol.Invalid as err:
+                _LOGGER.error("Ignoring scheduled query %s: %s", spec, err)
+                continue
+            self.queries.append(
+                ScheduledQuery(
+                    slugify(spec[CONF_NAME]),
+                    spec[CONF_NAME],
+                    spec[ATTR_ENTITY_ID],
+                    spec["query"],
+                    time.fromisoformat(spec[CONF_AT]) if CONF_AT in spec else None,
+                    (
+                        timedelta(minutes=spec[CONF_INTERVAL])
+                        if CONF_INTERVAL in spec
+                        else None
+                    ),
+                    timedelta(hours=spec[CONF_WINDOW]),
+                    spec[ATTR_MODE],
+                )
+            )
+        # Latest response and the next run of each query, by key.
+        self.results: dict[str, dict[str, Any]] = {}
+        self.next_runs: dict[str, datetime] = {}
+        self._semaphore = asyncio.Semaphore(SCHEDULED_MAX_CONCURRENCY)
+
+    def next_run(
+        self, query: ScheduledQuery, after: datetime, now: datetime
+    ) -> tuple[datetime, datetime]:
+        """Return the next time ``query`` is due, and when to run it for that.
+
+        The time is the first one of the schedule after both ``after`` (the
+        time last served) and ``now``; the run is up to the jitter before it.
+        Counting from the time served rather than from the run keeps an early
+        run from serving the same time twice.
+        """
+        if query.interval is not None:
+            ready = after + query.interval
+            if ready <= now:
+                ready += query.interval * ((now - ready) // query.interval + 1)
+            early = query.interval.total_seconds() / 10
+        else:
+            local = dt_util.as_local(max(after, now))
+            ready = datetime.combine(local.date(), query.at, local.tzinfo)
+            if ready <= local:
+                ready = datetime.combine(
+                    local.date() + timedelta(days=1), query.at, local.tzinfo
+                )
+            ready = dt_util.as_utc(ready)
+            early = SCHEDULED_JITTER
+        return ready, ready - timedelta(seconds=random.uniform(0, early))
+
+    async def async_run(
+        self, hass: HomeAssistant, conf: dict, query: ScheduledQuery
+    ) -> None:
+        """Answer ``query`` over the window ending now and publish the answer."""
+        async with self._semaphore:
+            now = dt_util.utcnow()
+            data = {
+                ATTR_ENTITY_ID: query.entity_ids,
+                "start_time": (now - query.window).isoformat(),
+                "end_time": now.isoformat(),
+                "query": query.query,
+                ATTR_MODE: query.mode,
+            }
+            try:
+                request = parse_request(data, conf, hass.data[DOMAIN]["scope"])
+            except SearchError as err:
+                response: dict[str, Any] = {"answer": None, "error": str(err)}
+            else:
+                response = await async_answer(hass, conf, request)
+
+        previous = self.results.get(query.key)
+        if response["answer"] is not None:
+            self.results[query.key] = {
+                **response,
+                "answered_at": dt_util.utcnow().isoformat(),
+            }
+        elif previous is not None:
+            _LOGGER.warning(
+                "Scheduled query %s failed; keeping the previous answer", query.name
+            )
+            self.results[query.key] = {**previous, "error": response["error"]}
+        else:
+            self.results[query.key] = response
+        async_dispatcher_send(hass, SIGNAL_SCHEDULED_UPDATED, query.key)
+
+    @callback
+    def async_start(
+        self, hass: HomeAssistant, entry: ConfigEntry, conf: dict
+    ) -> CALLBACK_TYPE:
+        """Run every query once Home Assistant has started, then on schedule.
+
+        Returns a callback that cancels the pending runs.
+        """
+        unsubscribes: dict[str, CALLBACK_TYPE] = {}
+
+        @callback
+        def _async_schedule(
+            query: ScheduledQuery, ready: datetime, when: datetime
+        ) -> None:
+            self.next_runs[query.key] = when
+
+            @callback
+            def _async_due(now: datetime) -> None:
+                entry.async_create_background_task(
+                    hass,
+                    self.async_run(hass, conf, query),
+                    f"{DOMAIN} scheduled query {query.key}",
+                )
+                _async_schedule(query, *self.next_run(query, ready, now))
+
+            unsubscribes[query.key] = async_track_point_in_utc_time(
+                hass, _async_due, when
+            )
+            async_dispatcher_send(hass, SIGNAL_SCHEDULED_UPDATED, query.key)
+
+        @callback
+        def _async_started(_hass: HomeAssistant) -> None:
+            now = dt_util.utcnow()
+            for query in self.queries:
+                when = now + timedelta(
+                    seconds=random.uniform(0, SCHEDULED_STARTUP_DELAY)
+                )
+                _async_schedule(query, when, when)
+
+        cancel_started = async_at_started(hass, _async_started)
+
+        @callback
+        def _async_stop() -> None:
+            cancel_started()
+            for unsubscribe in unsubscribes.values():
+                unsubscribe()
+
+        return _async_stop
@@ -0,0 +1,252 @@
+"""Rate-limit-aware scheduling of requests to the LLM endpoint."""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import random
+import re
+import time
+from collections.abc import AsyncIterator, Mapping
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    PRIORITY_INTERACTIVE,
+    RETRY_BACKOFF_MAX_SECONDS,
+    RETRY_BACKOFF_SECONDS,
+    SCHEDULER_DEADLINE,
+    SCHEDULER_MAX_CONCURRENCY,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# OpenAI reset durations look like "1s", "6m0s", "20ms" or "1h2m3.5s".
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+# Limits without a usable reset time are assumed to be per minute.
+_DEFAULT_WINDOW = 60.0
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse a rate-limit reset duration into seconds."""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _UNIT_SECONDS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    """Return the server's requested retry delay in seconds, if any.
+
+    Understands ``retry-after-ms`` and ``Retry-After`` as seconds or as an
+    HTTP date.
+    """
+    if (value := headers.get("retry-after-ms")) is not None:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    if (value := headers.get("Retry-After")) is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - dt_util.utcnow()).total_seconds(), 0.0)
+
+
+class _Bucket:
+    """Token bucket mirroring one of the server's rate limits.
+
+    Unlimited until the first response reports the limit; every response
+    then resets the level to what the server says is remaining.
+    """
+
+    def __init__(self) -> None:
+        self.capacity = math.inf
+        self.level = math.inf
+        self.rate = math.inf
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if math.isfinite(self.level):
+            self.level = min(
+                self.capacity, self.level + (now - self._updated) * self.rate
+            )
+        self._updated = now
+
+    def update(self, limit: float, remaining: float, reset: float | None) -> None:
+        """Set the bucket from the limit, remaining amount and reset time."""
+        self.capacity = limit
+        self.level = remaining
+        # The server refills the used part of the limit by the reset time.
+        if reset and reset > 0:
+            self.rate = max(limit - remaining, 1.0) / reset
+        else:
+            self.rate = limit / _DEFAULT_WINDOW
+        self._updated = time.monotonic()
+
+    def delay(self, cost: float, now: float) -> float:
+        """Return how long to wait until ``cost`` is available."""
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        if self.level >= cost:
+            return 0.0
+        return (cost - self.level) / self.rate
+
+    def take(self, cost: float) -> None:
+        self.level -= min(cost, self.capacity)
+
+
+class RequestScheduler:
+    """Shared gate in front of the LLM endpoint.
+
+    Bounds concurrency, paces requests and tokens with buckets fed by the
+    ``x-ratelimit-*`` response headers, pauses everyone after a 429 and hands
+    free slots to interactive requests before background ones. One slot is
+    kept for interactive requests, so a burst from automations cannot occupy
+    them all.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+        deadline: float = SCHEDULER_DEADLINE,
+    ) -> None:
+        """Initialize the scheduler."""
+        self.max_concurrency = max_concurrency
+        # Seconds a request may take end to end, queueing and retries included.
+        self.deadline = deadline
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._sequence = itertools.count()
+        self._requests = _Bucket()
+        self._tokens = _Bucket()
+        self._paused_until = 0.0
+
+    @property
+    def active(self) -> int:
+        """Return the number of requests holding a slot."""
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """Return the number of requests waiting for a slot."""
+        return sum(not future.done() for _p, _s, future in self._waiters)
+
+    def _can_start(self, priority: int) -> bool:
+        if priority == PRIORITY_INTERACTIVE:
+            return self._active < self.max_concurrency
+        return self._active < max(self.max_concurrency - 1, 1)
+
+    def _wake(self) -> None:
+        while self._waiters:
+            priority, _sequence, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_start(priority):
+                return
+            heapq.heappop(self._waiters)
+            self._active += 1
+            future.set_result(None)
+
+    async def _acquire(self, priority: int) -> None:
+        if not self._waiters and self._can_start(priority):
+            self._active += 1
+            return
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        # A waiter of lower priority may be blocked on the reserved slot
+        # while this request could start.
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled.
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self._active -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: int, cost: float, deadline: float
+    ) -> AsyncIterator[None]:
+        """Hold a request slot once the rate limits allow ``cost`` tokens.
+
+        ``deadline`` is a ``time.monotonic()`` value; if the limits cannot
+        allow the request before it, ``TimeoutError`` is raised right away
+        instead of waiting in vain.
+        """
+        await self._acquire(priority)
+        try:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self._paused_until - now,
+                    self._requests.delay(1, now),
+                    self._tokens.delay(cost, now),
+                )
+                if wait <= 0:
+                    break
+                if now + wait > deadline:
+                    raise TimeoutError(f"rate limited for another {wait:.1f}s")
+                _LOGGER.debug("Waiting %.2fs for the rate limit", wait)
+                await asyncio.sleep(wait)
+            self._requests.take(1)
+            self._tokens.take(cost)
+            yield
+        finally:
+            self._release()
+
+    def record_response(self, headers: Mapping[str, str]) -> None:
+        """Update the buckets from a response's rate-limit headers."""
+        for kind, bucket in (("requests", self._requests), ("tokens", self._tokens)):
+            try:
+                limit = float(headers[f"x-ratelimit-limit-{kind}"])
+                remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+            except (KeyError, ValueError):
+                continue
+            bucket.update(
+                limit,
+                remaining,
+                parse_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+            )
+
+    def retry_delay(
+        self, attempt: int, headers: Mapping[str, str] | None = None
+    ) -> float:
+        """Return how long to wait before retry number ``attempt``.
+
+        A server-provided ``Retry-After`` is honoured (plus a little jitter so
+        waiting requests do not all return at once) and pauses every request,
+        not just this one. Otherwise the delay is exponential with jitter.
+        """
+        retry_after = parse_retry_after(headers) if headers is not None else None
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, min(retry_after * 0.1, 1.0))
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            return delay
+        ceiling = min(
+            RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+        )
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
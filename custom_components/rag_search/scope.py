@@ -0,0 +1,285 @@
+"""Entity scope rules compiled to the set of entities searches may read."""
+
+from __future__ import annotations
+
+import fnmatch
+import logging
+import re
+from collections.abc import Callable, Collection, Iterable
+
+from homeassistant.core import (
+    CALLBACK_TYPE,
+    Event,
+    HomeAssistant,
+    callback,
+    valid_entity_id,
+)
+from homeassistant.helpers import (
+    area_registry as ar,
+    device_registry as dr,
+    entity_registry as er,
+    label_registry as lr,
+)
+from homeassistant.helpers.start import async_at_started
+
+_LOGGER = logging.getLogger(__name__)
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+class _RuleSet:
+    """The inclusions, or the exclusions, of a scope."""
+
+    __slots__ = (
+        "_globs",
+        "area_ids",
+        "areas",
+        "domains",
+        "entity_ids",
+        "label_ids",
+        "labels",
+    )
+
+    def __init__(self) -> None:
+        self.entity_ids: set[str] = set()
+        self.domains: set[str] = set()
+        # Area and label rules as written (ids or names, case-folded), and
+        # the registry ids they currently name.
+        self.areas: set[str] = set()
+        self.labels: set[str] = set()
+        self.area_ids: frozenset[str] = frozenset()
+        self.label_ids: frozenset[str] = frozenset()
+        self._globs: list[str] = []
+
+    def add(self, rule: str) -> None:
+        """Add one rule, without its ``!``."""
+        kind, separator, value = rule.partition(":")
+        value = value.strip()
+        if separator and value and kind == "domain":
+            self.domains.add(value)
+        elif separator and value and kind == "area":
+            self.areas.add(value.casefold())
+        elif separator and value and kind == "label":
+            self.labels.add(value.casefold())
+        elif _GLOB_CHARS.search(rule):
+            self._globs.append(fnmatch.translate(rule))
+        elif valid_entity_id(rule):
+            self.entity_ids.add(rule)
+        else:
+            _LOGGER.warning("Ignoring entity scope rule %r", rule)
+
+    @property
+    def dynamic(self) -> bool:
+        """Return True if the rules match more than the entity ids they name."""
+        return bool(self.domains or self.areas or self.labels or self._globs)
+
+    @property
+    def uses_registry(self) -> bool:
+        """Return True if matching needs the entity's area or labels."""
+        return bool(self.areas or self.labels)
+
+    def compile(self) -> re.Pattern[str] | None:
+        """Return one expression matching every glob, if there are any."""
+        if not self._globs:
+            return None
+        return re.compile("|".join(f"(?:{glob})" for glob in self._globs))
+
+    @callback
+    def async_resolve(self, hass: HomeAssistant) -> None:
+        """Look up the registry ids of the areas and labels named by the rules."""
+        if self.areas:
+            self.area_ids = frozenset(
+                area.id
+                for area in ar.async_get(hass).async_list_areas()
+                if area.id in self.areas or area.name.casefold() in self.areas
+            )
+        if self.labels:
+            self.label_ids = frozenset(
+                label.label_id
+                for label in lr.async_get(hass).async_list_labels()
+                if label.label_id in self.labels or label.name.casefold() in self.labels
+            )
+
+
+class ScopePolicy:
+    """The entities searches may read, compiled from the scope rules.
+
+    A rule is an entity id, a glob over entity ids (``sensor.*_temperature``),
+    ``domain:<domain>``, ``area:<area id or name>`` or ``label:<label id or
+    name>``; an entity's area is its own or its device's, and so are its
+    labels. A leading ``!`` makes a rule an exclusion, which wins over every
+    inclusion. Entity ids named outright are allowed even before the entity
+    exists.
+
+    The rules are evaluated once against the entity registry and the state
+    machine into the frozen set ``allowed``, so authorising a query of any
+    number of entities is one set operation. ``async_start`` keeps the set
+    current: an entity registry change re-evaluates that entity only, a
+    device, area or label change evaluates the rules again.
+    """
+
+    def __init__(self, rules: Iterable[str]) -> None:
+        """Parse the rules; only the entity ids they name are allowed so far."""
+        self._include = _RuleSet()
+        self._exclude = _RuleSet()
+        for rule in rules:
+            if not (rule := str(rule).strip()):
+                continue
+            if rule.startswith("!"):
+                self._exclude.add(rule[1:].strip())
+            else:
+                self._include.add(rule)
+        self._include_globs = self._include.compile()
+        self._exclude_globs = self._exclude.compile()
+        self.allowed: frozenset[str] = frozenset(
+            entity_id
+            for entity_id in self._include.entity_ids
+            if not self._matches(self._exclude, self._exclude_globs, entity_id)
+        )
+        self._listeners: list[Callable[[frozenset[str]], None]] = []
+
+    def __len__(self) -> int:
+        """Return the number of allowed entities."""
+        return len(self.allowed)
+
+    def denied(self, entity_ids: Collection[str]) -> list[str]:
+        """Return the ``entity_ids`` outside the scope, in order."""
+        if self.allowed.issuperset(entity_ids):
+            return []
+        return [entity_id for entity_id in entity_ids if entity_id not in self.allowed]
+
+    @staticmethod
+    def _matches(
+        rules: _RuleSet,
+        globs: re.Pattern[str] | None,
+        entity_id: str,
+        area_id: str | None = None,
+        label_ids: Collection[str] = (),
+    ) -> bool:
+        return (
+            entity_id in rules.entity_ids
+            or entity_id.partition(".")[0] in rules.domains
+            or (globs is not None and globs.match(entity_id) is not None)
+            or (area_id is not None and area_id in rules.area_ids)
+            or not rules.label_ids.isdisjoint(label_ids)
+        )
+
+    @callback
+    def _async_evaluate(self, hass: HomeAssistant, entity_id: str) -> bool:
+        """Return True if the rules allow ``entity_id``."""
+        area_id: str | None = None
+        label_ids: set[str] = set()
+        if (self._include.uses_registry or self._exclude.uses_registry) and (
+            entry := er.async_get(hass).async_get(entity_id)
+        ) is not None:
+            area_id = entry.area_id
+            label_ids.update(entry.labels)
+            if entry.device_id and (
+                device := dr.async_get(hass).async_get(entry.device_id)
+            ):
+                area_id = area_id or device.area_id
+                label_ids.update(device.labels)
+        return self._matches(
+            self._include, self._include_globs, entity_id, area_id, label_ids
+        ) and not self._matches(
+            self._exclude, self._exclude_globs, entity_id, area_id, label_ids
+        )
+
+    @callback
+    def _async_set(self, allowed: frozenset[str]) -> None:
+        if allowed == self.allowed:
+            return
+        self.allowed = allowed
+        _LOGGER.debug("%d entities in scope", len(allowed))
+        for listener in list(self._listeners):
+            listener(allowed)
+
+    @callback
+    def async_add_listener(
+        self, listener: Callable[[frozenset[str]], None]
+    ) -> CALLBACK_TYPE:
+        """Call ``listener`` with the allowed entities whenever they change.
+
+        Returns a callback that removes the listener.
+        """
+        self._listeners.append(listener)
+
+        @callback
+        def _async_remove() -> None:
+            self._listeners.remove(listener)
+
+        return _async_remove
+
+    @callback
+    def async_compile(self, hass: HomeAssistant) -> None:
+        """Evaluate the rules against every known entity."""
+        if not self._include.dynamic:
+            candidates: Iterable[str] = self._include.entity_ids
+        else:
+            self._include.async_resolve(hass)
+            candidates = set(er.async_get(hass).entities)
+            candidates.update(hass.states.async_entity_ids())
+            candidates.update(self._include.entity_ids)
+        self._exclude.async_resolve(hass)
+        self._async_set(
+            frozenset(
+                entity_id
+                for entity_id in candidates
+                if self._async_evaluate(hass, entity_id)
+            )
+        )
+
+    @callback
+    def async_start(self, hass: HomeAssistant) -> CALLBACK_TYPE:
+        """Compile the scope and keep it up to date with the registries.
+
+        Before Home Assistant has started, device, area and label changes are
+        left to the compilation that follows the start. Returns a callback
+        that stops listening.
+        """
+        self.async_compile(hass)
+
+        @callback
+        def _async_entity_updated(event: Event) -> None:
+            allowed = set(self.allowed)
+            for entity_id in (event.data["entity_id"], event.data.get("old_entity_id")):
+                if not entity_id:
+                    continue
+                exists = (
+                    entity_id in self._include.entity_ids
+                    or er.async_get(hass).async_get(entity_id) is not None
+                    or hass.states.get(entity_id) is not None
+                )
+                if exists and self._async_evaluate(hass, entity_id):
+                    allowed.add(entity_id)
+                else:
+                    allowed.discard(entity_id)
+            self._async_set(frozenset(allowed))
+
+        @callback
+        def _async_registry_updated(_event: Event) -> None:
+            if hass.is_running:
+                self.async_compile(hass)
+
+        unsubscribes = [
+            hass.bus.async_listen(
+                er.EVENT_ENTITY_REGISTRY_UPDATED, _async_entity_updated
+            ),
+            async_at_started(hass, self.async_compile),
+        ]
+        if self._include.uses_registry or self._exclude.uses_registry:
+            unsubscribes.extend(
+                hass.bus.async_listen(event_type, _async_registry_updated)
+                for event_type in (
+                    dr.EVENT_DEVICE_REGISTRY_UPDATED,
+                    ar.EVENT_AREA_REGISTRY_UPDATED,
+                    lr.EVENT_LABEL_REGISTRY_UPDATED,
+                )
+            )
+
+        @callback
+        def _async_stop() -> None:
+            for unsubscribe in unsubscribes:
+                unsubscribe()
+
+        return _async_stop
@@ -1,27 +1,103 @@
 """RAG history search logic for the RAG Search integration."""
 
 import asyncio
+import functools
+import heapq
 import logging
-from datetime import datetime
+import math
+import time
+from collections import defaultdict
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta
+from operator import attrgetter
+from typing import Any, NamedTuple
 
 import aiohttp
+import voluptuous as vol
 from homeassistant.components.recorder import get_instance, history
-from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.components.recorder.db_schema import States
+from homeassistant.components.recorder.util import session_scope
+from homeassistant.const import MAX_LENGTH_STATE_STATE
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, State
+from homeassistant.helpers import config_validation as cv
+from homeassistant.util import dt as dt_util
+from sqlalchemy import select
+from voluptuous.humanize import humanize_error
 
+from .analytics import compute_facts, fact_lines
+from .backend import OpenAIBackend
+from .buffer import HistoryBuffer
+from .cache import (
+    AnswerCache,
+    SemanticCache,
+    SingleFlight,
+    answer_key,
+    history_key,
+    normalize_query,
+)
+from .compress import Record, compress_states
 from .const import (
+    ATTR_MODE,
+    ATTR_NAME,
+    ATTR_QUERIES,
+    ATTR_SESSION_ID,
+    ATTR_THRESHOLD,
+    BATCH_MAX_CONCURRENCY,
+    COMPRESS_FETCH_FACTOR,
+    CONF_COMPRESS,
+    CONF_FACTS,
     CONF_MAX_ITEMS,
-    CONF_OPENAI_API_KEY,
+    CONF_MAX_TOKENS,
     CONF_OPENAI_MODEL,
+    CONF_PROMPT_TOKENS,
+    CONF_STREAM,
+    DEFAULT_COMPRESS,
+    DEFAULT_FACTS,
     DEFAULT_MAX_ITEMS,
+    DEFAULT_MAX_TOKENS,
     DEFAULT_MODEL,
+    DEFAULT_PROMPT_TOKENS,
+    DEFAULT_STREAM,
+    DIGEST_MIN_WINDOW,
     DOMAIN,
+    MAP_REDUCE_MAX_CHUNKS,
+    MAP_REDUCE_SUMMARY_TOKENS,
     MAX_RETRIES,
-    OPENAI_CHAT_URL,
-    OPENAI_MAX_TOKENS,
+    MODE_MAP_REDUCE,
+    MODE_RECENT,
+    MODE_RELEVANT,
+    MODE_STRUCTURED,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
     REQUEST_TIMEOUT,
     RESULT_ENTITY,
-    RETRY_BACKOFF_SECONDS,
+    STAGE_FETCH,
+    STAGE_FORMAT,
+    STAGE_LLM,
+    STAGE_LLM_FIRST_BYTE,
+    STAGE_PROMPT,
+    STAGE_SUMMARIZE,
+    STAGE_VALIDATION,
+)
+from .digests import DigestStore
+from .mapreduce import SUMMARY_INSTRUCTION, async_map_reduce
+from .metrics import QueryMetrics, QueryTrace
+from .planner import async_get_statistics, plan_history, statistics_records
+from .prompt import (
+    QUERY_PREFIX,
+    build_prompt,
+    estimate_tokens,
+    pack_lines,
+    prompt_budget,
+    recency_priorities,
 )
+from .retrieval import Embedder, rank_relevant
+from .routing import EntityIndex
+from .scheduler import RequestScheduler
+from .scope import ScopePolicy
+from .segments import SegmentCache
+from .sessions import Message, SessionStore
+from .stream import DeltaCallback, PartialPublisher, iter_content_deltas
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -31,68 +107,346 @@ def _parse_iso(value: str) -> datetime:
     return datetime.fromisoformat(value.replace("Z", "+00:00"))
 
 
-def _format_history(entity_id: str, history_data: dict, num_items: int) -> list[str]:
-    """Format significant-state history into human-readable lines."""
-    entries: list[str] = []
-    if entity_id in history_data:
-        latest_entries = history_data[entity_id][-num_items:]
-        for state in latest_entries:
-            entries.append(
-                f"{state.entity_id} changed to {state.state} at {state.last_changed}"
+def _get_latest_states(
+    hass: HomeAssistant,
+    start_time: datetime,
+    end_time: datetime,
+    entity_id: str,
+    limit: int,
+) -> dict[str, list[State]]:
+    """Return the newest ``limit`` state changes of an entity within a window.
+
+    ``history.get_significant_states`` loads every state in the window, which
+    on a chatty sensor means materialising far more rows than we keep. This
+    query orders by ``last_updated_ts`` descending and applies the limit in the
+    database, then reverses the rows back into chronological order, so the
+    cost scales with ``limit`` rather than with the window length.
+
+    Runs in the recorder executor. The result has the same shape as
+    ``get_significant_states``.
+    """
+    instance = get_instance(hass)
+    if not instance.states_meta_manager.active:
+        # The states table has not been migrated to the metadata schema yet;
+        # fall back to the full fetch and slice.
+        history_data = history.get_significant_states(
+            hass, start_time, end_time, [entity_id]
+        )
+        return {entity_id: history_data.get(entity_id, [])[-limit:]}
+
+    start_ts = start_time.timestamp()
+    end_ts = end_time.timestamp()
+    with session_scope(hass=hass, read_only=True) as session:
+        metadata_id = instance.states_meta_manager.get(entity_id, session, False)
+        if metadata_id is None:
+            return {}
+        rows = session.execute(
+            select(States.state, States.last_changed_ts, States.last_updated_ts)
+            .filter(States.metadata_id == metadata_id)
+            .filter(
+                (States.last_changed_ts == States.last_updated_ts)
+                | States.last_changed_ts.is_(None)
+            )
+            .filter(States.last_updated_ts >= start_ts)
+            .filter(States.last_updated_ts < end_ts)
+            .order_by(States.last_updated_ts.desc())
+            .limit(limit)
+        ).all()
+        # Like get_significant_states, include the state in effect at the
+        # start of the window when the window itself has room for it.
+        start_row = None
+        if len(rows) < limit:
+            start_row = session.execute(
+                select(States.state)
+                .filter(States.metadata_id == metadata_id)
+                .filter(States.last_updated_ts < start_ts)
+                .order_by(States.last_updated_ts.desc())
+                .limit(1)
+            ).first()
+
+    states: list[State] = []
+    if start_row is not None and start_row.state:
+        states.append(
+            State(
+                entity_id,
+                start_row.state,
+                last_changed=start_time,
+                last_updated=start_time,
             )
-    return entries
+        )
+    for row in reversed(rows):
+        last_updated = dt_util.utc_from_timestamp(row.last_updated_ts)
+        states.append(
+            State(
+                entity_id,
+                row.state or "",
+                last_changed=(
+                    dt_util.utc_from_timestamp(row.last_changed_ts)
+                    if row.last_changed_ts
+                    else last_updated
+                ),
+                last_updated=last_updated,
+            )
+        )
+    return {entity_id: states}
+
+
+def _allocate_budget(counts: Sequence[int], total: int) -> list[int]:
+    """Split ``total`` items fairly across streams of the given lengths.
+
+    Every stream gets an equal share; whatever a short stream does not use is
+    handed on to the longer ones, so the budget is not wasted when one entity
+    is quiet and another is chatty.
+    """
+    budgets = [0] * len(counts)
+    remaining = total
+    pending = sorted(range(len(counts)), key=lambda i: counts[i])
+    while pending and remaining > 0:
+        share = max(remaining // len(pending), 1)
+        index = pending.pop(0)
+        budgets[index] = min(counts[index], share)
+        remaining -= budgets[index]
+    return budgets
+
+
+def _merge_history(
+    entity_ids: Sequence[str], history_data: Mapping[str, list], num_items: int
+) -> list:
+    """K-way merge per-entity histories by time, newest ``num_items`` overall.
+
+    Each entity keeps its newest states within a fair per-entity budget, and
+    the surviving streams are merged into a single chronological sequence.
+    """
+    streams = [history_data.get(entity_id, []) for entity_id in entity_ids]
+    budgets = _allocate_budget([len(stream) for stream in streams], num_items)
+    return list(
+        heapq.merge(
+            *(
+                stream[len(stream) - budget :]
+                for stream, budget in zip(streams, budgets)
+                if budget
+            ),
+            key=lambda state: state.last_changed,
+        )
+    )
+
+
+def _format_state(state) -> str:
+    """Format a single state as a human-readable line."""
+    return f"{state.entity_id} changed to {state.state} at {state.last_changed}"
+
+
+def _compress_history(
+    entity_ids: Sequence[str],
+    history_data: Mapping,
+    num_items: int | None,
+    window_end: datetime,
+) -> list[Record]:
+    """Compress each entity's history and merge the records by time.
+
+    Noise is dropped and repeats collapsed for every entity first; entities
+    that still exceed their fair share of ``num_items`` are then downsampled
+    to fit it. ``None`` means no limit.
+    """
+    streams = [
+        compress_states(history_data.get(entity_id, []), window_end)
+        for entity_id in entity_ids
+    ]
+    if num_items is not None:
+        budgets = _allocate_budget([len(stream) for stream in streams], num_items)
+        streams = [
+            (
+                stream
+                if len(stream) <= budget
+                else compress_states(
+                    history_data.get(entity_id, []), window_end, budget
+                )
+            )
+            for entity_id, stream, budget in zip(entity_ids, streams, budgets)
+        ]
+    return list(heapq.merge(*streams, key=attrgetter("when")))
+
+
+def _map_reduce_records(
+    raw_ids: Sequence[str],
+    history_data: Mapping,
+    statistics_data: Mapping[str, Sequence],
+    digest_records: Sequence[Record],
+    window_end: datetime,
+    compress: bool,
+    capacity: int,
+) -> list[Record]:
+    """Return every record of the window, thinned evenly above ``capacity`` tokens.
+
+    Nothing is cut by ``num_items`` here. Only when the records would not fit
+    the map phase is every stream downsampled by the same factor (LTTB for
+    numeric states, merged buckets for statistics, collapsed flapping for the
+    rest). Digest lines are already one per day and are kept as they are.
+    """
+    stats_ids = [e for e in statistics_data if statistics_data[e]]
+    streams: dict[str, list[Record]] = {}
+    for entity_id in raw_ids:
+        states = history_data.get(entity_id, [])
+        streams[entity_id] = (
+            compress_states(states, window_end)
+            if compress
+            else [Record(s.last_changed, s.entity_id, _format_state(s)) for s in states]
+        )
+    for entity_id in stats_ids:
+        streams[entity_id] = statistics_records(entity_id, statistics_data[entity_id])
+
+    total = sum(
+        estimate_tokens(record.text) + 1
+        for stream in streams.values()
+        for record in stream
+    )
+    if total > capacity:
+        _LOGGER.debug("Thinning %d tokens of history to %d", total, capacity)
+        scale = capacity / total
+        for entity_id, stream in streams.items():
+            budget = max(int(len(stream) * scale), 1)
+            streams[entity_id] = (
+                statistics_records(entity_id, statistics_data[entity_id], budget)
+                if entity_id in stats_ids
+                else compress_states(
+                    history_data.get(entity_id, []), window_end, budget
+                )
+            )
+    return list(heapq.merge(digest_records, *streams.values(), key=attrgetter("when")))
+
+
+def _select_relevant_history(
+    embedder: Embedder,
+    entity_ids: Sequence[str],
+    history_data: Mapping,
+    query: str,
+    num_items: int,
+    window_end: datetime | None,
+    statistics: Sequence[Record] = (),
+) -> list[tuple[str, float]]:
+    """Format the whole window and keep the chunks most relevant to ``query``.
+
+    Returns ``(line, relevance)`` pairs in chronological order. With a
+    ``window_end`` the history is compressed (without downsampling) before it
+    is chunked. ``statistics`` records are ranked along with the states. CPU
+    bound, so it runs in the executor.
+    """
+    if window_end is not None:
+        records = _compress_history(entity_ids, history_data, None, window_end)
+    else:
+        records = [
+            Record(state.last_changed, state.entity_id, _format_state(state))
+            for state in _merge_history(
+                entity_ids, history_data, sum(len(v) for v in history_data.values())
+            )
+        ]
+    if statistics:
+        records = list(heapq.merge(records, statistics, key=attrgetter("when")))
+    return rank_relevant(
+        embedder,
+        [record.text for record in records],
+        [record.when for record in records],
+        query,
+        num_items,
+    )
 
 
 async def _call_openai(
-    session: aiohttp.ClientSession, api_key: str, model: str, prompt: str
+    backend: OpenAIBackend,
+    model: str,
+    prompt: str | Sequence[Mapping[str, str]],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    on_delta: DeltaCallback | None = None,
+    scheduler: RequestScheduler | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    trace: QueryTrace | None = None,
 ) -> str | None:
-    """Call the OpenAI chat completions API with timeout and retries.
+    """Call the backend's chat completions API through the request scheduler.
 
-    Returns the answer text, or ``None`` on a non-retryable failure.
+    ``prompt`` is sent as a single user message, or is the list of messages.
+    Every attempt waits for a scheduler slot and the rate limits; retryable
+    failures back off as the scheduler says. The whole call, queueing
+    included, is bounded by the scheduler's deadline. With ``on_delta`` the
+    completion is streamed and the callback is invoked for every chunk as it
+    arrives. A ``trace`` gets the retries, the last attempt's time to first
+    byte and the token usage. Returns the answer text, or ``None`` on failure.
     """
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    messages = (
+        [{"role": "user", "content": prompt}]
+        if isinstance(prompt, str)
+        else list(prompt)
+    )
     payload = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": OPENAI_MAX_TOKENS,
+        "messages": messages,
+        "max_tokens": max_tokens,
     }
-    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    if on_delta is not None:
+        payload["stream"] = True
+    cost = sum(estimate_tokens(message["content"]) for message in messages) + max_tokens
+    deadline = time.monotonic() + scheduler.deadline
 
     last_error: Exception | None = None
     for attempt in range(1, MAX_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        timeout = aiohttp.ClientTimeout(total=min(REQUEST_TIMEOUT, remaining))
+        if trace is not None:
+            trace.retries = attempt - 1
         try:
-            async with session.post(
-                OPENAI_CHAT_URL, json=payload, headers=headers, timeout=timeout
-            ) as response:
-                # 4xx (except 429) are client errors and will not succeed on
-                # retry, so fail fast.
-                if response.status == 429 or response.status >= 500:
-                    _LOGGER.warning(
-                        "OpenAI API returned retryable status %s (attempt %d/%d)",
-                        response.status,
-                        attempt,
-                        MAX_RETRIES,
-                    )
-                    last_error = RuntimeError(f"status {response.status}")
-                    await _backoff(attempt)
-                    continue
-                if response.status != 200:
-                    _LOGGER.error(
-                        "OpenAI API returned a non-200 status: %s", response.status
-                    )
-                    return None
-
-                response_data = await response.json()
-                choices = response_data.get("choices")
-                if not choices:
-                    _LOGGER.error("Invalid response from OpenAI: %s", response_data)
-                    return None
-                return choices[0]["message"]["content"].strip()
-
-        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            async with asyncio.timeout(remaining), scheduler.slot(
+                priority, cost, deadline
+            ):
+                sent = time.monotonic()
+                async with backend.post_chat(payload, timeout) as response:
+                    if trace is not None:
+                        trace.stages[STAGE_LLM_FIRST_BYTE] = (
+                            time.monotonic() - sent
+                        ) * 1000
+                    scheduler.record_response(response.headers)
+                    # 4xx (except 429) are client errors and will not succeed on
+                    # retry, so fail fast.
+                    if response.status == 429 or response.status >= 500:
+                        _LOGGER.warning(
+                            "OpenAI API returned retryable status %s (attempt %d/%d)",
+                            response.status,
+                            attempt,
+                            MAX_RETRIES,
+                        )
+                        last_error = RuntimeError(f"status {response.status}")
+                        delay = scheduler.retry_delay(attempt, response.headers)
+                    elif response.status != 200:
+                        _LOGGER.error(
+                            "OpenAI API returned a non-200 status: %s", response.status
+                        )
+                        return None
+                    elif on_delta is not None:
+                        parts: list[str] = []
+                        async for delta in iter_content_deltas(
+                            response, trace.set_usage if trace else None
+                        ):
+                            parts.append(delta)
+                            on_delta(delta, "".join(parts))
+                        if not (answer := "".join(parts).strip()):
+                            _LOGGER.error("OpenAI stream ended without an answer")
+                            return None
+                        return answer
+                    else:
+                        response_data = await response.json()
+                        choices = response_data.get("choices")
+                        if not choices:
+                            _LOGGER.error(
+                                "Invalid response from OpenAI: %s", response_data
+                            )
+                            return None
+                        if trace is not None:
+                            trace.set_usage(response_data.get("usage"))
+                        return choices[0]["message"]["content"].strip()
+
+        except (aiohttp.ClientError, TimeoutError) as err:
             last_error = err
             _LOGGER.warning(
                 "Error calling OpenAI API (attempt %d/%d): %s",
@@ -100,70 +454,854 @@ async def _call_openai(
                 MAX_RETRIES,
                 err,
             )
-            await _backoff(attempt)
+            delay = scheduler.retry_delay(attempt)
 
-    _LOGGER.error(
-        "OpenAI API call failed after %d attempts: %s", MAX_RETRIES, last_error
-    )
+        if attempt == MAX_RETRIES:
+            break
+        if time.monotonic() + delay >= deadline:
+            _LOGGER.warning(
+                "Not retrying: a %.1fs backoff would exceed the %ss deadline",
+                delay,
+                scheduler.deadline,
+            )
+            break
+        # The slot is released while backing off.
+        await asyncio.sleep(delay)
+
+    _LOGGER.error("OpenAI API call failed after %d attempts: %s", attempt, last_error)
     return None
 
 
-async def _backoff(attempt: int) -> None:
-    """Sleep with linear backoff between retries (skipped on the last attempt)."""
-    if attempt < MAX_RETRIES:
-        await asyncio.sleep(RETRY_BACKOFF_SECONDS * attempt)
+async def _async_get_history(
+    hass: HomeAssistant,
+    entity_ids: list[str],
+    start_time: datetime,
+    end_time: datetime,
+    limit: int | None,
+    reuse: bool = False,
+) -> Mapping[str, list]:
+    """Return history for the window from the cheapest source that has it.
 
+    The in-memory buffer is used when it covers the window. A single entity
+    with a limit uses the newest-first recorder query, unless the history is
+    to be ``reuse``d by follow-up questions. Anything else goes through the
+    segment cache, which fetches all entities together and only for the
+    parts of the window it has not loaded before.
+    """
+    buffer: HistoryBuffer = hass.data[DOMAIN]["buffer"]
+    if buffer.covers(entity_ids, start_time):
+        return buffer.get_states(entity_ids, start_time, end_time, limit)
 
-async def search_history(hass: HomeAssistant, conf: dict, call: ServiceCall) -> None:
-    """Handle the service call for rag_search.search_history."""
-    openai_model = conf.get(CONF_OPENAI_MODEL, DEFAULT_MODEL)
-    openai_api_key = conf.get(CONF_OPENAI_API_KEY)
-    max_items = conf.get(CONF_MAX_ITEMS, DEFAULT_MAX_ITEMS)
-    session = hass.data[DOMAIN]["session"]
+    segments: SegmentCache = hass.data[DOMAIN]["segments"]
+    if (
+        limit is not None
+        and not reuse
+        and len(entity_ids) == 1
+        and not segments.covers(entity_ids, start_time, end_time)
+    ):
+        return await get_instance(hass).async_add_executor_job(
+            _get_latest_states, hass, start_time, end_time, entity_ids[0], limit
+        )
+    return await segments.async_get_states(hass, entity_ids, start_time, end_time)
+
+
+def requested_entity_ids(data: Mapping[str, Any]) -> list[str]:
+    """Return the de-duplicated entity ids requested by a service call."""
+    entity_id = data.get("entity_id")
+    if not entity_id:
+        return []
+    if isinstance(entity_id, str):
+        entity_id = [part.strip() for part in entity_id.split(",")]
+    return list(dict.fromkeys(e for e in entity_id if e))
+
+
+class SearchRequest(NamedTuple):
+    """A validated search_history call."""
+
+    entity_ids: list[str]
+    start_time: datetime
+    end_time: datetime
+    query: str
+    mode: str
+    num_items: int
+    priority: int
+    threshold: float | None = None
+    session_id: str | None = None
+    stream: bool = False
+
+
+class SearchError(Exception):
+    """A search request that cannot be answered; the message is the result."""
+
+
+# One item of a search_history_batch call: the fields of search_history.
+BATCH_QUERY_SCHEMA = vol.Schema(
+    {
+        vol.Optional("entity_id"): vol.Any(cv.string, [cv.string]),
+        vol.Optional(ATTR_NAME): cv.string,
+        vol.Required("start_time"): cv.string,
+        vol.Required("end_time"): cv.string,
+        vol.Required("query"): cv.string,
+        vol.Optional("num_items"): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        vol.Optional(ATTR_MODE): vol.In(
+            [MODE_RECENT, MODE_RELEVANT, MODE_MAP_REDUCE, MODE_STRUCTURED]
+        ),
+        vol.Optional(ATTR_THRESHOLD): vol.Coerce(float),
+        vol.Optional(ATTR_SESSION_ID): cv.string,
+    }
+)
+
+
+def parse_request(
+    data: Mapping[str, Any],
+    conf: dict,
+    scope: ScopePolicy,
+    user_id: str | None = None,
+    index: EntityIndex | None = None,
+) -> SearchRequest:
+    """Validate the fields of one search and return the request.
+
+    Every entity must be allowed by the compiled ``scope``. A ``name`` is
+    resolved with the routing ``index`` to the entities in scope it
+    describes, which are added to any ``entity_id`` given.
+
+    A ``session_id`` makes the request a turn of that conversation.
 
-    start_time_str = call.data.get("start_time")
-    end_time_str = call.data.get("end_time")
+    Raises ``SearchError`` with the message to report when the entities are
+    not in scope or no entity in scope matches the name, the time window is
+    missing or malformed, or the threshold is not a number.
+    """
+    entity_ids = requested_entity_ids(data)
+    if (name := data.get(ATTR_NAME)) and index is not None:
+        resolved = index.resolve(str(name), scope.allowed)
+        if not resolved:
+            _LOGGER.error("No entity in the allowed scope matches %r.", name)
+            raise SearchError("No entity matches the name.")
+        _LOGGER.debug("Resolved %r to %s", name, resolved)
+        entity_ids = list(dict.fromkeys(entity_ids + resolved))
+    out_of_scope = scope.denied(entity_ids)
+    if not entity_ids or out_of_scope:
+        _LOGGER.error(
+            "Entities %s are not in the allowed scope.", out_of_scope or entity_ids
+        )
+        raise SearchError("Entity not in scope.")
+
+    start_time_str = data.get("start_time")
+    end_time_str = data.get("end_time")
     if not start_time_str or not end_time_str:
         _LOGGER.error("Both 'start_time' and 'end_time' must be provided.")
-        hass.states.async_set(RESULT_ENTITY, "Invalid time parameters.")
-        return
+        raise SearchError("Invalid time parameters.")
 
     try:
         start_time = _parse_iso(start_time_str)
         end_time = _parse_iso(end_time_str)
     except ValueError as err:
         _LOGGER.error("Invalid date format for start_time or end_time: %s", err)
-        hass.states.async_set(RESULT_ENTITY, "Invalid date format.")
-        return
+        raise SearchError("Invalid date format.") from err
+
+    threshold = data.get(ATTR_THRESHOLD)
+    if threshold is not None:
+        try:
+            threshold = float(threshold)
+        except (TypeError, ValueError) as err:
+            _LOGGER.error("Invalid threshold: %s", threshold)
+            raise SearchError("Invalid threshold.") from err
+
+    max_items = conf.get(CONF_MAX_ITEMS, DEFAULT_MAX_ITEMS)
+    return SearchRequest(
+        entity_ids,
+        start_time,
+        end_time,
+        str(data.get("query")),
+        data.get(ATTR_MODE, MODE_RECENT),
+        min(data.get("num_items", max_items), max_items),
+        # A call made by a user (UI, voice) is interactive; calls from
+        # automations and scripts carry no user and queue behind them.
+        PRIORITY_INTERACTIVE if user_id else PRIORITY_BACKGROUND,
+        threshold,
+        str(session_id) if (session_id := data.get(ATTR_SESSION_ID)) else None,
+    )
+
+
+async def async_answer(
+    hass: HomeAssistant,
+    conf: dict,
+    request: SearchRequest,
+    trace: QueryTrace | None = None,
+) -> dict[str, Any]:
+    """Answer a request, sharing the work with an identical one in flight.
+
+    Returns the answer (or error) with the request's metadata. The query's
+    stage timings and token usage, collected in ``trace``, are recorded in
+    the entry's metrics.
+    """
+    if trace is None:
+        trace = QueryTrace()
+    inflight: SingleFlight[dict[str, Any]] = hass.data[DOMAIN]["inflight"]
+    result, shared = await inflight.run(
+        (
+            tuple(sorted(request.entity_ids)),
+            request.start_time,
+            request.end_time,
+            normalize_query(request.query),
+            request.mode,
+            request.num_items,
+            request.threshold,
+            request.session_id,
+        ),
+        lambda: _async_answer(hass, conf, request, trace),
+    )
+    if shared:
+        _LOGGER.debug("Joined an identical query already in flight")
+    response = {
+        **result,
+        "entity_ids": request.entity_ids,
+        "start_time": request.start_time.isoformat(),
+        "end_time": request.end_time.isoformat(),
+        "mode": request.mode,
+        "shared": shared,
+    }
+    metrics: QueryMetrics = hass.data[DOMAIN]["metrics"]
+    metrics.async_record(trace, response)
+    return response
+
+
+async def search_history(
+    hass: HomeAssistant, conf: dict, call: ServiceCall
+) -> ServiceResponse:
+    """Handle the service call for rag_search.search_history.
+
+    The answer is written to the result entity and also returned, with some
+    metadata, as the service response. Identical calls that arrive while one
+    is already running share its history fetch and OpenAI call.
+    """
+    trace = QueryTrace()
+    try:
+        request = parse_request(
+            call.data,
+            conf,
+            hass.data[DOMAIN]["scope"],
+            call.context.user_id,
+            hass.data[DOMAIN]["index"],
+        )
+    except SearchError as err:
+        hass.states.async_set(RESULT_ENTITY, str(err))
+        response = {"answer": None, "error": str(err)}
+        hass.data[DOMAIN]["metrics"].async_record(trace, response)
+        return response
+    trace.lap(STAGE_VALIDATION)
+
+    # Only an interactive search streams its answer into the result entity.
+    request = request._replace(stream=conf.get(CONF_STREAM, DEFAULT_STREAM))
+    response = await async_answer(hass, conf, request, trace)
+    # An empty completion is an answer, not an error.
+    answer = response["answer"]
+    hass.states.async_set(
+        RESULT_ENTITY,
+        (answer if answer is not None else response["error"])[:MAX_LENGTH_STATE_STATE],
+    )
+    return response
 
-    entity_id = call.data.get("entity_id")
-    if isinstance(entity_id, list):
-        entity_id = entity_id[0] if entity_id else None
 
-    num_items = min(call.data.get("num_items", max_items), max_items)
+def _digest_history(
+    hass: HomeAssistant, request: SearchRequest
+) -> tuple[list[Record], datetime, datetime]:
+    """Return the digest lines for a request, where they start and end.
 
+    Raw history covers the window before the digested days (the rest of the
+    day the window starts in) and after them. Only windows of at least
+    ``DIGEST_MIN_WINDOW`` use the digests; for the rest, or when the digests
+    do not cover the window, raw history is read from the start of the
+    window. Structured queries compute their facts from the whole window and
+    never use the digests.
+    """
+    if (
+        request.mode == MODE_STRUCTURED
+        or request.end_time - request.start_time < DIGEST_MIN_WINDOW
+    ):
+        return [], request.start_time, request.start_time
+    digests: DigestStore = hass.data[DOMAIN]["digests"]
+    retained_from = dt_util.utcnow() - timedelta(days=get_instance(hass).keep_days)
+    planned = digests.plan(
+        request.entity_ids, request.start_time, request.end_time, retained_from
+    )
+    if planned is None:
+        return [], request.start_time, request.start_time
     _LOGGER.debug(
-        "Fetching history from %s to %s for entity %s",
+        "Read %d digest lines from %s, history from %s",
+        len(planned[0]),
+        planned[1],
+        planned[2],
+    )
+    return planned
+
+
+def _merge_spans(
+    spans: list[tuple[datetime, datetime]],
+) -> list[tuple[datetime, datetime]]:
+    """Merge overlapping or touching time spans."""
+    merged: list[tuple[datetime, datetime]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def _async_prefetch(
+    hass: HomeAssistant, requests: Sequence[SearchRequest]
+) -> int:
+    """Load the raw history of many requests with as few recorder calls as possible.
+
+    Each entity's windows are merged where they overlap, and entities with the
+    same merged window are fetched together into the segment cache, which the
+    requests are then answered from. Entities the buffer already covers, or
+    that will be read from statistics or digests, are skipped. Returns the number of
+    fetches made.
+    """
+    buffer: HistoryBuffer = hass.data[DOMAIN]["buffer"]
+    segments: SegmentCache = hass.data[DOMAIN]["segments"]
+    spans: defaultdict[str, list[tuple[datetime, datetime]]] = defaultdict(list)
+    for request in requests:
+        _digest_records, digests_start, history_start = _digest_history(hass, request)
+        if digests_start > request.start_time:
+            for entity_id in request.entity_ids:
+                spans[entity_id].append((request.start_time, digests_start))
+        if history_start >= request.end_time:
+            continue
+        plan = plan_history(hass, request.entity_ids, history_start, request.end_time)
+        for entity_id in plan.raw:
+            if not buffer.covers([entity_id], history_start):
+                spans[entity_id].append((history_start, request.end_time))
+
+    groups: defaultdict[tuple[datetime, datetime], list[str]] = defaultdict(list)
+    for entity_id, entity_spans in spans.items():
+        for span in _merge_spans(entity_spans):
+            groups[span].append(entity_id)
+    for (start_time, end_time), entity_ids in groups.items():
+        await segments.async_get_states(hass, entity_ids, start_time, end_time)
+    return len(groups)
+
+
+async def search_history_batch(
+    hass: HomeAssistant, conf: dict, call: ServiceCall
+) -> ServiceResponse:
+    """Handle the service call for rag_search.search_history_batch.
+
+    Every item of ``queries`` is checked against ``BATCH_QUERY_SCHEMA`` and
+    validated like a search_history call; an invalid item gets its error as
+    its result. The history of all items, including its unsettled tail, is
+    prefetched together, then the items are answered with at most
+    ``BATCH_MAX_CONCURRENCY`` in progress. Answers are not streamed, so the
+    result entity is left alone. The response lists the results in request
+    order with the time each took.
+    """
+    started = time.monotonic()
+    items: list[Mapping[str, Any]] = call.data.get(ATTR_QUERIES) or []
+    results: list[dict[str, Any] | None] = [None] * len(items)
+    requests: dict[int, SearchRequest] = {}
+    for index, data in enumerate(items):
+        try:
+            data = BATCH_QUERY_SCHEMA(data)
+        except vol.Invalid as err:
+            _LOGGER.error("Invalid batch query %d: %s", index, err)
+            results[index] = {
+                "answer": None,
+                "error": humanize_error(data, err),
+                "duration_ms": 0,
+            }
+            continue
+        try:
+            requests[index] = parse_request(
+                data,
+                conf,
+                hass.data[DOMAIN]["scope"],
+                call.context.user_id,
+                hass.data[DOMAIN]["index"],
+            )
+        except SearchError as err:
+            results[index] = {"answer": None, "error": str(err), "duration_ms": 0}
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def _answer(index: int, request: SearchRequest) -> None:
+        async with semaphore:
+            item_started = time.monotonic()
+            response = await async_answer(hass, conf, request)
+            results[index] = {
+                **response,
+                "duration_ms": round((time.monotonic() - item_started) * 1000),
+            }
+
+    segments: SegmentCache = hass.data[DOMAIN]["segments"]
+    # History too recent to be final is fetched once for the whole batch.
+    with segments.hold_unsettled():
+        fetches = await _async_prefetch(hass, list(requests.values()))
+        _LOGGER.debug(
+            "Prefetched history for %d queries in %d fetches", len(requests), fetches
+        )
+        await asyncio.gather(
+            *(_answer(index, request) for index, request in requests.items())
+        )
+    return {
+        "results": results,
+        "duration_ms": round((time.monotonic() - started) * 1000),
+    }
+
+
+async def _async_answer(
+    hass: HomeAssistant, conf: dict, request: SearchRequest, trace: QueryTrace
+) -> dict[str, Any]:
+    """Fetch the history, build the prompt and answer the query."""
+    openai_model = conf.get(CONF_OPENAI_MODEL, DEFAULT_MODEL)
+    prompt_tokens = conf.get(CONF_PROMPT_TOKENS, DEFAULT_PROMPT_TOKENS)
+    max_tokens = conf.get(CONF_MAX_TOKENS, DEFAULT_MAX_TOKENS)
+    entity_ids, start_time, end_time, query, mode, num_items, _priority, *_ = request
+
+    _LOGGER.debug(
+        "Fetching history from %s to %s for entities %s (mode %s)",
         start_time,
         end_time,
-        entity_id,
+        entity_ids,
+        mode,
+    )
+    # Relevance ranking and facts need the whole window; recency only the
+    # newest rows.
+    compress = conf.get(CONF_COMPRESS, DEFAULT_COMPRESS)
+    fetch_limit = (
+        None if mode in (MODE_RELEVANT, MODE_MAP_REDUCE, MODE_STRUCTURED) else num_items
     )
-    history_data = await get_instance(hass).async_add_executor_job(
-        history.get_significant_states, hass, start_time, end_time, [entity_id]
+    if fetch_limit is not None and compress:
+        # Compression folds many raw states into each line, so read more of
+        # the window than the number of lines we will send.
+        fetch_limit *= COMPRESS_FETCH_FACTOR
+
+    # Long windows read their finished days from the daily digests; only the
+    # rest of the window comes from the recorder.
+    digest_records, digests_start, history_start = _digest_history(hass, request)
+    if digests_start > start_time:
+        # The digest of the day the window starts in would reach back
+        # before the window, so the rest of that day is read raw.
+        head_data = await _async_get_history(
+            hass, entity_ids, start_time, digests_start, None
+        )
+        head_records = (
+            _compress_history(entity_ids, head_data, num_items, digests_start)
+            if compress
+            else [
+                Record(state.last_changed, state.entity_id, _format_state(state))
+                for state in _merge_history(entity_ids, head_data, num_items)
+            ]
+        )
+        digest_records = [*head_records, *digest_records]
+
+    # Numeric sensors over long windows are read from the statistics tables;
+    # the rest (and sensors without compiled statistics) from raw states.
+    plan = plan_history(hass, entity_ids, history_start, end_time)
+    statistics_data: Mapping[str, list] = {}
+    if plan.statistics and plan.period is not None:
+        statistics_data = await async_get_statistics(
+            hass, plan.statistics, history_start, end_time, plan.period
+        )
+    raw_ids = [e for e in entity_ids if not statistics_data.get(e)]
+    stats_ids = [e for e in entity_ids if statistics_data.get(e)]
+    history_data = (
+        await _async_get_history(
+            hass,
+            raw_ids,
+            history_start,
+            end_time,
+            fetch_limit,
+            # A session's follow-ups then only fetch what their windows add.
+            reuse=request.session_id is not None,
+        )
+        if raw_ids and history_start < end_time
+        else {}
+    )
+    _LOGGER.debug(
+        "Reading %s from states and %s from %s statistics",
+        raw_ids,
+        stats_ids,
+        plan.period,
     )
+    trace.lap(STAGE_FETCH)
 
-    history_entries = _format_history(entity_id, history_data, num_items)
-    _LOGGER.info("Collected %d history entries.", len(history_entries))
+    window_end = min(end_time, dt_util.utcnow())
+    facts: dict[str, dict[str, Any]] = {}
+    if history_start < window_end and (
+        mode == MODE_STRUCTURED or conf.get(CONF_FACTS, DEFAULT_FACTS)
+    ):
+        facts = await hass.async_add_executor_job(
+            compute_facts,
+            entity_ids,
+            history_data,
+            statistics_data,
+            history_start,
+            window_end,
+            request.threshold,
+            fetch_limit,
+        )
+    facts_entries = [
+        line
+        for entity_id, entity_facts in facts.items()
+        for line in fact_lines(entity_id, entity_facts)
+    ]
+    if mode == MODE_STRUCTURED:
+        trace.lap(STAGE_FORMAT)
+        return {
+            "answer": "\n".join(facts_entries) or "No history in the window.",
+            "error": None,
+            "facts": facts,
+            "history_items": sum(len(history_data.get(e, [])) for e in raw_ids)
+            + sum(len(statistics_data[e]) for e in stats_ids),
+            "cached": False,
+        }
 
+    # Split num_items fairly between the states and the statistics streams.
+    budgets = dict(
+        zip(
+            entity_ids,
+            _allocate_budget(
+                [
+                    len(statistics_data.get(e) or history_data.get(e, []))
+                    for e in entity_ids
+                ],
+                num_items,
+            ),
+        )
+    )
+    raw_items = sum(budgets[e] for e in raw_ids)
+
+    if mode == MODE_MAP_REDUCE:
+        return await _async_map_reduce_answer(
+            hass,
+            conf,
+            request,
+            raw_ids,
+            history_data,
+            statistics_data,
+            digest_records,
+            facts_entries,
+            window_end,
+            trace,
+        )
+    if mode == MODE_RELEVANT:
+        ranked = await hass.async_add_executor_job(
+            _select_relevant_history,
+            hass.data[DOMAIN]["embedder"],
+            raw_ids,
+            history_data,
+            query,
+            num_items,
+            window_end if compress else None,
+            list(
+                heapq.merge(
+                    digest_records,
+                    *(statistics_records(e, statistics_data[e]) for e in stats_ids),
+                    key=attrgetter("when"),
+                )
+            ),
+        )
+        history_entries = [line for line, _score in ranked]
+        priorities = [score for _line, score in ranked]
+    else:
+        if compress:
+            records = _compress_history(raw_ids, history_data, raw_items, window_end)
+        else:
+            records = [
+                Record(state.last_changed, state.entity_id, _format_state(state))
+                for state in _merge_history(raw_ids, history_data, raw_items)
+            ]
+        records = list(
+            heapq.merge(
+                digest_records,
+                records,
+                *(
+                    statistics_records(e, statistics_data[e], budgets[e])
+                    for e in stats_ids
+                ),
+                key=attrgetter("when"),
+            )
+        )
+        history_entries = [record.text for record in records]
+        priorities = recency_priorities([record.entity_id for record in records])
+    # The facts summarise the whole window, so they are packed first.
+    history_entries = facts_entries + history_entries
+    priorities = [math.inf] * len(facts_entries) + priorities
+    trace.lap(STAGE_FORMAT)
+
+    # Whatever num_items allowed, the prompt never exceeds the token budget:
+    # the most valuable lines are packed first and the rest dropped.
+    budget = prompt_budget(openai_model, prompt_tokens, max_tokens)
+    if request.session_id is not None:
+        return await _async_session_answer(
+            hass, conf, request, history_entries, priorities, budget, trace
+        )
+    built = build_prompt(history_entries, priorities, query, budget)
+    trace.lap(STAGE_PROMPT)
+    if built is None:
+        _LOGGER.error("The query does not fit the %d token prompt budget.", budget)
+        return {"answer": None, "error": "Query too long."}
+    prompt, history_entries = built
+    _LOGGER.info(
+        "Collected %d history entries (%d packed within %d tokens).",
+        len(priorities),
+        len(history_entries),
+        budget,
+    )
+
+    result: dict[str, Any] = {
+        "answer": None,
+        "error": None,
+        "history_items": len(history_entries),
+        "cached": False,
+    }
+    keys, cached = _cached_answer(hass, request, openai_model, history_entries)
+    if cached is not None:
+        return {**result, **cached}
+
+    return await _async_complete(hass, conf, request, prompt, keys, result, trace)
+
+
+async def _async_map_reduce_answer(
+    hass: HomeAssistant,
+    conf: dict,
+    request: SearchRequest,
+    raw_ids: Sequence[str],
+    history_data: Mapping,
+    statistics_data: Mapping[str, Sequence],
+    digest_records: Sequence[Record],
+    facts_entries: Sequence[str],
+    window_end: datetime,
+    trace: QueryTrace,
+) -> dict[str, Any]:
+    """Answer the query over summaries of the whole window and its facts."""
+    openai_model = conf.get(CONF_OPENAI_MODEL, DEFAULT_MODEL)
+    prompt_tokens = conf.get(CONF_PROMPT_TOKENS, DEFAULT_PROMPT_TOKENS)
+    max_tokens = conf.get(CONF_MAX_TOKENS, DEFAULT_MAX_TOKENS)
+    _entity_ids, start_time, _end_time, query, _mode, _num_items, priority, *_ = request
+
+    budget = prompt_budget(openai_model, prompt_tokens, max_tokens)
+    history_budget = budget - estimate_tokens(QUERY_PREFIX + query)
+    if history_budget < 0:
+        _LOGGER.error("The query does not fit the %d token prompt budget.", budget)
+        return {"answer": None, "error": "Query too long."}
+    chunk_budget = prompt_budget(
+        openai_model, prompt_tokens, MAP_REDUCE_SUMMARY_TOKENS
+    ) - estimate_tokens("\n\n" + SUMMARY_INSTRUCTION)
+    records = _map_reduce_records(
+        raw_ids,
+        history_data,
+        statistics_data,
+        digest_records,
+        window_end,
+        conf.get(CONF_COMPRESS, DEFAULT_COMPRESS),
+        MAP_REDUCE_MAX_CHUNKS * chunk_budget,
+    )
+    trace.lap(STAGE_FORMAT)
+
+    result: dict[str, Any] = {
+        "answer": None,
+        "error": None,
+        "history_items": len(records),
+        "cached": False,
+    }
+    keys, cached = _cached_answer(
+        hass,
+        request,
+        openai_model,
+        [*facts_entries, *(record.text for record in records)],
+    )
+    if cached is not None:
+        return {**result, **cached}
+
+    summaries = await async_map_reduce(
+        records,
+        start_time,
+        window_end,
+        chunk_budget,
+        history_budget,
+        functools.partial(
+            _call_openai,
+            hass.data[DOMAIN]["backend"],
+            openai_model,
+            max_tokens=MAP_REDUCE_SUMMARY_TOKENS,
+            scheduler=hass.data[DOMAIN]["scheduler"],
+            priority=priority,
+        ),
+        hass.data[DOMAIN]["summaries"],
+        openai_model,
+    )
+    trace.lap(STAGE_SUMMARIZE)
+    if summaries is None:
+        return {**result, "error": "Error processing the query."}
+    _LOGGER.info(
+        "Summarised %d history entries into %d summaries.",
+        len(records),
+        len(summaries),
+    )
+    lines = [*facts_entries, *summaries]
+    priorities = [math.inf] * len(facts_entries) + [0.0] * len(summaries)
     prompt = (
-        "\n".join(history_entries) + "\n\nUser Query: " + str(call.data.get("query"))
+        "\n".join(pack_lines(lines, priorities, history_budget)) + QUERY_PREFIX + query
+    )
+    trace.lap(STAGE_PROMPT)
+    return await _async_complete(hass, conf, request, prompt, keys, result, trace)
+
+
+class _AnswerKeys(NamedTuple):
+    """Where an answer is cached: for the exact question and for similar ones."""
+
+    exact: str
+    history: str
+
+
+def _cached_answer(
+    hass: HomeAssistant,
+    request: SearchRequest,
+    model: str,
+    history_lines: Sequence[str],
+) -> tuple[_AnswerKeys, dict[str, Any] | None]:
+    """Return the cache keys of a request and its cached answer, if any.
+
+    The answer cache is tried first. On a miss, the semantic cache may have
+    the answer to a differently worded question about the same history; the
+    result then also carries the similarity of the two questions.
+    """
+    keys = _AnswerKeys(
+        answer_key(
+            model,
+            request.entity_ids,
+            request.start_time,
+            request.end_time,
+            request.query,
+            history_lines,
+        ),
+        history_key(model, request.entity_ids, history_lines),
     )
+    cache: AnswerCache = hass.data[DOMAIN]["cache"]
+    if cache.enabled and (answer := cache.get(keys.exact)) is not None:
+        _LOGGER.info("Answer served from cache (%s)", cache.stats())
+        return keys, {"answer": answer, "cached": True}
+    semantic: SemanticCache = hass.data[DOMAIN]["semantic"]
+    if (
+        hit := semantic.get(
+            keys.history, request.start_time, request.end_time, request.query
+        )
+    ) is not None:
+        answer, similarity = hit
+        _LOGGER.info(
+            "Answer to a similar question (%.2f) served from cache (%s)",
+            similarity,
+            semantic.stats(),
+        )
+        return keys, {
+            "answer": answer,
+            "cached": True,
+            "cache_similarity": round(similarity, 3),
+        }
+    return keys, None
+
+
+async def _async_session_answer(
+    hass: HomeAssistant,
+    conf: dict,
+    request: SearchRequest,
+    lines: Sequence[str],
+    priorities: Sequence[float],
+    budget: int,
+    trace: QueryTrace,
+) -> dict[str, Any]:
+    """Answer one turn of a conversation.
+
+    Only the history lines the session has not sent yet go into the new
+    turn, after the unchanged messages of the earlier turns. A conversation
+    that has outgrown the budget starts over with the current history.
+    Answers depend on the earlier turns, so the answer caches are not used,
+    and turns of the same session wait for each other.
+    """
+    sessions: SessionStore = hass.data[DOMAIN]["sessions"]
+    async with sessions.lock(request.session_id):
+        session = sessions.get(request.session_id)
+        turn = (
+            session.prompt(lines, priorities, request.query, budget)
+            if session is not None
+            else None
+        )
+        if turn is None:
+            if session is not None:
+                _LOGGER.debug("Session %s is full; starting over", request.session_id)
+            session = sessions.start(request.session_id)
+            turn = session.prompt(lines, priorities, request.query, budget)
+        trace.lap(STAGE_PROMPT)
+        if turn is None:
+            _LOGGER.error("The query does not fit the %d token prompt budget.", budget)
+            return {"answer": None, "error": "Query too long."}
+        messages, packed = turn
+        _LOGGER.info(
+            "Session %s turn %d: %d new history entries of %d.",
+            request.session_id,
+            session.turns + 1,
+            len(packed),
+            len(lines),
+        )
+
+        result = await _async_complete(
+            hass,
+            conf,
+            request,
+            messages,
+            None,
+            {
+                "answer": None,
+                "error": None,
+                "history_items": len(packed),
+                "cached": False,
+                "session_id": request.session_id,
+                "session_turn": session.turns + 1,
+            },
+            trace,
+        )
+        if result["answer"] is not None:
+            session.add_turn(messages, packed, result["answer"])
+        return result
+
+
+async def _async_complete(
+    hass: HomeAssistant,
+    conf: dict,
+    request: SearchRequest,
+    prompt: str | list[Message],
+    keys: _AnswerKeys | None,
+    result: dict[str, Any],
+    trace: QueryTrace,
+) -> dict[str, Any]:
+    """Send the final prompt, cache the answer and fill in ``result``.
+
+    Without ``keys`` the answer is not cached.
+    """
     _LOGGER.debug("Generated prompt for OpenAI: %s", prompt)
+    trace.lap(None)
 
-    answer = await _call_openai(session, openai_api_key, openai_model, prompt)
+    answer = await _call_openai(
+        hass.data[DOMAIN]["backend"],
+        conf.get(CONF_OPENAI_MODEL, DEFAULT_MODEL),
+        prompt,
+        conf.get(CONF_MAX_TOKENS, DEFAULT_MAX_TOKENS),
+        PartialPublisher(hass, RESULT_ENTITY) if request.stream else None,
+        hass.data[DOMAIN]["scheduler"],
+        request.priority,
+        trace,
+    )
+    trace.lap(STAGE_LLM)
     if answer is None:
-        hass.states.async_set(RESULT_ENTITY, "Error processing the query.")
-        return
+        return {**result, "error": "Error processing the query."}
+    if keys is not None:
+        hass.data[DOMAIN]["cache"].set(keys.exact, answer)
+        hass.data[DOMAIN]["semantic"].set(
+            keys.history, request.start_time, request.end_time, request.query, answer
+        )
 
     _LOGGER.info("Received response from OpenAI: %s", answer)
-    hass.states.async_set(RESULT_ENTITY, answer)
+    return {**result, "answer": answer}
@@ -0,0 +1,267 @@
+"""Segment cache for recorder history with delta-only refetch."""
+
+from __future__ import annotations
+
+import logging
+from bisect import insort
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+from homeassistant.components.recorder import get_instance
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from .columns import StateColumns, StateVocabulary, load_columns
+from .const import SEGMENT_CACHE_MAX_STATES, SEGMENT_SETTLE_TIME
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _EntitySegments:
+    """Loaded time intervals and their states for one entity."""
+
+    __slots__ = ("columns", "intervals")
+
+    def __init__(self, entity_id: str, vocabulary: StateVocabulary) -> None:
+        # Sorted, non-overlapping (start_ts, end_ts) ranges known to be
+        # complete, and the states inside them ordered by time.
+        self.intervals: list[tuple[float, float]] = []
+        self.columns = StateColumns.empty(entity_id, vocabulary)
+
+    def missing(self, start_ts: float, end_ts: float) -> list[tuple[float, float]]:
+        """Return the sub-ranges of ``[start_ts, end_ts)`` not loaded yet."""
+        gaps: list[tuple[float, float]] = []
+        cursor = start_ts
+        for loaded_start, loaded_end in self.intervals:
+            if loaded_end <= cursor:
+                continue
+            if loaded_start >= end_ts:
+                break
+            if loaded_start > cursor:
+                gaps.append((cursor, loaded_start))
+            cursor = max(cursor, loaded_end)
+        if cursor < end_ts:
+            gaps.append((cursor, end_ts))
+        return gaps
+
+    def adjoins(self, timestamp: float) -> bool:
+        """Return True if a loaded interval ends exactly at ``timestamp``."""
+        return any(end == timestamp for _start, end in self.intervals)
+
+    def add(self, start_ts: float, end_ts: float, columns: StateColumns) -> None:
+        """Record a loaded interval and the states fetched for it."""
+        # A concurrent fetch may have loaded part of the interval meanwhile;
+        # only the states of what is still missing are new.
+        gaps = self.missing(start_ts, end_ts)
+        if not gaps:
+            return
+        cached = self.columns
+        # The vocabulary may have been compacted while the gap was loading.
+        columns = cached.vocabulary.adopt(columns)
+        keep = np.zeros(len(columns), dtype=bool)
+        for gap_start, gap_end in gaps:
+            keep |= (columns.times >= gap_start) & (columns.times < gap_end)
+        columns = columns[keep]
+        index = np.searchsorted(cached.times, columns.times, side="right")
+        cached.times = np.insert(cached.times, index, columns.times)
+        cached.codes = np.insert(cached.codes, index, columns.codes)
+        # Where intervals now join, a state stamped at the edge may be the
+        # start state of a fetch rather than a change; drop it if it repeats
+        # the state before it.
+        edges = np.isin(cached.times, [edge for gap in gaps for edge in gap])
+        repeats = edges & np.concatenate(
+            ([False], cached.codes[1:] == cached.codes[:-1])
+        )
+        if repeats.any():
+            cached.times = cached.times[~repeats]
+            cached.codes = cached.codes[~repeats]
+        for gap in gaps:
+            insort(self.intervals, gap)
+        merged: list[tuple[float, float]] = []
+        for interval in self.intervals:
+            if merged and interval[0] <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], interval[1]))
+            else:
+                merged.append(interval)
+        self.intervals = merged
+
+    def truncate(self, timestamp: float) -> None:
+        """Forget the states and intervals loaded from ``timestamp`` onward."""
+        self.columns = self.columns[self.columns.times < timestamp]
+        self.intervals = [
+            (start, min(end, timestamp))
+            for start, end in self.intervals
+            if start < timestamp
+        ]
+
+    def window(self, start_time: datetime, end_time: datetime) -> StateColumns:
+        """Return the states in a loaded window, plus the state at its start."""
+        cached = self.columns
+        start_ts = start_time.timestamp()
+        first = int(np.searchsorted(cached.times, start_ts, side="right"))
+        last = int(np.searchsorted(cached.times, end_time.timestamp(), side="left"))
+        window = cached[first:last]
+        if first > 0 and any(s <= start_ts < e for s, e in self.intervals):
+            # The state in effect when the window opens, as the recorder's
+            # include_start_time_state would report it.
+            window = StateColumns(
+                cached.entity_id,
+                np.insert(window.times, 0, start_ts),
+                np.insert(window.codes, 0, cached.codes[first - 1]),
+                cached.vocabulary,
+            )
+        return window
+
+
+class SegmentCache:
+    """Per-entity cache of recorder history, refetching only what is missing.
+
+    Repeated and overlapping windows (a sliding "last 24 hours", say) cost a
+    small delta query instead of a full refetch. States are loaded with the
+    lean columnar loader and kept as columns sharing one vocabulary, about 12
+    bytes per state. The cache is bounded by the total number of states and
+    evicts whole entities, least recently used first.
+    """
+
+    def __init__(self, max_states: int = SEGMENT_CACHE_MAX_STATES) -> None:
+        """Initialize an empty cache."""
+        self._max_states = max_states
+        self._entities: OrderedDict[str, _EntitySegments] = OrderedDict()
+        self._vocabulary = StateVocabulary()
+        # While held, the unsettled tail is cached too; this maps each entity
+        # to where its cached tail starts, so it can be dropped on release.
+        self._holds = 0
+        self._unsettled_from: dict[str, float] = {}
+
+    @property
+    def state_count(self) -> int:
+        """Return the number of cached states across all entities."""
+        return sum(len(segments.columns) for segments in self._entities.values())
+
+    def covers(
+        self, entity_ids: Sequence[str], start_time: datetime, end_time: datetime
+    ) -> bool:
+        """Return True if the whole window is already loaded for every entity."""
+        start_ts, end_ts = start_time.timestamp(), end_time.timestamp()
+        return all(
+            entity_id in self._entities
+            and not self._entities[entity_id].missing(start_ts, end_ts)
+            for entity_id in entity_ids
+        )
+
+    @contextmanager
+    def hold_unsettled(self) -> Iterator[None]:
+        """Cache the unsettled tail as well until the block exits.
+
+        A batch of searches ending now would otherwise fetch the tail again
+        for every search. The tail is dropped once the last hold is released,
+        so later calls see what the recorder has committed since.
+        """
+        self._holds += 1
+        try:
+            yield
+        finally:
+            self._holds -= 1
+            if not self._holds:
+                unsettled_from, self._unsettled_from = self._unsettled_from, {}
+                for entity_id, timestamp in unsettled_from.items():
+                    if (segments := self._entities.get(entity_id)) is not None:
+                        segments.truncate(timestamp)
+
+    async def async_get_states(
+        self,
+        hass: HomeAssistant,
+        entity_ids: Sequence[str],
+        start_time: datetime,
+        end_time: datetime,
+    ) -> dict[str, StateColumns]:
+        """Return the window's history, fetching only the missing sub-ranges.
+
+        Entities missing the same sub-range share one ``load_columns`` call.
+        The part of the window that is too recent to be final (the
+        recorder may not have committed it yet) is returned but not cached, so
+        it is fetched again next time, unless the cache is held with
+        ``hold_unsettled``.
+        """
+        settled_ts = (dt_util.utcnow() - SEGMENT_SETTLE_TIME).timestamp()
+        start_ts = start_time.timestamp()
+        end_ts = end_time.timestamp()
+
+        requests: defaultdict[tuple[float, float, bool], list[str]] = defaultdict(list)
+        unsettled: defaultdict[str, list[StateColumns]] = defaultdict(list)
+        vocabulary = self._vocabulary
+        # A concurrent call may evict these entities while a fetch is awaited;
+        # keep hold of them so this window is still answered in full.
+        entities: dict[str, _EntitySegments] = {}
+        for entity_id in entity_ids:
+            if (segments := self._entities.get(entity_id)) is None:
+                segments = self._entities[entity_id] = _EntitySegments(
+                    entity_id, vocabulary
+                )
+            self._entities.move_to_end(entity_id)
+            entities[entity_id] = segments
+            for gap_start, gap_end in segments.missing(start_ts, end_ts):
+                # The state at the start of a gap is already cached when the gap
+                # continues a loaded interval.
+                include_start = not segments.adjoins(gap_start)
+                requests[(gap_start, gap_end, include_start)].append(entity_id)
+
+        for (gap_start, gap_end, include_start), gap_entities in requests.items():
+            _LOGGER.debug(
+                "Fetching %s to %s for %s",
+                dt_util.utc_from_timestamp(gap_start),
+                dt_util.utc_from_timestamp(gap_end),
+                gap_entities,
+            )
+            history_data = await get_instance(hass).async_add_executor_job(
+                load_columns,
+                hass,
+                dt_util.utc_from_timestamp(gap_start),
+                dt_util.utc_from_timestamp(gap_end),
+                gap_entities,
+                vocabulary,
+                include_start,
+            )
+            loaded_end = min(gap_end, max(gap_start, settled_ts))
+            if self._holds and loaded_end < gap_end:
+                for entity_id in gap_entities:
+                    self._unsettled_from[entity_id] = min(
+                        loaded_end, self._unsettled_from.get(entity_id, loaded_end)
+                    )
+                loaded_end = gap_end
+            for entity_id in gap_entities:
+                columns = history_data.get(entity_id) or StateColumns.empty(
+                    entity_id, vocabulary
+                )
+                settled = columns.times < loaded_end
+                entities[entity_id].add(gap_start, loaded_end, columns[settled])
+                unsettled[entity_id].append(columns[~settled])
+
+        result = {
+            entity_id: StateColumns.concat(
+                entity_id,
+                [
+                    entities[entity_id].window(start_time, end_time),
+                    *unsettled.get(entity_id, []),
+                ],
+                self._vocabulary,
+            )
+            for entity_id in entity_ids
+        }
+        self._evict()
+        return result
+
+    def _evict(self) -> None:
+        total = self.state_count
+        while total > self._max_states and self._entities:
+            _entity_id, segments = self._entities.popitem(last=False)
+            total -= len(segments.columns)
+        # Numeric sensors intern a new string for almost every reading; start
+        # a fresh vocabulary once most of the strings are no longer cached.
+        if len(self._vocabulary) > max(2 * total, self._max_states):
+            self._vocabulary = self._vocabulary.compact(
+                segments.columns for segments in self._entities.values()
+            )
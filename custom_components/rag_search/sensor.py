@@ -0,0 +1,245 @@
+"""Sensors for the query metrics and the scheduled queries of RAG Search."""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import MAX_LENGTH_STATE_STATE, EntityCategory, UnitOfTime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.device_registry import DeviceEntryType, DeviceInfo
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import (
+    DOMAIN,
+    SIGNAL_METRICS_UPDATED,
+    SIGNAL_SCHEDULED_UPDATED,
+    STAGE_FETCH,
+    STAGE_FORMAT,
+    STAGE_LLM,
+    STAGE_LLM_FIRST_BYTE,
+    STAGE_PROMPT,
+    STAGE_SUMMARIZE,
+    STAGE_TOTAL,
+    STAGE_VALIDATION,
+)
+from .metrics import QueryMetrics, RollingHistogram
+from .scheduled import ScheduledQueries, ScheduledQuery
+
+
+@dataclass(frozen=True, kw_only=True)
+class MetricSensorDescription(SensorEntityDescription):
+    """A sensor showing the median of one histogram of the query metrics."""
+
+    histogram: Callable[[QueryMetrics], RollingHistogram]
+    # The summary value used as state.
+    statistic: str = "p50"
+
+
+def _stage(stage: str) -> Callable[[QueryMetrics], RollingHistogram]:
+    return lambda metrics: metrics.stages[stage]
+
+
+def _duration(key: str, stage: str) -> MetricSensorDescription:
+    return MetricSensorDescription(
+        key=key,
+        translation_key=key,
+        histogram=_stage(stage),
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        suggested_display_precision=0,
+    )
+
+
+def _tokens(key: str) -> MetricSensorDescription:
+    return MetricSensorDescription(
+        key=key,
+        translation_key=key,
+        histogram=lambda metrics: metrics.tokens[key],
+        native_unit_of_measurement="tokens",
+        suggested_display_precision=0,
+    )
+
+
+SENSORS: tuple[MetricSensorDescription, ...] = (
+    _duration("query_latency", STAGE_TOTAL),
+    _duration("validation_time", STAGE_VALIDATION),
+    _duration("recorder_fetch_time", STAGE_FETCH),
+    _duration("formatting_time", STAGE_FORMAT),
+    _duration("summarize_time", STAGE_SUMMARIZE),
+    _duration("prompt_build_time", STAGE_PROMPT),
+    _duration("llm_first_byte", STAGE_LLM_FIRST_BYTE),
+    _duration("llm_time", STAGE_LLM),
+    MetricSensorDescription(
+        key="llm_retries",
+        translation_key="llm_retries",
+        histogram=lambda metrics: metrics.retries,
+        statistic="mean",
+        suggested_display_precision=2,
+    ),
+    _tokens("prompt_tokens"),
+    _tokens("completion_tokens"),
+    _tokens("cached_tokens"),
+)
+
+
+async def async_setup_entry(
+    hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback
+) -> None:
+    """Set up the metric sensors and one sensor per scheduled query."""
+    metrics: QueryMetrics = hass.data[DOMAIN]["metrics"]
+    scheduled: ScheduledQueries = hass.data[DOMAIN]["scheduled"]
+    async_add_entities(
+        [QueryCountSensor(entry, metrics)]
+        + [MetricSensor(entry, metrics, description) for description in SENSORS]
+        + [ScheduledQuerySensor(entry, scheduled, query) for query in scheduled.queries]
+    )
+
+
+def _device_info(entry: ConfigEntry) -> DeviceInfo:
+    return DeviceInfo(
+        identifiers={(DOMAIN, entry.entry_id)},
+        name=entry.title,
+        entry_type=DeviceEntryType.SERVICE,
+    )
+
+
+class _MetricsEntity(SensorEntity):
+    """Base of the metric sensors: one device per entry, pushed updates."""
+
+    _attr_has_entity_name = True
+    _attr_should_poll = False
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, entry: ConfigEntry, metrics: QueryMetrics, key: str) -> None:
+        """Initialize the sensor."""
+        self._metrics = metrics
+        self._attr_unique_id = f"{entry.entry_id}_{key}"
+        self._attr_device_info = _device_info(entry)
+
+    async def async_added_to_hass(self) -> None:
+        """Refresh whenever a query is recorded."""
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, SIGNAL_METRICS_UPDATED, self.async_write_ha_state
+            )
+        )
+
+
+class MetricSensor(_MetricsEntity):
+    """One histogram: its median (or mean) as state, the rest as attributes."""
+
+    entity_description: MetricSensorDescription
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(
+        self,
+        entry: ConfigEntry,
+        metrics: QueryMetrics,
+        description: MetricSensorDescription,
+    ) -> None:
+        """Initialize the sensor."""
+        super().__init__(entry, metrics, description.key)
+        self.entity_description = description
+
+    @property
+    def native_value(self) -> float | None:
+        """Return the statistic over the recent queries."""
+        return self.entity_description.histogram(self._metrics).summary()[
+            self.entity_description.statistic
+        ]
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the percentiles, count and bucket counts."""
+        return self.entity_description.histogram(self._metrics).summary()
+
+
+class QueryCountSensor(_MetricsEntity):
+    """The number of queries answered, failed, cached and shared."""
+
+    _attr_translation_key = "queries"
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    def __init__(self, entry: ConfigEntry, metrics: QueryMetrics) -> None:
+        """Initialize the sensor."""
+        super().__init__(entry, metrics, "queries")
+
+    @property
+    def native_value(self) -> int:
+        """Return the number of queries since start-up."""
+        return self._metrics.queries
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return how the queries ended."""
+        return {
+            "failed": self._metrics.failed,
+            "cached": self._metrics.cached,
+            "semantic_cached": self._metrics.semantic_cached,
+            "shared": self._metrics.shared,
+        }
+
+
+class ScheduledQuerySensor(SensorEntity):
+    """The latest answer to a scheduled query, and when it was answered."""
+
+    _attr_has_entity_name = True
+    _attr_should_poll = False
+
+    def __init__(
+        self, entry: ConfigEntry, scheduled: ScheduledQueries, query: ScheduledQuery
+    ) -> None:
+        """Initialize the sensor."""
+        self._scheduled = scheduled
+        self._query = query
+        self._attr_name = query.name
+        self._attr_unique_id = f"{entry.entry_id}_scheduled_{query.key}"
+        self._attr_device_info = _device_info(entry)
+
+    @property
+    def native_value(self) -> str | None:
+        """Return the answer, cut to the length of a state."""
+        result = self._scheduled.results.get(self._query.key, {})
+        if (answer := result.get("answer")) is None:
+            return None
+        return answer[:MAX_LENGTH_STATE_STATE]
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the whole answer, its freshness and the query."""
+        result = self._scheduled.results.get(self._query.key, {})
+        next_run = self._scheduled.next_runs.get(self._query.key)
+        return {
+            "answer": result.get("answer"),
+            "answered_at": result.get("answered_at"),
+            "error": result.get("error"),
+            "start_time": result.get("start_time"),
+            "end_time": result.get("end_time"),
+            "next_run": next_run.isoformat() if next_run else None,
+            "query": self._query.query,
+            "entity_ids": self._query.entity_ids,
+        }
+
+    async def async_added_to_hass(self) -> None:
+        """Refresh whenever the query is answered."""
+
+        @callback
+        def _async_updated(key: str) -> None:
+            if key == self._query.key:
+                self.async_write_ha_state()
+
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, SIGNAL_SCHEDULED_UPDATED, _async_updated
+            )
+        )
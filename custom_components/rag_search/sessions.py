@@ -0,0 +1,136 @@
+"""Conversational sessions that resend only what the model has not seen."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from weakref import WeakValueDictionary
+
+from .const import SESSION_IDLE_TIMEOUT, SESSION_MAX_SESSIONS, SESSION_MESSAGE_TOKENS
+from .prompt import build_prompt, estimate_tokens
+
+SYSTEM_PROMPT = (
+    "You answer questions about the recorded history of Home Assistant "
+    "entities. Each user message gives the history lines not shown before, "
+    "then the question. Earlier lines and answers still apply."
+)
+
+Message = dict[str, str]
+
+
+class Session:
+    """The messages of one conversation, only ever appended to.
+
+    A stable system message comes first, then every turn: the history lines
+    not sent before with the question, and the answer. Each prompt extends
+    the previous one, so providers that cache prompt prefixes serve the
+    earlier turns as cached input tokens.
+    """
+
+    __slots__ = ("_sent", "last_used", "messages", "tokens", "turns")
+
+    def __init__(self) -> None:
+        """Start a conversation with only the system message."""
+        self.messages: list[Message] = [{"role": "system", "content": SYSTEM_PROMPT}]
+        self.tokens = estimate_tokens(SYSTEM_PROMPT) + SESSION_MESSAGE_TOKENS
+        self.turns = 0
+        self.last_used = time.monotonic()
+        # History lines already in the messages.
+        self._sent: set[str] = set()
+
+    def prompt(
+        self,
+        lines: Sequence[str],
+        priorities: Sequence[float],
+        query: str,
+        budget: int,
+    ) -> tuple[list[Message], list[str]] | None:
+        """Return the messages of the next turn and the new lines they carry.
+
+        Lines already sent are left out and the new ones are packed into what
+        the conversation leaves of ``budget``. Returns ``None`` when the
+        question does not fit, or when a follow-up cannot carry all of its
+        new lines; the conversation is then full.
+        """
+        fresh = [index for index, line in enumerate(lines) if line not in self._sent]
+        built = build_prompt(
+            [lines[index] for index in fresh],
+            [priorities[index] for index in fresh],
+            query,
+            budget - self.tokens - 2 * SESSION_MESSAGE_TOKENS,
+        )
+        if built is None or (self.turns and len(built[1]) < len(fresh)):
+            return None
+        content, packed = built
+        return [*self.messages, {"role": "user", "content": content}], packed
+
+    def add_turn(
+        self, messages: list[Message], packed: Sequence[str], answer: str
+    ) -> None:
+        """Keep a turn returned by ``prompt`` and its answer."""
+        for message in messages[len(self.messages) :]:
+            self.tokens += estimate_tokens(message["content"]) + SESSION_MESSAGE_TOKENS
+        self.messages = [*messages, {"role": "assistant", "content": answer}]
+        self.tokens += estimate_tokens(answer) + SESSION_MESSAGE_TOKENS
+        self._sent.update(packed)
+        self.turns += 1
+
+
+class SessionStore:
+    """Sessions by id, dropped when idle and bounded in number.
+
+    A session expires ``idle_timeout`` seconds after its last use; beyond
+    ``max_sessions`` the least recently used is dropped. Each session is
+    bounded by the prompt budget, so the whole store is too. Nothing is
+    persisted.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+    ) -> None:
+        """Initialize without sessions."""
+        self._idle_timeout = idle_timeout
+        self._max_sessions = max_sessions
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        # A lock lives only while a turn holds or waits on it.
+        self._locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+
+    def __len__(self) -> int:
+        """Return the number of live sessions."""
+        self._expire()
+        return len(self._sessions)
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self._idle_timeout
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used > cutoff:
+                break
+            del self._sessions[session_id]
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """Return the lock that serialises the turns of ``session_id``."""
+        if (lock := self._locks.get(session_id)) is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    def get(self, session_id: str) -> Session | None:
+        """Return a live session and mark it used."""
+        self._expire()
+        if (session := self._sessions.get(session_id)) is not None:
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def start(self, session_id: str) -> Session:
+        """Start a session under ``session_id``, replacing any previous one."""
+        self._expire()
+        session = self._sessions[session_id] = Session()
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self._max_sessions:
+            self._sessions.popitem(last=False)
+        return session
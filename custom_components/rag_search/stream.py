@@ -0,0 +1,92 @@
+"""Streaming chat completions: SSE parsing and partial answer publishing."""
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+from collections.abc import AsyncIterator, Callable, Mapping
+from typing import Any
+
+import aiohttp
+from homeassistant.core import HomeAssistant, callback
+
+from .const import EVENT_PARTIAL_RESULT, STREAM_PUBLISH_CHUNKS, STREAM_PUBLISH_INTERVAL
+
+_LOGGER = logging.getLogger(__name__)
+
+# Called with each new piece of the answer and the answer so far.
+DeltaCallback = Callable[[str, str], None]
+
+
+async def iter_content_deltas(
+    response: aiohttp.ClientResponse,
+    on_usage: Callable[[Mapping[str, Any]], None] | None = None,
+) -> AsyncIterator[str]:
+    """Yield the content deltas of a streamed chat completion.
+
+    Reads the ``text/event-stream`` body line by line; each ``data:`` line is
+    one JSON chunk and ``data: [DONE]`` ends the stream. Lines that are not
+    data (comments, keep-alives, event names) are skipped. Servers that
+    report token ``usage`` in a chunk have it passed to ``on_usage``.
+    """
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            return
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            _LOGGER.debug("Skipping malformed stream chunk: %s", data)
+            continue
+        if on_usage is not None and chunk.get("usage"):
+            on_usage(chunk["usage"])
+        choices = chunk.get("choices") or []
+        if choices and (delta := (choices[0].get("delta") or {}).get("content")):
+            yield delta
+
+
+class PartialPublisher:
+    """Publish a streaming answer as it arrives.
+
+    Every chunk fires an ``EVENT_PARTIAL_RESULT`` event. The result entity is
+    written at most every ``interval`` seconds or ``chunks`` chunks, whichever
+    comes first, so a fast stream does not flood the state machine.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entity_id: str,
+        interval: float = STREAM_PUBLISH_INTERVAL,
+        chunks: int = STREAM_PUBLISH_CHUNKS,
+    ) -> None:
+        """Initialize the publisher."""
+        self._hass = hass
+        self._entity_id = entity_id
+        self._interval = interval
+        self._chunks = chunks
+        self._pending = 0
+        self._last_publish: float | None = None
+
+    @callback
+    def __call__(self, delta: str, text: str) -> None:
+        """Handle one chunk of the answer."""
+        self._hass.bus.async_fire(
+            EVENT_PARTIAL_RESULT,
+            {"entity_id": self._entity_id, "delta": delta, "answer": text},
+        )
+        self._pending += 1
+        now = time.monotonic()
+        if (
+            self._last_publish is not None
+            and self._pending < self._chunks
+            and now - self._last_publish < self._interval
+        ):
+            return
+        self._pending = 0
+        self._last_publish = now
+        self._hass.states.async_set(self._entity_id, text, {"streaming": True})
@@ -28,7 +28,7 @@ def config_entry() -> MockConfigEntry:
         data={
             CONF_OPENAI_API_KEY: "fake_api_key",
             CONF_OPENAI_MODEL: "gpt-4o-mini",
-            CONF_ENTITY_SCOPE: ["sensor.temperature"],
+            CONF_ENTITY_SCOPE: ["sensor.temperature", "binary_sensor.kitchen_motion"],
             CONF_MAX_ITEMS: 50,
         },
     )
@@ -0,0 +1,95 @@
+"""Tests for the locally computed history facts."""
+
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from homeassistant.core import State
+
+from custom_components.rag_search.analytics import (
+    analyze_states,
+    analyze_statistics,
+    fact_lines,
+)
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+END = START + timedelta(hours=4)
+
+
+def _states(entity_id: str, *changes: tuple[float, str]) -> list[State]:
+    return [
+        State(entity_id, value, last_changed=START + timedelta(hours=hours))
+        for hours, value in changes
+    ]
+
+
+def test_numeric_facts():
+    """Extremes, means, percentiles and threshold crossings of a numeric series."""
+    states = _states(
+        "sensor.t", (0, "20"), (1, "30"), (1.5, "unavailable"), (2, "10"), (3, "30")
+    )
+
+    facts = analyze_states(states, START, END, threshold=25)
+
+    assert facts["readings"] == 4
+    assert facts["min"] == {"value": 10, "at": "2024-10-01T02:00:00+00:00"}
+    assert facts["max"] == {"value": 30, "at": "2024-10-01T01:00:00+00:00"}
+    assert facts["mean"] == 22.5
+    # 20 for 1h, 30 for 30m, 10 for 1h and 30 for 1h, over 3.5h with data.
+    assert facts["time_weighted_mean"] == pytest.approx(75 / 3.5, abs=1e-3)
+    assert facts["percentiles"]["p50"] == 25
+    assert facts["threshold"] == {
+        "value": 25,
+        "above_seconds": 5400,
+        "crossed_above": 2,
+        "crossed_below": 1,
+    }
+    assert facts["gaps"] == {"count": 1, "seconds": 1800, "longest": 1800}
+    assert fact_lines("sensor.t", facts)[0].startswith(
+        "sensor.t from 2024-10-01T00:00:00+00:00 to 2024-10-01T04:00:00+00:00: "
+        "4 readings, min 10 at 2024-10-01T02:00:00+00:00"
+    )
+
+
+def test_time_in_state_and_entries():
+    """Entries and time in each state; the state at the window start is no change."""
+    states = _states(
+        "binary_sensor.door", (0, "off"), (1, "on"), (1.25, "off"), (3, "on")
+    )
+
+    facts = analyze_states(states, START, END)
+
+    assert facts["changes"] == 3
+    assert facts["entered"] == {"off": 1, "on": 2}
+    assert facts["time_in_state"] == {"off": 9900, "on": 4500}
+    assert facts["last"] == {"state": "on", "since": "2024-10-01T03:00:00+00:00"}
+    assert "gaps" not in facts
+    assert fact_lines("binary_sensor.door", facts)[0].endswith(
+        "3 changes; off 1 times for 2h 45m, on 2 times for 1h 15m; "
+        "on since 2024-10-01T03:00:00+00:00"
+    )
+
+
+def test_missing_start_and_empty_window():
+    """Time before the first state counts as a gap; no states is all gap."""
+    late = analyze_states(_states("sensor.t", (1, "5")), START, END)
+    assert late["gaps"] == {"count": 1, "seconds": 3600, "longest": 3600}
+
+    empty = analyze_states([], START, END)
+    assert empty["states"] == 0
+    assert fact_lines("sensor.t", empty)[0].endswith(
+        "no readings; without data 1 times for 4h"
+    )
+
+
+def test_statistics_facts():
+    """Statistics rows give the extremes and the mean of the window."""
+    rows = [
+        {"start": START.timestamp(), "mean": 20.0, "min": 18.0, "max": 22.0},
+        {"start": START.timestamp() + 3600, "mean": 24.0, "min": 21.0, "max": 28.0},
+    ]
+
+    facts = analyze_statistics(rows, START, END)
+
+    assert facts["min"] == {"value": 18, "at": "2024-10-01T00:00:00+00:00"}
+    assert facts["max"] == {"value": 28, "at": "2024-10-01T01:00:00+00:00"}
+    assert facts["time_weighted_mean"] == 22
@@ -0,0 +1,137 @@
+"""Tests for the OpenAI-compatible backend and its connection pool."""
+
+from unittest.mock import AsyncMock, patch
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aioresponses import aioresponses
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import HomeAssistant
+
+from custom_components.rag_search.backend import (
+    CannotConnect,
+    InvalidAuth,
+    OpenAIBackend,
+    async_create_dedicated_session,
+)
+from custom_components.rag_search.const import (
+    CONF_BASE_URL,
+    CONF_DEDICATED_CONNECTOR,
+    CONNECTOR_LIMIT_PER_HOST,
+    DOMAIN,
+    RESULT_ENTITY,
+    SERVICE_SEARCH_HISTORY,
+)
+
+
+def test_urls_and_headers():
+    """Endpoints hang off the base URL; no key means no Authorization."""
+    backend = OpenAIBackend(None, None, "http://llm.local:8000/v1/")
+    assert backend.chat_url == "http://llm.local:8000/v1/chat/completions"
+    assert backend.models_url == "http://llm.local:8000/v1/models"
+    assert "Authorization" not in backend.headers
+    assert OpenAIBackend(None, "sk").headers["Authorization"] == "Bearer sk"
+
+
+async def test_validate():
+    """Rejected keys and unreachable servers raise distinct errors."""
+    async with aiohttp.ClientSession() as session:
+        backend = OpenAIBackend(session, "sk", "http://llm.local/v1")
+        with aioresponses() as mocked:
+            mocked.get(backend.models_url, status=401)
+            with pytest.raises(InvalidAuth):
+                await backend.async_validate()
+            mocked.get(backend.models_url, status=502)
+            with pytest.raises(CannotConnect):
+                await backend.async_validate()
+
+
+@pytest.fixture
+async def models_server(socket_enabled):
+    """Serve a fake /v1/models endpoint on localhost, counting connections."""
+    peers: list = []
+
+    async def _models(request: web.Request) -> web.Response:
+        peers.append(request.transport.get_extra_info("peername"))
+        return web.json_response({"data": []})
+
+    app = web.Application()
+    app.router.add_get("/v1/models", _models)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    yield str(server.make_url("/v1")), peers
+    await server.close()
+
+
+async def test_dedicated_session_reuses_warm_connection(
+    hass: HomeAssistant, models_server
+):
+    """The warm-up connection is kept alive and reused by the next request."""
+    base_url, peers = models_server
+    session, cancel_close = async_create_dedicated_session(hass)
+    assert session.connector.limit_per_host == CONNECTOR_LIMIT_PER_HOST
+    backend = OpenAIBackend(session, None, base_url)
+
+    await backend.async_warm_up()
+    await backend.async_validate()
+
+    assert len(peers) == 2
+    assert peers[0] == peers[1]
+    cancel_close()
+    await session.close()
+
+
+async def test_dedicated_session_closed_with_home_assistant(hass: HomeAssistant):
+    """Home Assistant shutting down closes the dedicated session."""
+    session, _cancel_close = async_create_dedicated_session(hass)
+    hass.bus.async_fire(EVENT_HOMEASSISTANT_CLOSE)
+    await hass.async_block_till_done()
+    assert session.closed
+
+
+async def test_queries_go_to_configured_backend(hass: HomeAssistant, config_entry):
+    """With a base URL and a dedicated pool, queries reach that server."""
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(
+        config_entry,
+        options={
+            CONF_BASE_URL: "http://llm.local/v1",
+            CONF_DEDICATED_CONNECTOR: True,
+        },
+    )
+    with aioresponses() as mocked, patch(
+        "custom_components.rag_search.search._async_get_history",
+        AsyncMock(return_value={}),
+    ):
+        mocked.get("http://llm.local/v1/models", status=200, payload={})
+        mocked.post(
+            "http://llm.local/v1/chat/completions",
+            status=200,
+            payload={"choices": [{"message": {"content": "Local"}}]},
+        )
+        await hass.config_entries.async_setup(config_entry.entry_id)
+        await hass.async_block_till_done()
+        backend = hass.data[DOMAIN]["backend"]
+        session = backend.session
+        assert len(mocked.requests) == 1  # the warm-up
+
+        await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            {
+                "entity_id": "sensor.temperature",
+                "start_time": "2024-10-01T00:00:00Z",
+                "end_time": "2024-10-01T01:00:00Z",
+                "query": "Where am I answered?",
+            },
+            blocking=True,
+        )
+
+    assert hass.states.get(RESULT_ENTITY).state == "Local"
+    assert backend.chat_url == "http://llm.local/v1/chat/completions"
+
+    await hass.config_entries.async_unload(config_entry.entry_id)
+    await hass.async_block_till_done()
+    assert session.closed
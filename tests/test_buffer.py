@@ -0,0 +1,126 @@
+"""Tests for the in-memory history buffer."""
+
+from datetime import UTC, datetime, timedelta
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.rag_search.buffer import HistoryBuffer
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+
+
+def _at(minute: int) -> datetime:
+    return START + timedelta(minutes=minute)
+
+
+def test_window_includes_state_at_start():
+    """The state in effect when the window opens is reported at its start."""
+    buffer = HistoryBuffer(["sensor.power"])
+    for minute in range(5):
+        buffer.add("sensor.power", str(minute), _at(minute))
+
+    states = buffer.get_states(["sensor.power"], _at(1) + timedelta(seconds=30), _at(4))
+
+    assert [s.state for s in states["sensor.power"]] == ["1", "2", "3"]
+    assert states["sensor.power"][0].last_changed == _at(1) + timedelta(seconds=30)
+
+
+def test_window_limit_keeps_newest():
+    """A limit keeps the newest states in the window."""
+    buffer = HistoryBuffer(["sensor.power"])
+    for minute in range(10):
+        buffer.add("sensor.power", str(minute), _at(minute))
+
+    states = buffer.get_states(["sensor.power"], START, _at(10), limit=3)
+
+    assert [s.state for s in states["sensor.power"]] == ["7", "8", "9"]
+
+
+def test_eviction_moves_coverage_forward():
+    """Once the ring is full, coverage starts at the oldest retained state."""
+    buffer = HistoryBuffer(["sensor.power"], capacity=3)
+    for minute in range(5):
+        buffer.add("sensor.power", str(minute), _at(minute))
+
+    assert not buffer.covers(["sensor.power"], _at(1))
+    assert buffer.covers(["sensor.power"], _at(2))
+    states = buffer.get_states(["sensor.power"], _at(2), _at(10))
+    assert [s.state for s in states["sensor.power"]] == ["2", "3", "4"]
+
+
+def test_rings_grow_with_their_states():
+    """A ring only holds the states appended so far, up to its capacity."""
+    buffer = HistoryBuffer(["sensor.power", "sensor.idle"], capacity=10_000)
+    for minute in range(5):
+        buffer.add("sensor.power", str(minute), _at(minute))
+
+    assert len(buffer._rings["sensor.power"]._times) == 5
+    assert len(buffer._rings["sensor.idle"]._times) == 0
+
+
+def test_unknown_and_out_of_order_states_ignored():
+    """States for unbuffered entities or older than the newest are dropped."""
+    buffer = HistoryBuffer(["sensor.power"])
+    buffer.add("sensor.power", "2", _at(2))
+    buffer.add("sensor.power", "1", _at(1))
+    buffer.add("sensor.other", "1", _at(3))
+
+    assert not buffer.covers(["sensor.other"], _at(0))
+    states = buffer.get_states(["sensor.power"], START, _at(10))
+    assert [s.state for s in states["sensor.power"]] == ["2"]
+
+
+def test_compaction_keeps_live_values():
+    """Evicted numeric values are dropped from the intern table."""
+    buffer = HistoryBuffer(["sensor.power"], capacity=10)
+    for second in range(10_000):
+        buffer.add("sensor.power", str(second), START + timedelta(seconds=second))
+
+    assert len(buffer._values) < 5000
+    states = buffer.get_states(["sensor.power"], START, _at(1000))
+    assert [s.state for s in states["sensor.power"]] == [
+        str(second) for second in range(9990, 10_000)
+    ]
+
+
+async def test_listener_follows_state_changes(hass: HomeAssistant):
+    """The buffer is seeded from current states and follows changes."""
+    hass.states.async_set("binary_sensor.door", "off")
+    buffer = HistoryBuffer(["binary_sensor.door"])
+    unsub = buffer.async_start(hass)
+    seeded = hass.states.get("binary_sensor.door").last_changed
+
+    hass.states.async_set("binary_sensor.door", "on")
+    hass.states.async_set("binary_sensor.door", "on", {"battery": 50})
+    hass.states.async_set("sensor.unrelated", "1")
+    await hass.async_block_till_done()
+    unsub()
+    hass.states.async_set("binary_sensor.door", "off")
+    await hass.async_block_till_done()
+
+    assert buffer.covers(["binary_sensor.door"], seeded)
+    assert not buffer.covers(["binary_sensor.door"], seeded - timedelta(seconds=1))
+    states = buffer.get_states(
+        ["binary_sensor.door"], seeded, seeded + timedelta(hours=1)
+    )
+    assert [s.state for s in states["binary_sensor.door"]] == ["off", "on"]
+
+
+async def test_entities_follow_scope(hass: HomeAssistant):
+    """Entities joining the scope are seeded and followed; others dropped."""
+    hass.states.async_set("sensor.power", "1")
+    hass.states.async_set("sensor.energy", "5")
+    buffer = HistoryBuffer(["sensor.power"])
+    stop = buffer.async_start(hass)
+
+    buffer.async_set_entities(["sensor.energy"])
+    hass.states.async_set("sensor.energy", "6")
+    hass.states.async_set("sensor.power", "2")
+    await hass.async_block_till_done()
+    stop()
+
+    states = buffer.get_states(
+        ["sensor.power", "sensor.energy"], START, datetime.now(UTC)
+    )
+    assert list(states) == ["sensor.energy"]
+    assert [s.state for s in states["sensor.energy"]] == ["5", "6"]
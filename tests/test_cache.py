@@ -0,0 +1,209 @@
+"""Tests for the answer cache and the semantic cache."""
+
+import asyncio
+import gc
+from datetime import UTC, datetime
+from typing import Any
+from unittest.mock import patch
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.rag_search.cache import (
+    AnswerCache,
+    SemanticCache,
+    SingleFlight,
+    answer_key,
+)
+from custom_components.rag_search.const import CACHE_STORAGE_KEY
+from custom_components.rag_search.retrieval import HashingEmbedder
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+END = datetime(2024, 10, 2, tzinfo=UTC)
+
+
+def _key(query: str = "What was the state?", lines=("a", "b"), entities=None):
+    return answer_key(
+        "gpt-4o-mini",
+        entities or ["sensor.a", "sensor.b"],
+        START,
+        END,
+        query,
+        lines,
+    )
+
+
+def test_key_normalises_query_and_entity_order():
+    """Case, spacing, trailing punctuation and entity order do not matter."""
+    assert _key("What was  the state?") == _key("what was the state")
+    assert _key(entities=["sensor.b", "sensor.a"]) == _key()
+
+
+def test_key_changes_with_history():
+    """New history produces a new key, so stale answers are not reused."""
+    assert _key(lines=("a", "b")) != _key(lines=("a", "b", "c"))
+
+
+async def test_hit_miss_and_lru_eviction(hass: HomeAssistant):
+    """The least recently used entry is evicted first."""
+    cache = AnswerCache(hass, ttl=60, max_entries=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2}
+
+
+async def test_entries_expire(hass: HomeAssistant):
+    """Entries are not served after their TTL."""
+    cache = AnswerCache(hass, ttl=60)
+    with patch("custom_components.rag_search.cache.time.time", return_value=1000):
+        cache.set("a", "A")
+    with patch("custom_components.rag_search.cache.time.time", return_value=1059):
+        assert cache.get("a") == "A"
+    with patch("custom_components.rag_search.cache.time.time", return_value=1061):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+async def test_zero_ttl_disables_cache(hass: HomeAssistant):
+    """A TTL of zero stores nothing."""
+    cache = AnswerCache(hass, ttl=0)
+    cache.set("a", "A")
+    assert not cache.enabled
+    assert len(cache) == 0
+
+
+async def test_persisted_entries_are_loaded(
+    hass: HomeAssistant, hass_storage: dict[str, Any]
+):
+    """Unexpired entries survive a restart through the store."""
+    hass_storage[CACHE_STORAGE_KEY] = {
+        "version": 1,
+        "key": CACHE_STORAGE_KEY,
+        "data": {"entries": {"fresh": ["A", 2000], "stale": ["B", 500]}},
+    }
+    cache = AnswerCache(hass, ttl=60, persist=True)
+    with patch("custom_components.rag_search.cache.time.time", return_value=1000):
+        await cache.async_load()
+        assert cache.get("fresh") == "A"
+        assert cache.get("stale") is None
+
+
+async def test_single_flight_shares_in_flight_work():
+    """Concurrent callers with the same key share one execution."""
+    flight: SingleFlight[int] = SingleFlight()
+    release = asyncio.Event()
+    runs = 0
+
+    async def _work() -> int:
+        nonlocal runs
+        runs += 1
+        await release.wait()
+        return 42
+
+    first = asyncio.ensure_future(flight.run("key", _work))
+    second = asyncio.ensure_future(flight.run("key", _work))
+    other = asyncio.ensure_future(flight.run("other", _work))
+    await asyncio.sleep(0)
+    assert len(flight) == 2
+    release.set()
+
+    assert await first == (42, False)
+    assert await second == (42, True)
+    assert await other == (42, False)
+    assert runs == 2
+    assert flight.shared == 1
+    await asyncio.sleep(0)
+    assert len(flight) == 0
+
+
+async def test_single_flight_survives_cancelled_caller():
+    """Cancelling one waiter does not cancel the shared work."""
+    flight: SingleFlight[str] = SingleFlight()
+    release = asyncio.Event()
+
+    async def _work() -> str:
+        await release.wait()
+        return "done"
+
+    first = asyncio.ensure_future(flight.run("key", _work))
+    second = asyncio.ensure_future(flight.run("key", _work))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == ("done", True)
+
+
+async def test_single_flight_retrieves_orphaned_failure():
+    """Work failing after every caller was cancelled is not reported."""
+    flight: SingleFlight[str] = SingleFlight()
+    release = asyncio.Event()
+    errors: list[dict[str, Any]] = []
+    asyncio.get_running_loop().set_exception_handler(
+        lambda _loop, context: errors.append(context)
+    )
+
+    async def _work() -> str:
+        await release.wait()
+        raise RuntimeError("failed")
+
+    caller = asyncio.ensure_future(flight.run("key", _work))
+    await asyncio.sleep(0)
+    caller.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+    assert len(flight) == 0
+    del caller
+    gc.collect()
+    assert errors == []
+
+
+def test_semantic_cache_reuses_reworded_question():
+    """Filler words and punctuation do not matter; the group and window do."""
+    cache = SemanticCache(HashingEmbedder(), ttl=60, threshold=0.85)
+    cache.set("history", START, END, "Was the garage door left open?", "Twice")
+
+    answer, similarity = cache.get("history", START, END, "garage door open left?")
+    assert answer == "Twice"
+    assert similarity >= 0.85
+    assert cache.get("other", START, END, "garage door open left?") is None
+    assert (
+        cache.get("history", START, START.replace(hour=12), "garage door left open")
+        is None
+    )
+    assert cache.get("history", START, END, "When did the garage door close?") is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "hit_rate": 0.25, "size": 1}
+
+
+def test_semantic_cache_distinguishes_numbers():
+    """Questions about other thresholds never share an answer."""
+    cache = SemanticCache(HashingEmbedder(), ttl=60, threshold=0.5)
+    cache.set("history", START, END, "Was it above 25 degrees?", "No")
+    assert cache.get("history", START, END, "Was it above 30 degrees?") is None
+    assert cache.get("history", START, END, "Above 25 degrees?")[0] == "No"
+
+
+def test_semantic_cache_bounded_and_expiring():
+    """The least recently used entry is evicted and old entries expire."""
+    cache = SemanticCache(HashingEmbedder(), ttl=60, threshold=0.85, max_entries=2)
+    with patch("custom_components.rag_search.cache.time.time", return_value=1000):
+        cache.set("history", START, END, "garage door open", "A")
+        cache.set("history", START, END, "kitchen light on", "B")
+        assert cache.get("history", START, END, "garage door open?")[0] == "A"
+        cache.set("history", START, END, "bedroom window closed", "C")
+        assert cache.get("history", START, END, "kitchen light on?") is None
+    with patch("custom_components.rag_search.cache.time.time", return_value=1061):
+        assert cache.get("history", START, END, "garage door open?") is None
+    assert len(cache) == 2
+
+    disabled = SemanticCache(HashingEmbedder(), ttl=60, threshold=0)
+    disabled.set("history", START, END, "garage door open", "A")
+    assert not disabled.enabled
+    assert len(disabled) == 0
@@ -0,0 +1,47 @@
+"""Tests for the columnar state history."""
+
+from datetime import UTC, datetime, timedelta
+
+import numpy as np
+from homeassistant.core import State
+
+from custom_components.rag_search.columns import StateColumns, StateVocabulary
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+
+
+def _states(*values: str) -> list[State]:
+    return [
+        State("sensor.a", value, last_changed=START + timedelta(minutes=minute))
+        for minute, value in enumerate(values)
+    ]
+
+
+def test_columns_rows_and_values():
+    """Rows come back as states; values are NaN where a state is not a number."""
+    columns = StateColumns.from_states("sensor.a", _states("1.5", "on", "inf", "2"))
+
+    assert len(columns) == 4
+    assert columns[1].state == "on"
+    assert columns[1].last_changed == START + timedelta(minutes=1)
+    assert [row.state for row in columns[2:]] == ["inf", "2"]
+    np.testing.assert_array_equal(columns.values, [1.5, np.nan, np.nan, 2.0])
+    assert [row.state for row in columns.without(["on", "off"])] == ["1.5", "inf", "2"]
+
+
+def test_vocabulary_adopt_and_compact():
+    """Columns move between vocabularies without changing their states."""
+    shared = StateVocabulary()
+    kept = StateColumns.from_states("sensor.a", _states("x", "y"), shared)
+    StateColumns.from_states("sensor.a", _states("dropped"), shared)
+    other = StateColumns.from_states("sensor.a", _states("z", "x"))
+
+    adopted = shared.adopt(other)
+    assert adopted.vocabulary is shared
+    assert [row.state for row in adopted] == ["z", "x"]
+
+    compacted = shared.compact([kept])
+    assert compacted.strings == ["x", "y"]
+    assert kept.vocabulary is compacted
+    assert [row.state for row in kept] == ["x", "y"]
+    assert len(shared) == 4
@@ -0,0 +1,108 @@
+"""Unit tests for the history compression stage."""
+
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from custom_components.rag_search.compress import (
+    compress_states,
+    format_duration,
+    format_number,
+    lttb,
+)
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+
+
+def _states(entity_id: str, values, step=timedelta(minutes=1)):
+    return [
+        SimpleNamespace(entity_id=entity_id, state=value, last_changed=START + i * step)
+        for i, value in enumerate(values)
+    ]
+
+
+def test_format_duration():
+    """Durations are compact and human readable."""
+    assert format_duration(40) == "40s"
+    assert format_duration(3900) == "1h 5m"
+    assert format_duration(2 * 86400 + 3600) == "2d 1h"
+
+
+def test_format_number():
+    """Readings keep at most two decimals and no trailing zeros."""
+    assert format_number(21.0) == "21"
+    assert format_number(21.456) == "21.46"
+    assert format_number(-0.5) == "-0.5"
+
+
+def test_lttb_keeps_extremes_and_endpoints():
+    """A spike survives downsampling and the endpoints are always kept."""
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    y[500] = 10
+    keep = lttb(x, y, 20)
+    assert len(keep) == 20
+    assert keep[0] == 0 and keep[-1] == 999
+    assert 500 in keep
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_lttb_short_series_untouched():
+    """A series already within the threshold is returned whole."""
+    x = np.arange(5, dtype=float)
+    assert list(lttb(x, x, 10)) == [0, 1, 2, 3, 4]
+
+
+def test_runs_collapse_repeats_and_drop_noise():
+    """Repeats become one run with a duration; unavailable is dropped."""
+    states = _states(
+        "binary_sensor.door", ["off", "off", "unavailable", "off", "on", "on"]
+    )
+    records = compress_states(states, START + timedelta(minutes=10))
+    assert [r.text for r in records] == [
+        (
+            f"binary_sensor.door was off from {START} to "
+            f"{START + timedelta(minutes=4)} (4m)"
+        ),
+        (
+            f"binary_sensor.door was on from {START + timedelta(minutes=4)} to "
+            f"{START + timedelta(minutes=10)} (6m)"
+        ),
+    ]
+
+
+def test_flapping_collapsed_under_budget():
+    """A burst of very short runs becomes one line when over budget."""
+    values = ["on", "off"] * 20 + ["on"]
+    states = _states("binary_sensor.motion", values, step=timedelta(seconds=5))
+    records = compress_states(states, START + timedelta(hours=1), budget=5)
+    assert len(records) == 2
+    assert "flapped 40 times between off, on" in records[0].text
+    assert records[1].text.startswith("binary_sensor.motion was on from")
+
+
+def test_numeric_series_downsampled_with_summary():
+    """A long numeric series is summarised and downsampled to the budget."""
+    values = [str(20 + (i % 10) / 10) for i in range(1000)]
+    values[400] = "35"
+    records = compress_states(
+        _states("sensor.temperature", values, step=timedelta(seconds=1)),
+        START + timedelta(hours=1),
+        budget=10,
+    )
+    assert len(records) == 10
+    assert "had 1000 readings" in records[0].text
+    assert "max 35" in records[0].text
+    assert any("was 35 at" in r.text for r in records[1:])
+
+
+def test_numeric_series_within_budget_kept():
+    """Without a budget problem every reading is kept."""
+    records = compress_states(
+        _states("sensor.temperature", ["20", "unknown", "21"]), START, budget=10
+    )
+    assert [r.text.split(" at ")[0] for r in records] == [
+        "sensor.temperature was 20",
+        "sensor.temperature was 21",
+    ]
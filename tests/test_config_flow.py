@@ -1,15 +1,23 @@
 """Tests for the RAG Search config flow."""
 
+import aiohttp
+import pytest
+import voluptuous as vol
 from aioresponses import aioresponses
 from homeassistant import config_entries, data_entry_flow
 from homeassistant.core import HomeAssistant
 
 from custom_components.rag_search.const import (
+    CONF_BASE_URL,
+    CONF_DEDICATED_CONNECTOR,
     CONF_ENTITY_SCOPE,
     CONF_MAX_ITEMS,
     CONF_OPENAI_API_KEY,
     CONF_OPENAI_MODEL,
+    CONF_PROMPT_TOKENS,
+    CONF_SCHEDULED_QUERIES,
     DOMAIN,
+    MIN_PROMPT_TOKENS,
     OPENAI_MODELS_URL,
 )
 
@@ -60,8 +68,6 @@ async def test_user_flow_invalid_auth(hass: HomeAssistant):
 
 async def test_user_flow_cannot_connect(hass: HomeAssistant):
     """A connection error shows a cannot_connect error."""
-    import aiohttp
-
     result = await hass.config_entries.flow.async_init(
         DOMAIN, context={"source": config_entries.SOURCE_USER}
     )
@@ -104,3 +110,95 @@ async def test_single_instance_only(hass: HomeAssistant):
     )
     assert result["type"] == data_entry_flow.FlowResultType.ABORT
     assert result["reason"] == "already_configured"
+
+
+async def test_user_flow_local_backend(hass: HomeAssistant):
+    """A base URL points validation and the entry at a compatible server."""
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN, context={"source": config_entries.SOURCE_USER}
+    )
+
+    with aioresponses() as mocked:
+        mocked.get("http://192.168.1.5:8080/v1/models", status=200, payload={})
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"],
+            {**USER_INPUT, CONF_BASE_URL: "http://192.168.1.5:8080/v1/"},
+        )
+        await hass.async_block_till_done()
+
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+    assert result["data"][CONF_BASE_URL] == "http://192.168.1.5:8080/v1/"
+
+
+async def test_options_flow_validates_new_base_url(hass: HomeAssistant, config_entry):
+    """Changing the base URL is checked before the options are saved."""
+    config_entry.add_to_hass(hass)
+    result = await hass.config_entries.options.async_init(config_entry.entry_id)
+
+    with aioresponses() as mocked:
+        mocked.get("http://llm.local/v1/models", exception=aiohttp.ClientError("boom"))
+        result = await hass.config_entries.options.async_configure(
+            result["flow_id"], {CONF_BASE_URL: "http://llm.local/v1"}
+        )
+    assert result["type"] == data_entry_flow.FlowResultType.FORM
+    assert result["errors"] == {"base": "cannot_connect"}
+
+    with aioresponses() as mocked:
+        mocked.get("http://llm.local/v1/models", status=200, payload={})
+        result = await hass.config_entries.options.async_configure(
+            result["flow_id"],
+            {CONF_BASE_URL: "http://llm.local/v1", CONF_DEDICATED_CONNECTOR: True},
+        )
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+    assert config_entry.options[CONF_DEDICATED_CONNECTOR] is True
+
+
+async def test_options_flow_keeps_room_for_the_query(hass: HomeAssistant, config_entry):
+    """A prompt budget too small for the question itself is rejected."""
+    config_entry.add_to_hass(hass)
+    result = await hass.config_entries.options.async_init(config_entry.entry_id)
+    for too_small in (0, MIN_PROMPT_TOKENS - 1):
+        with pytest.raises(vol.Invalid):
+            await hass.config_entries.options.async_configure(
+                result["flow_id"], {CONF_PROMPT_TOKENS: too_small}
+            )
+
+    result = await hass.config_entries.options.async_configure(
+        result["flow_id"], {CONF_PROMPT_TOKENS: "500"}
+    )
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+    assert config_entry.options[CONF_PROMPT_TOKENS] == 500
+
+
+async def test_options_flow_validates_scheduled_queries(
+    hass: HomeAssistant, config_entry
+):
+    """Scheduled queries are checked before the options are saved."""
+    config_entry.add_to_hass(hass)
+    result = await hass.config_entries.options.async_init(config_entry.entry_id)
+    result = await hass.config_entries.options.async_configure(
+        result["flow_id"],
+        {CONF_SCHEDULED_QUERIES: [{"name": "Briefing", "query": "How was it?"}]},
+    )
+    assert result["type"] == data_entry_flow.FlowResultType.FORM
+    assert result["errors"] == {CONF_SCHEDULED_QUERIES: "invalid_scheduled_queries"}
+
+    query = {
+        "name": "Briefing",
+        "entity_id": "sensor.temperature",
+        "query": "How was it?",
+        "at": "07:00",
+    }
+    result = await hass.config_entries.options.async_configure(
+        result["flow_id"], {CONF_SCHEDULED_QUERIES: [query]}
+    )
+    assert result["type"] == data_entry_flow.FlowResultType.CREATE_ENTRY
+    assert config_entry.options[CONF_SCHEDULED_QUERIES] == [
+        {
+            **query,
+            "entity_id": ["sensor.temperature"],
+            "at": "07:00:00",
+            "window": 24,
+            "mode": "recent",
+        }
+    ]
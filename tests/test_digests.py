@@ -0,0 +1,216 @@
+"""Tests for the daily digests."""
+
+from datetime import date, datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from freezegun.api import FrozenDateTimeFactory
+from homeassistant.core import HomeAssistant, State
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.rag_search.const import (
+    DIGEST_BUILD_HOUR,
+    DIGEST_BUILD_MINUTE,
+    DIGEST_STORAGE_KEY,
+)
+from custom_components.rag_search.digests import (
+    DigestStore,
+    build_digest,
+    digest_text,
+)
+
+DAY = date(2024, 10, 1)
+GARAGE = "cover.garage_door"
+
+
+def _bounds(day: date = DAY) -> tuple[datetime, datetime]:
+    return dt_util.start_of_local_day(day), dt_util.start_of_local_day(
+        day + timedelta(days=1)
+    )
+
+
+def _at(hours: float, day: date = DAY) -> datetime:
+    return _bounds(day)[0] + timedelta(hours=hours)
+
+
+def test_digest_of_a_binary_entity():
+    """Changes, time in state and the rare transitions are kept."""
+    start, end = _bounds()
+    states = [
+        State(GARAGE, "closed", last_changed=start - timedelta(hours=5)),
+        State(GARAGE, "open", last_changed=_at(7)),
+        State(GARAGE, "closed", last_changed=_at(7.5)),
+        State(GARAGE, "unavailable", last_changed=_at(9)),
+        State(GARAGE, "open", last_changed=_at(18)),
+        State(GARAGE, "closed", last_changed=_at(22)),
+    ]
+    digest = build_digest(states, start, end)
+
+    assert digest["changes"] == 4
+    assert digest["time"] == {"closed": 19.5 * 3600, "open": 4.5 * 3600}
+    assert digest["notable"] == [
+        ["07:00", "open"],
+        ["07:30", "closed"],
+        ["18:00", "open"],
+        ["22:00", "closed"],
+    ]
+    assert digest_text(GARAGE, "2024-10-01", digest) == (
+        "cover.garage_door on 2024-10-01: 4 changes; closed 19h 30m, open 4h 30m; "
+        "open at 07:00, closed at 07:30, open at 18:00, closed at 22:00"
+    )
+
+
+def test_notable_transitions_prefer_rare_states():
+    """A busy day keeps the transitions into the least common state."""
+    start, end = _bounds()
+    states = [State(GARAGE, "closed", last_changed=start)]
+    for hour in range(1, 21):
+        states.append(
+            State(GARAGE, "open" if hour % 2 else "closed", last_changed=_at(hour))
+        )
+    states.insert(11, State(GARAGE, "jammed", last_changed=_at(10.5)))
+    digest = build_digest(states, start, end)
+
+    assert len(digest["notable"]) == 6
+    assert ["10:30", "jammed"] in digest["notable"]
+
+
+def test_digest_of_a_numeric_entity():
+    """Numeric entities get min/max with times and a time-weighted mean."""
+    start, end = _bounds()
+    states = [
+        State("sensor.temperature", "10", last_changed=start),
+        State("sensor.temperature", "30", last_changed=_at(18)),
+    ]
+    digest = build_digest(states, start, end)
+
+    assert digest == {
+        "changes": 1,
+        "mean": 15.0,
+        "min": [10.0, "00:00"],
+        "max": [30.0, "18:00"],
+    }
+    assert digest_text("sensor.temperature", "2024-10-01", digest) == (
+        "sensor.temperature on 2024-10-01: mean 15, min 10 at 00:00, "
+        "max 30 at 18:00 (1 readings)"
+    )
+
+
+def _instance(history_data: dict, keep_days: int = 10) -> MagicMock:
+    instance = MagicMock()
+    instance.keep_days = keep_days
+    instance.async_add_executor_job = AsyncMock(return_value=history_data)
+    return instance
+
+
+async def test_update_builds_missing_days_once(
+    hass: HomeAssistant, freezer: FrozenDateTimeFactory, hass_storage
+):
+    """Every finished retained day is read once and the digests are saved."""
+    freezer.move_to(_at(3, DAY + timedelta(days=10)))
+    store = DigestStore(hass, [GARAGE])
+    instance = _instance({GARAGE: [State(GARAGE, "closed", last_changed=_at(0))]})
+    with patch(
+        "custom_components.rag_search.digests.get_instance", return_value=instance
+    ):
+        assert await store.async_update(hass) == 9
+        assert await store.async_update(hass) == 0
+
+    args = instance.async_add_executor_job.await_args_list[0].args
+    assert args[2:4] == _bounds(DAY + timedelta(days=1))
+    assert store.get(GARAGE, DAY) is None
+    assert store.get(GARAGE, DAY + timedelta(days=9))["time"] == {"closed": 86400.0}
+
+    freezer.tick(timedelta(minutes=1))
+    await hass.async_block_till_done()
+    async_fire_time_changed(hass)
+    await hass.async_block_till_done()
+    assert len(hass_storage[DIGEST_STORAGE_KEY]["data"]["digests"][GARAGE]) == 9
+
+
+def _store(hass: HomeAssistant, digests: dict) -> DigestStore:
+    store = DigestStore(hass, list(digests))
+    store._digests = digests
+    return store
+
+
+def _steady(state: str) -> dict:
+    return {"changes": 0, "time": {state: 86400.0}, "notable": []}
+
+
+async def test_plan_reads_digested_days(
+    hass: HomeAssistant, freezer: FrozenDateTimeFactory
+):
+    """Finished days inside the window come from digests, the rest is raw."""
+    freezer.move_to(_at(12, DAY + timedelta(days=4)))
+    busy = {"changes": 2, "time": {"closed": 79200.0, "open": 7200.0}}
+    busy["notable"] = [["07:00", "open"], ["09:00", "closed"]]
+    store = _store(
+        hass,
+        {
+            GARAGE: {
+                "2024-10-01": _steady("closed"),
+                "2024-10-02": _steady("closed"),
+                "2024-10-03": busy,
+                "2024-10-04": _steady("closed"),
+            }
+        },
+    )
+    planned = store.plan(
+        [GARAGE], _at(6), dt_util.utcnow(), dt_util.utcnow() - timedelta(days=10)
+    )
+
+    assert planned is not None
+    records, digests_from, history_from = planned
+    # The window starts at 06:00, so the first day is not digested whole.
+    assert digests_from == _bounds(DAY + timedelta(days=1))[0]
+    assert history_from == _bounds(DAY + timedelta(days=4))[0]
+    assert [record.text for record in records] == [
+        "cover.garage_door was closed all day on 2024-10-02",
+        (
+            "cover.garage_door on 2024-10-03: 2 changes; closed 22h, open 2h; "
+            "open at 07:00, closed at 09:00"
+        ),
+        "cover.garage_door was closed all day on 2024-10-04",
+    ]
+
+
+async def test_plan_needs_every_retained_day(
+    hass: HomeAssistant, freezer: FrozenDateTimeFactory
+):
+    """A retained day without a digest falls back to raw history."""
+    freezer.move_to(_at(12, DAY + timedelta(days=3)))
+    store = _store(hass, {GARAGE: {"2024-10-01": _steady("closed")}})
+    end = dt_util.utcnow()
+
+    assert store.plan([GARAGE], _at(0), end, end - timedelta(days=10)) is None
+    # Once the missing days have been purged there is nothing better to read.
+    planned = store.plan([GARAGE], _at(0), end, _at(0, DAY + timedelta(days=3)))
+    assert planned is not None
+    assert len(planned[0]) == 1
+
+
+async def test_digests_built_off_peak(
+    hass: HomeAssistant, config_entry, freezer: FrozenDateTimeFactory
+):
+    """The nightly job runs at the configured local time."""
+    freezer.move_to(_at(12))
+    hass.config.components.add("recorder")
+    with patch(
+        "custom_components.rag_search.digests.DigestStore.async_update",
+        AsyncMock(return_value=0),
+    ) as update, patch(
+        "custom_components.rag_search.buffer.HistoryBuffer.async_backfill",
+        AsyncMock(),
+    ):
+        config_entry.add_to_hass(hass)
+        await hass.config_entries.async_setup(config_entry.entry_id)
+        await hass.async_block_till_done()
+        assert not update.await_count
+
+        async_fire_time_changed(
+            hass,
+            _at(DIGEST_BUILD_HOUR + DIGEST_BUILD_MINUTE / 60, DAY + timedelta(days=1)),
+        )
+        await hass.async_block_till_done()
+    assert update.await_count == 1
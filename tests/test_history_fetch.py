@@ -0,0 +1,134 @@
+"""Tests for the recorder history fetch helpers against a real recorder."""
+
+from datetime import timedelta
+
+import pytest
+from freezegun.api import FrozenDateTimeFactory
+from homeassistant.components.recorder import Recorder
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.components.recorder.common import (
+    async_wait_recording_done,
+)
+
+from custom_components.rag_search.buffer import HistoryBuffer
+from custom_components.rag_search.columns import StateVocabulary, load_columns
+from custom_components.rag_search.search import _get_latest_states
+
+
+@pytest.fixture(autouse=True)
+def auto_enable_custom_integrations(recorder_db_url, enable_custom_integrations):
+    """Prepare the recorder database before the hass fixture is created."""
+    return
+
+
+async def _record_states(
+    hass: HomeAssistant, freezer: FrozenDateTimeFactory, entity_id: str, values, start
+):
+    """Record one state per value, one minute apart, starting at ``start``."""
+    for minute, value in enumerate(values):
+        freezer.move_to(start + timedelta(minutes=minute))
+        hass.states.async_set(entity_id, value)
+    freezer.move_to(start + timedelta(minutes=len(values)))
+    await async_wait_recording_done(hass)
+
+
+async def test_get_latest_states_limits_in_query(
+    recorder_mock: Recorder, hass: HomeAssistant, freezer: FrozenDateTimeFactory
+):
+    """Only the newest ``limit`` changes are returned, oldest first."""
+    start = dt_util.utcnow() - timedelta(hours=1)
+    await _record_states(
+        hass, freezer, "sensor.power", [str(i) for i in range(10)], start
+    )
+
+    history_data = await recorder_mock.async_add_executor_job(
+        _get_latest_states,
+        hass,
+        start - timedelta(minutes=1),
+        dt_util.utcnow(),
+        "sensor.power",
+        3,
+    )
+
+    assert [s.state for s in history_data["sensor.power"]] == ["7", "8", "9"]
+
+
+async def test_get_latest_states_includes_start_state(
+    recorder_mock: Recorder, hass: HomeAssistant, freezer: FrozenDateTimeFactory
+):
+    """A sparse window still reports the state in effect at its start."""
+    start = dt_util.utcnow() - timedelta(hours=1)
+    await _record_states(hass, freezer, "sensor.power", ["1", "2", "3"], start)
+
+    window_start = start + timedelta(minutes=1, seconds=30)
+    history_data = await recorder_mock.async_add_executor_job(
+        _get_latest_states, hass, window_start, dt_util.utcnow(), "sensor.power", 10
+    )
+
+    states = history_data["sensor.power"]
+    assert [s.state for s in states] == ["2", "3"]
+    assert states[0].last_changed == window_start
+
+
+async def test_get_latest_states_unknown_entity(
+    recorder_mock: Recorder, hass: HomeAssistant
+):
+    """An entity the recorder has never seen yields no history."""
+    history_data = await recorder_mock.async_add_executor_job(
+        _get_latest_states,
+        hass,
+        dt_util.utcnow() - timedelta(hours=1),
+        dt_util.utcnow(),
+        "sensor.unknown",
+        10,
+    )
+    assert history_data == {}
+
+
+async def test_buffer_backfill_extends_coverage(
+    recorder_mock: Recorder, hass: HomeAssistant, freezer: FrozenDateTimeFactory
+):
+    """Backfilling from the recorder makes older windows servable from memory."""
+    start = dt_util.utcnow() - timedelta(hours=1)
+    await _record_states(hass, freezer, "sensor.power", ["1", "2", "3"], start)
+
+    buffer = HistoryBuffer(["sensor.power"])
+    unsub = buffer.async_start(hass)
+    assert not buffer.covers(["sensor.power"], start)
+
+    await buffer.async_backfill(hass)
+    unsub()
+
+    assert buffer.covers(["sensor.power"], start)
+    states = buffer.get_states(["sensor.power"], start, dt_util.utcnow())
+    assert [s.state for s in states["sensor.power"]] == ["1", "2", "3"]
+
+
+async def test_load_columns_matches_significant_states(
+    recorder_mock: Recorder, hass: HomeAssistant, freezer: FrozenDateTimeFactory
+):
+    """The columnar loader reads state changes and the start state, not attributes."""
+    start = dt_util.utcnow() - timedelta(hours=1)
+    await _record_states(hass, freezer, "sensor.power", ["1", "2", "on", "3"], start)
+    # An attribute-only update is not a state change.
+    hass.states.async_set("sensor.power", "3", {"unit_of_measurement": "W"})
+    await async_wait_recording_done(hass)
+
+    window_start = start + timedelta(minutes=1, seconds=30)
+    vocabulary = StateVocabulary()
+    columns = await recorder_mock.async_add_executor_job(
+        load_columns,
+        hass,
+        window_start,
+        dt_util.utcnow() + timedelta(minutes=1),
+        ["sensor.power", "sensor.unknown"],
+        vocabulary,
+    )
+
+    assert list(columns) == ["sensor.power"]
+    power = columns["sensor.power"]
+    assert [state.state for state in power] == ["2", "on", "3"]
+    assert power.time(0) == window_start
+    assert power.time(1) == start + timedelta(minutes=2)
+    assert power.values[0] == 2 and power.values[2] == 3
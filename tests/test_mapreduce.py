@@ -0,0 +1,134 @@
+"""Tests for map-reduce summarisation."""
+
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.rag_search.cache import AnswerCache
+from custom_components.rag_search.compress import Record
+from custom_components.rag_search.const import (
+    MAP_REDUCE_CONCURRENCY,
+    MAP_REDUCE_MAX_CHUNKS,
+)
+from custom_components.rag_search.mapreduce import (
+    COMBINE_INSTRUCTION,
+    async_map_reduce,
+    async_summarize,
+    chunk_period,
+    chunk_records,
+)
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+
+
+def _records(count: int, step: timedelta = timedelta(hours=1)) -> list[Record]:
+    return [
+        Record(START + i * step, "sensor.a", f"sensor.a was {i} at {START + i * step}")
+        for i in range(count)
+    ]
+
+
+def test_chunk_period_bounds_the_chunk_count():
+    """Periods double from one day until the window has few enough of them."""
+    assert chunk_period(START, START + timedelta(days=3)) == timedelta(days=1)
+    period = chunk_period(START, START + timedelta(days=180))
+    assert period == timedelta(days=16)
+    assert timedelta(days=180) / period <= MAP_REDUCE_MAX_CHUNKS
+
+
+def test_chunks_split_on_period_and_budget():
+    """Chunks stay within the budget and never cross a period boundary."""
+    records = _records(72)
+    by_day = chunk_records(records, budget=10_000, period=timedelta(days=1))
+    assert [len(chunk) for chunk in by_day] == [24, 24, 24]
+
+    small = chunk_records(records, budget=100, period=timedelta(days=1))
+    assert len(small) > 3
+    assert sum(len(chunk) for chunk in small) == 72
+    for chunk in small:
+        assert len({r.when.date() for r in chunk}) == 1
+
+
+def test_chunks_are_stable_across_overlapping_windows():
+    """A window starting a day later shares the chunks of the days in common."""
+    records = _records(96)
+    first = chunk_records(records[:72], 10_000, timedelta(days=1))
+    second = chunk_records(records[24:], 10_000, timedelta(days=1))
+    assert first[1:] == second[:2]
+
+
+async def test_summaries_cached_by_chunk(hass: HomeAssistant):
+    """A chunk summarised before is not sent again."""
+    prompts: list[str] = []
+
+    async def complete(prompt: str) -> str:
+        prompts.append(prompt)
+        return f"summary {len(prompts)}"
+
+    cache = AnswerCache(hass, ttl=60)
+    chunks = chunk_records(_records(48), 10_000, timedelta(days=1))
+    first = await async_summarize(chunks, "Sum up.", complete, cache, "gpt-4o-mini")
+    again = await async_summarize(chunks, "Sum up.", complete, cache, "gpt-4o-mini")
+
+    assert len(prompts) == 2
+    assert first == again
+    assert first[0].text.startswith(f"From {START} to ")
+    assert all(prompt.endswith("\n\nSum up.") for prompt in prompts)
+
+
+async def test_summaries_bounded_concurrency(hass: HomeAssistant):
+    """No more than MAP_REDUCE_CONCURRENCY chunks are summarised at once."""
+    running = peak = 0
+
+    async def complete(prompt: str) -> str:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return "ok"
+
+    chunks = chunk_records(_records(240), 10_000, timedelta(days=1))
+    summaries = await async_summarize(
+        chunks, "Sum up.", complete, AnswerCache(hass, ttl=60), "gpt-4o-mini"
+    )
+    assert len(summaries) == 10
+    assert peak == MAP_REDUCE_CONCURRENCY
+
+
+async def test_failed_summary_fails_the_map(hass: HomeAssistant):
+    """One failed chunk fails the whole map, and nothing bad is cached."""
+
+    async def complete(prompt: str) -> str | None:
+        return None if "was 30 " in prompt else "ok"
+
+    cache = AnswerCache(hass, ttl=60)
+    chunks = chunk_records(_records(48), 10_000, timedelta(days=1))
+    assert await async_summarize(chunks, "x", complete, cache, "m") is None
+    assert len(cache) == 1
+
+
+async def test_summaries_over_budget_are_combined(hass: HomeAssistant):
+    """Summaries that exceed the budget are summarised again."""
+    prompts: list[str] = []
+
+    async def complete(prompt: str) -> str:
+        prompts.append(prompt)
+        return "word " * 30
+
+    records = _records(24 * 8)
+    summaries = await async_map_reduce(
+        records,
+        START,
+        START + timedelta(days=8),
+        chunk_budget=2000,
+        budget=100,
+        complete=complete,
+        cache=AnswerCache(hass, ttl=60),
+        model="gpt-4o-mini",
+    )
+
+    assert len(prompts) == 9
+    assert prompts[-1].endswith(COMBINE_INSTRUCTION)
+    assert len(summaries) == 1
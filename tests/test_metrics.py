@@ -0,0 +1,162 @@
+"""Tests for the query metrics, their sensors and the diagnostics."""
+
+import asyncio
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aioresponses import aioresponses
+from homeassistant.core import HomeAssistant
+
+from custom_components.rag_search.const import (
+    DOMAIN,
+    OPENAI_CHAT_URL,
+    SERVICE_SEARCH_HISTORY,
+    STAGE_FETCH,
+    STAGE_LLM,
+    STAGE_TOTAL,
+    STAGE_VALIDATION,
+)
+from custom_components.rag_search.diagnostics import (
+    async_get_config_entry_diagnostics,
+)
+from custom_components.rag_search.metrics import QueryTrace, RollingHistogram
+
+CALL_DATA = {
+    "entity_id": "sensor.temperature",
+    "start_time": "2024-10-01T00:00:00Z",
+    "end_time": "2024-10-01T06:00:00Z",
+    "query": "What was the state?",
+}
+ANSWER = {
+    "choices": [{"message": {"content": "Fine"}}],
+    "usage": {"prompt_tokens": 321, "completion_tokens": 12, "total_tokens": 333},
+}
+
+
+@contextmanager
+def _patch_history():
+    instance = MagicMock()
+    instance.async_add_executor_job = AsyncMock(return_value={})
+    instance.keep_days = 10
+    get_instance = MagicMock(return_value=instance)
+    with (
+        patch("custom_components.rag_search.search.get_instance", get_instance),
+        patch("custom_components.rag_search.segments.get_instance", get_instance),
+        patch("custom_components.rag_search.planner.get_instance", get_instance),
+    ):
+        yield
+
+
+def test_rolling_histogram_window():
+    """Percentiles and buckets describe the window; the count does not stop."""
+    histogram = RollingHistogram((10, 100), size=4)
+    assert histogram.summary()["p50"] is None
+    for value in (1000, 5, 50, 60, 70):
+        histogram.add(value)
+
+    summary = histogram.summary()
+    assert summary["count"] == 5
+    assert summary["window"] == 4
+    assert summary["p50"] == 50
+    assert summary["p99"] == 70
+    assert summary["max"] == 70
+    assert summary["buckets"] == {"le_10": 1, "le_100": 3, "inf": 0}
+
+
+def test_trace_laps():
+    """Each lap charges the time since the previous one to its stage."""
+    with patch("custom_components.rag_search.metrics.time.monotonic") as monotonic:
+        monotonic.side_effect = [10.0, 10.5, 11.0, 13.0]
+        trace = QueryTrace()
+        trace.lap(STAGE_VALIDATION)
+        trace.lap(None)
+        trace.lap(STAGE_FETCH)
+    assert trace.stages == {STAGE_VALIDATION: 500.0, STAGE_FETCH: 2000.0}
+
+    trace.set_usage({"prompt_tokens": 7, "completion_tokens": None})
+    assert trace.usage == {"prompt_tokens": 7}
+
+    trace.set_usage(
+        {"prompt_tokens": 2048, "prompt_tokens_details": {"cached_tokens": 1024}}
+    )
+    assert trace.usage == {"prompt_tokens": 2048, "cached_tokens": 1024}
+
+
+async def test_query_recorded_in_sensors(hass: HomeAssistant, setup_integration):
+    """A query's stages, retries and token usage reach the sensors."""
+    with _patch_history(), aioresponses() as mocked, patch(
+        "custom_components.rag_search.search.asyncio.sleep", AsyncMock()
+    ):
+        mocked.post(OPENAI_CHAT_URL, status=503)
+        mocked.post(OPENAI_CHAT_URL, status=200, payload=ANSWER)
+        await hass.services.async_call(
+            DOMAIN, SERVICE_SEARCH_HISTORY, CALL_DATA, blocking=True
+        )
+        await hass.async_block_till_done()
+
+    metrics = hass.data[DOMAIN]["metrics"]
+    assert metrics.queries == 1
+    assert metrics.failed == 0
+    assert metrics.retries.summary()["p50"] == 1
+    assert metrics.stages[STAGE_LLM].count == 1
+
+    assert hass.states.get("sensor.rag_search_queries").state == "1"
+    latency = hass.states.get("sensor.rag_search_query_latency")
+    assert float(latency.state) >= 0
+    assert latency.attributes["count"] == 1
+    assert hass.states.get("sensor.rag_search_prompt_tokens").state == "321"
+    assert hass.states.get("sensor.rag_search_completion_tokens").state == "12"
+    assert hass.states.get("sensor.rag_search_llm_retries").state == "1.0"
+    # map_reduce did not run, so its stage has no data.
+    assert hass.states.get("sensor.rag_search_summarization_time").state == "unknown"
+
+
+async def test_shared_query_counted_without_timings(
+    hass: HomeAssistant, setup_integration
+):
+    """A query joining an identical one in flight adds no stage timings."""
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(OPENAI_CHAT_URL, status=200, payload=ANSWER)
+        await asyncio.gather(
+            *(
+                hass.services.async_call(
+                    DOMAIN, SERVICE_SEARCH_HISTORY, CALL_DATA, blocking=True
+                )
+                for _ in range(2)
+            )
+        )
+
+    metrics = hass.data[DOMAIN]["metrics"]
+    assert (metrics.queries, metrics.shared) == (2, 1)
+    assert metrics.stages[STAGE_TOTAL].count == 1
+    assert metrics.stages[STAGE_VALIDATION].count == 1
+    assert metrics.tokens["prompt_tokens"].count == 1
+
+
+async def test_rejected_query_counted_as_failed(hass: HomeAssistant, setup_integration):
+    """Queries that fail validation are counted, without an LLM stage."""
+    await hass.services.async_call(
+        DOMAIN,
+        SERVICE_SEARCH_HISTORY,
+        {**CALL_DATA, "entity_id": "light.kitchen"},
+        blocking=True,
+    )
+    metrics = hass.data[DOMAIN]["metrics"]
+    assert (metrics.queries, metrics.failed) == (1, 1)
+    assert metrics.stages[STAGE_LLM].count == 0
+
+
+async def test_diagnostics(hass: HomeAssistant, setup_integration):
+    """The diagnostics include the metrics and never the API key."""
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(OPENAI_CHAT_URL, status=200, payload=ANSWER)
+        await hass.services.async_call(
+            DOMAIN, SERVICE_SEARCH_HISTORY, CALL_DATA, blocking=True
+        )
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, setup_integration)
+    assert diagnostics["entry"]["data"]["openai_api_key"] == "**REDACTED**"
+    assert diagnostics["metrics"]["queries"] == 1
+    assert diagnostics["metrics"]["tokens"]["prompt_tokens"]["p50"] == 321
+    assert diagnostics["metrics"]["stages_ms"]["total"]["count"] == 1
+    assert diagnostics["answer_cache"]["size"] == 1
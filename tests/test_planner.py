@@ -0,0 +1,103 @@
+"""Unit tests for the history source planner."""
+
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from homeassistant.core import HomeAssistant
+
+from custom_components.rag_search.planner import plan_history, statistics_records
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+
+
+@pytest.fixture
+def recorder_instance():
+    """Patch the recorder instance the planner reads retention from."""
+    instance = MagicMock(keep_days=10)
+    with patch(
+        "custom_components.rag_search.planner.get_instance", return_value=instance
+    ):
+        yield instance
+
+
+def _rows(count: int) -> list[dict]:
+    return [
+        {
+            "start": (START + timedelta(hours=i)).timestamp(),
+            "end": (START + timedelta(hours=i + 1)).timestamp(),
+            "mean": float(i),
+            "min": float(i) - 1,
+            "max": float(i) + 1,
+        }
+        for i in range(count)
+    ]
+
+
+async def test_plan_routes_measurement_sensors(
+    hass: HomeAssistant, recorder_instance, freezer
+):
+    """Only measurement sensors over long windows use statistics."""
+    freezer.move_to(START + timedelta(days=2))
+    hass.states.async_set("sensor.temperature", "21", {"state_class": "measurement"})
+    hass.states.async_set("sensor.energy", "5", {"state_class": "total_increasing"})
+    hass.states.async_set("binary_sensor.door", "off")
+    entity_ids = ["sensor.temperature", "sensor.energy", "binary_sensor.door"]
+
+    plan = plan_history(hass, entity_ids, START, START + timedelta(days=2))
+    assert plan.statistics == ["sensor.temperature"]
+    assert plan.raw == ["sensor.energy", "binary_sensor.door"]
+    assert plan.period == "5minute"
+
+    plan = plan_history(hass, entity_ids, START, START + timedelta(hours=6))
+    assert plan.statistics == []
+    assert plan.raw == entity_ids
+
+
+async def test_plan_uses_hourly_for_long_or_old_windows(
+    hass: HomeAssistant, recorder_instance, freezer
+):
+    """Hourly statistics past the short-term window or retention."""
+    hass.states.async_set("sensor.temperature", "21", {"state_class": "measurement"})
+    freezer.move_to(START + timedelta(days=200))
+
+    plan = plan_history(
+        hass, ["sensor.temperature"], START, START + timedelta(days=180)
+    )
+    assert plan.period == "hour"
+    # Short window, but short-term statistics have been purged by now.
+    plan = plan_history(hass, ["sensor.temperature"], START, START + timedelta(days=2))
+    assert plan.period == "hour"
+
+
+def test_statistics_records_format():
+    """Each row becomes one line with mean, min and max."""
+    records = statistics_records("sensor.temperature", _rows(2))
+    assert [r.text for r in records] == [
+        (
+            f"sensor.temperature averaged 0 (min -1, max 1) from {START} to "
+            f"{START + timedelta(hours=1)}"
+        ),
+        (
+            f"sensor.temperature averaged 1 (min 0, max 2) from "
+            f"{START + timedelta(hours=1)} to {START + timedelta(hours=2)}"
+        ),
+    ]
+
+
+def test_statistics_records_merged_to_budget():
+    """Over budget, rows are merged into buckets covering the whole window."""
+    records = statistics_records("sensor.temperature", _rows(24), budget=4)
+    assert len(records) == 4
+    assert records[0].text == (
+        f"sensor.temperature averaged 2.5 (min -1, max 6) from {START} to "
+        f"{START + timedelta(hours=6)}"
+    )
+    assert records[-1].text.endswith(f"to {START + timedelta(hours=24)}")
+
+
+def test_statistics_records_skip_empty_rows():
+    """Rows without a mean (no samples in the period) are dropped."""
+    rows = _rows(3)
+    rows[1]["mean"] = None
+    assert len(statistics_records("sensor.temperature", rows)) == 2
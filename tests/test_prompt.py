@@ -0,0 +1,75 @@
+"""Unit tests for the token-budgeted prompt builder."""
+
+from custom_components.rag_search.const import DEFAULT_CONTEXT_TOKENS
+from custom_components.rag_search.prompt import (
+    build_prompt,
+    context_window,
+    estimate_tokens,
+    pack_lines,
+    prompt_budget,
+    recency_priorities,
+)
+
+
+def test_estimate_tokens():
+    """Words, digit groups and symbols are counted separately."""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("on") == 1
+    assert estimate_tokens("temperature") == 2
+    assert estimate_tokens("2024-10-01") == 6
+    assert estimate_tokens("sensor.temperature was 21.5") == 8
+    assert estimate_tokens("Küche") == 5
+
+
+def test_estimate_tokens_errs_high_on_history_lines():
+    """History lines, dense in digits and symbols, are counted generously."""
+    line = "sensor.temperature was 21.5 at 2024-10-01 00:05:00+00:00"
+    assert estimate_tokens(line) >= 22
+
+
+def test_context_window_longest_prefix():
+    """Dated model names resolve to their family; unknown ones get a default."""
+    assert context_window("gpt-4o-mini-2024-07-18") == 128_000
+    assert context_window("gpt-4-0613") == 8_192
+    assert context_window("gpt-4-turbo-preview") == 128_000
+    assert context_window("my-local-model") == DEFAULT_CONTEXT_TOKENS
+
+
+def test_prompt_budget_clamped_to_context():
+    """Prompt and completion always fit in the model's context window."""
+    assert prompt_budget("gpt-4o-mini", 2000, 150) == 2000
+    assert prompt_budget("gpt-4", 100_000, 1000) == 8_192 - 1000 - 8
+    assert prompt_budget("gpt-4", 100, 10_000) == 0
+
+
+def test_recency_priorities_round_robin():
+    """Each entity's newest line outranks any entity's second newest."""
+    keys = ["a", "a", "a", "b", "a"]
+    assert recency_priorities(keys) == [-3.0, -2.0, -1.0, 0.0, 0.0]
+
+
+def test_pack_lines_keeps_priority_and_order():
+    """Highest priority lines are packed and returned in original order."""
+    lines = ["one", "two", "three", "four"]
+    packed = pack_lines(lines, [1.0, 3.0, 0.0, 2.0], budget=4)
+    assert packed == ["two", "four"]
+
+
+def test_pack_lines_skips_lines_that_do_not_fit():
+    """A long line is skipped and shorter, lower priority ones still packed."""
+    lines = ["short", "a much longer line that will not fit at all", "tiny"]
+    assert pack_lines(lines, [0.0, 2.0, 1.0], budget=4) == ["short", "tiny"]
+
+
+def test_build_prompt_respects_budget():
+    """The built prompt never exceeds the budget."""
+    lines = [f"sensor.temperature was {i} at 2024-10-01" for i in range(100)]
+    prompt, packed = build_prompt(lines, recency_priorities(["s"] * 100), "Hi?", 200)
+    assert estimate_tokens(prompt) <= 200
+    assert packed == lines[-len(packed) :]
+    assert prompt.endswith("\n\nUser Query: Hi?")
+
+
+def test_build_prompt_query_too_long():
+    """A query that alone exceeds the budget cannot be built."""
+    assert build_prompt(["x"], [0.0], "word " * 50, 20) is None
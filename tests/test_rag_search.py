@@ -1,17 +1,33 @@
 """Test the rag_search.search_history service end to end (OpenAI mocked)."""
 
+import asyncio
+import json
+from contextlib import contextmanager, suppress
+from datetime import UTC, datetime, timedelta
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import aiohttp
 from aioresponses import aioresponses
-from homeassistant.core import HomeAssistant
+from homeassistant.components.recorder import statistics
+from homeassistant.core import HomeAssistant, State
+from homeassistant.util import dt as dt_util
 
+from custom_components.rag_search.columns import StateColumns, load_columns
 from custom_components.rag_search.const import (
+    COMPRESS_FETCH_FACTOR,
+    CONF_ENTITY_SCOPE,
+    CONF_MAX_TOKENS,
+    CONF_PROMPT_TOKENS,
+    CONF_STREAM,
     DOMAIN,
+    EVENT_PARTIAL_RESULT,
     OPENAI_CHAT_URL,
     RESULT_ENTITY,
     SERVICE_SEARCH_HISTORY,
+    SERVICE_SEARCH_HISTORY_BATCH,
 )
+from custom_components.rag_search.mapreduce import SUMMARY_INSTRUCTION
+from custom_components.rag_search.prompt import estimate_tokens
 
 CALL_DATA = {
     "entity_id": "sensor.temperature",
@@ -21,13 +37,33 @@ CALL_DATA = {
 }
 
 
+@contextmanager
 def _patch_history(return_value=None):
-    """Patch the recorder history lookup used by search_history."""
+    """Patch the recorder history lookups used by search_history."""
+    history_data = return_value or {}
+
+    async def _run(func, *args):
+        if func is load_columns:
+            _hass, _start, _end, entity_ids, vocabulary, _start_state = args
+            return {
+                entity_id: StateColumns.from_states(
+                    entity_id, history_data[entity_id], vocabulary
+                )
+                for entity_id in entity_ids
+                if entity_id in history_data
+            }
+        return history_data
+
     instance = MagicMock()
-    instance.async_add_executor_job = AsyncMock(return_value=return_value or {})
-    return patch(
-        "custom_components.rag_search.search.get_instance", return_value=instance
-    )
+    instance.async_add_executor_job = AsyncMock(side_effect=_run)
+    instance.keep_days = 10
+    get_instance = MagicMock(return_value=instance)
+    with (
+        patch("custom_components.rag_search.search.get_instance", get_instance),
+        patch("custom_components.rag_search.segments.get_instance", get_instance),
+        patch("custom_components.rag_search.planner.get_instance", get_instance),
+    ):
+        yield get_instance
 
 
 async def _call(hass: HomeAssistant, data: dict) -> str:
@@ -42,6 +78,73 @@ async def test_not_in_scope(hass: HomeAssistant, setup_integration):
     assert result == "Entity not in scope."
 
 
+async def test_partially_out_of_scope(hass: HomeAssistant, setup_integration):
+    """One out-of-scope entity rejects the whole multi-entity call."""
+    result = await _call(
+        hass, {**CALL_DATA, "entity_id": ["sensor.temperature", "light.living_room"]}
+    )
+    assert result == "Entity not in scope."
+
+
+async def test_name_resolved_to_entities_in_scope(hass: HomeAssistant, config_entry):
+    """A room or device name is resolved to the matching entities in scope."""
+    hass.states.async_set(
+        "binary_sensor.kitchen_motion", "off", {"friendly_name": "Kitchen Motion"}
+    )
+    hass.states.async_set("binary_sensor.hall_motion", "off")
+    config_entry.add_to_hass(hass)
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+
+    data = {k: v for k, v in CALL_DATA.items() if k != "entity_id"}
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Quiet"}}]},
+        )
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            {**data, "name": "motion"},
+            blocking=True,
+            return_response=True,
+        )
+    # The hall sensor matches too, but is not in scope.
+    assert response["entity_ids"] == ["binary_sensor.kitchen_motion"]
+
+    result = await _call(hass, {**data, "name": "garage door"})
+    assert result == "No entity matches the name."
+
+
+async def test_scope_rules_authorise_calls(hass: HomeAssistant, config_entry):
+    """Glob and exclusion rules decide which entities may be searched."""
+    hass.states.async_set("binary_sensor.kitchen_motion", "off")
+    hass.states.async_set("binary_sensor.hall_motion", "off")
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(
+        config_entry,
+        options={CONF_ENTITY_SCOPE: ["binary_sensor.*_motion", "!*.hall_*"]},
+    )
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+
+    for entity_id in ("binary_sensor.hall_motion", "sensor.temperature"):
+        result = await _call(hass, {**CALL_DATA, "entity_id": entity_id})
+        assert result == "Entity not in scope."
+
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Quiet"}}]},
+        )
+        result = await _call(
+            hass, {**CALL_DATA, "entity_id": "binary_sensor.kitchen_motion"}
+        )
+    assert result == "Quiet"
+
+
 async def test_invalid_time_format(hass: HomeAssistant, setup_integration):
     """A bad timestamp is reported without calling OpenAI."""
     with _patch_history():
@@ -69,6 +172,18 @@ async def test_successful_api_call(hass: HomeAssistant, setup_integration):
     assert result == "Test Response"
 
 
+async def test_empty_completion(hass: HomeAssistant, setup_integration):
+    """An empty completion is stored as an empty result."""
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": ""}}]},
+        )
+        result = await _call(hass, CALL_DATA)
+    assert result == ""
+
+
 async def test_openai_client_error(hass: HomeAssistant, setup_integration):
     """A persistent network error yields an error result after retries."""
     with _patch_history(), aioresponses() as mocked:
@@ -99,3 +214,876 @@ async def test_openai_bad_payload(hass: HomeAssistant, setup_integration):
         mocked.post(OPENAI_CHAT_URL, status=200, payload={"choices": []})
         result = await _call(hass, CALL_DATA)
     assert result == "Error processing the query."
+
+
+async def test_multiple_entities_single_fetch(hass: HomeAssistant, setup_integration):
+    """Several entities are fetched in one recorder job and merged in time."""
+    history_data = {
+        "sensor.temperature": [
+            State(
+                "sensor.temperature",
+                "21",
+                last_changed=datetime(2024, 10, 2, tzinfo=UTC),
+            )
+        ],
+        "binary_sensor.kitchen_motion": [
+            State(
+                "binary_sensor.kitchen_motion",
+                "on",
+                last_changed=datetime(2024, 10, 1, tzinfo=UTC),
+            )
+        ],
+    }
+    with _patch_history(history_data) as get_instance, aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Kitchen"}}]},
+        )
+        result = await _call(
+            hass,
+            {
+                **CALL_DATA,
+                "entity_id": ["sensor.temperature", "binary_sensor.kitchen_motion"],
+            },
+        )
+        request = next(iter(mocked.requests.values()))[0]
+
+    assert result == "Kitchen"
+    get_instance.return_value.async_add_executor_job.assert_awaited_once()
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert prompt.index("binary_sensor.kitchen_motion was on") < prompt.index(
+        "sensor.temperature was 21"
+    )
+
+
+async def test_relevant_mode_fetches_whole_window(
+    hass: HomeAssistant, setup_integration
+):
+    """Relevant mode ranks the full window instead of the newest rows."""
+    states = [
+        State(
+            "binary_sensor.kitchen_motion",
+            "tampered" if i == 5 else ("on" if i % 2 else "off"),
+            last_changed=datetime(2024, 10, 1, tzinfo=UTC) + timedelta(minutes=i),
+        )
+        for i in range(200)
+    ]
+    with _patch_history(
+        {"binary_sensor.kitchen_motion": states}
+    ) as get_instance, aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Once"}}]},
+        )
+        result = await _call(
+            hass,
+            {
+                **CALL_DATA,
+                "entity_id": "binary_sensor.kitchen_motion",
+                "num_items": 10,
+                "mode": "relevant",
+                "query": "When was it tampered?",
+            },
+        )
+        request = next(iter(mocked.requests.values()))[0]
+
+    assert result == "Once"
+    args = get_instance.return_value.async_add_executor_job.await_args.args
+    assert args[0] is load_columns
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert "kitchen_motion was tampered" in prompt
+    assert prompt.count("kitchen_motion was") == 10
+
+
+async def test_map_reduce_mode_covers_whole_window(
+    hass: HomeAssistant, setup_integration
+):
+    """Map-reduce summarises every day of the window and answers over that."""
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    states = [
+        State(
+            "binary_sensor.kitchen_motion",
+            "tampered" if i == 5 else ("on" if i % 2 else "off"),
+            last_changed=start + timedelta(hours=i),
+        )
+        for i in range(72)
+    ]
+    data = {
+        **CALL_DATA,
+        "entity_id": "binary_sensor.kitchen_motion",
+        "start_time": "2024-10-01T00:00:00Z",
+        "end_time": "2024-10-04T00:00:00Z",
+        "num_items": 5,
+        "mode": "map_reduce",
+        "query": "When was it tampered?",
+    }
+    with _patch_history(
+        {"binary_sensor.kitchen_motion": states}
+    ) as get_instance, aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "At 05:00 on day one"}}]},
+            repeat=True,
+        )
+        result = await _call(hass, data)
+        requests = [r.kwargs["json"] for r in next(iter(mocked.requests.values()))]
+        # The same question again is answered from the answer cache.
+        assert await _call(hass, data) == "At 05:00 on day one"
+        assert len(next(iter(mocked.requests.values()))) == 4
+
+    assert result == "At 05:00 on day one"
+    args = get_instance.return_value.async_add_executor_job.await_args.args
+    assert args[0] is load_columns
+    map_prompts = [r["messages"][0]["content"] for r in requests[:3]]
+    assert all(prompt.endswith(SUMMARY_INSTRUCTION) for prompt in map_prompts)
+    assert sum("kitchen_motion was tampered" in p for p in map_prompts) == 1
+    final = requests[3]["messages"][0]["content"]
+    assert final.count("From 2024-10-0") == 3
+    assert final.endswith("When was it tampered?")
+    assert len(hass.data[DOMAIN]["summaries"]) == 3
+
+
+async def test_long_window_reads_daily_digests(
+    hass: HomeAssistant, setup_integration, freezer
+):
+    """Finished days come from the digests, only today from the recorder."""
+    today = dt_util.start_of_local_day(datetime(2024, 10, 20))
+    freezer.move_to(today + timedelta(hours=9))
+    digests = hass.data[DOMAIN]["digests"]
+    for day in range(1, 20):
+        digests._digests.setdefault("binary_sensor.kitchen_motion", {})[
+            f"2024-10-{day:02}"
+        ] = {"changes": 0, "time": {"off": 86400.0}, "notable": []}
+    digests._digests["binary_sensor.kitchen_motion"]["2024-10-12"] = {
+        "changes": 2,
+        "time": {"off": 84600.0, "tampered": 1800.0},
+        "notable": [["03:00", "tampered"], ["03:30", "off"]],
+    }
+    states = [
+        State("binary_sensor.kitchen_motion", "on", last_changed=today),
+    ]
+    with _patch_history(
+        {"binary_sensor.kitchen_motion": states}
+    ) as get_instance, aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "On the 12th"}}]},
+        )
+        result = await _call(
+            hass,
+            {
+                **CALL_DATA,
+                "entity_id": "binary_sensor.kitchen_motion",
+                "start_time": "2024-10-01T07:00:00Z",
+                "end_time": dt_util.utcnow().isoformat(),
+                "query": "When was it tampered?",
+            },
+        )
+        request = next(iter(mocked.requests.values()))[0]
+
+    assert result == "On the 12th"
+    args = get_instance.return_value.async_add_executor_job.await_args.args
+    assert args[2] == today
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert "kitchen_motion on 2024-10-12: 2 changes" in prompt
+    assert "was off all day from 2024-10-01 to 2024-10-11" in prompt
+    assert "was off all day from 2024-10-13 to 2024-10-19" in prompt
+
+
+async def test_long_window_starting_mid_day_reads_that_day_raw(
+    hass: HomeAssistant, setup_integration, freezer
+):
+    """The digest of the day the window starts in is not used."""
+    today = dt_util.start_of_local_day(datetime(2024, 10, 20))
+    freezer.move_to(today + timedelta(hours=9))
+    digests = hass.data[DOMAIN]["digests"]
+    for day in range(1, 20):
+        digests._digests.setdefault("binary_sensor.kitchen_motion", {})[
+            f"2024-10-{day:02}"
+        ] = {"changes": 0, "time": {"off": 86400.0}, "notable": []}
+    # Tampered in the morning, before the window starts.
+    digests._digests["binary_sensor.kitchen_motion"]["2024-10-01"] = {
+        "changes": 2,
+        "time": {"off": 84600.0, "tampered": 1800.0},
+        "notable": [["03:00", "tampered"], ["03:30", "off"]],
+    }
+    start_time = dt_util.start_of_local_day(datetime(2024, 10, 1)) + timedelta(hours=12)
+    second_day = dt_util.start_of_local_day(datetime(2024, 10, 2))
+    states = [
+        State(
+            "binary_sensor.kitchen_motion",
+            "on",
+            last_changed=start_time + timedelta(hours=1),
+        ),
+    ]
+    with _patch_history(
+        {"binary_sensor.kitchen_motion": states}
+    ) as get_instance, aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Never"}}]},
+        )
+        await _call(
+            hass,
+            {
+                **CALL_DATA,
+                "entity_id": "binary_sensor.kitchen_motion",
+                "start_time": start_time.isoformat(),
+                "end_time": dt_util.utcnow().isoformat(),
+                "query": "When was it tampered?",
+            },
+        )
+        request = next(iter(mocked.requests.values()))[0]
+
+    windows = [
+        (call.args[2], call.args[3])
+        for call in get_instance.return_value.async_add_executor_job.await_args_list
+        if call.args[0] is load_columns
+    ]
+    assert (start_time, second_day) in windows
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert "tampered" not in prompt.split("User Query:")[0]
+    assert "was off all day from 2024-10-02 to 2024-10-19" in prompt
+
+
+async def test_recent_window_served_from_buffer(hass: HomeAssistant, config_entry):
+    """A window the in-memory buffer covers never touches the recorder."""
+    hass.states.async_set("sensor.temperature", "20")
+    config_entry.add_to_hass(hass)
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+    start_time = dt_util.utcnow()
+    hass.states.async_set("sensor.temperature", "21")
+    await hass.async_block_till_done()
+
+    with _patch_history() as get_instance, aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Warmer"}}]},
+        )
+        result = await _call(
+            hass,
+            {
+                **CALL_DATA,
+                "start_time": start_time.isoformat(),
+                "end_time": (start_time + timedelta(minutes=1)).isoformat(),
+            },
+        )
+        request = next(iter(mocked.requests.values()))[0]
+
+    assert result == "Warmer"
+    get_instance.return_value.async_add_executor_job.assert_not_called()
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert "sensor.temperature was 21" in prompt
+
+
+async def test_repeated_query_served_from_cache(hass: HomeAssistant, setup_integration):
+    """An identical query over unchanged history skips the OpenAI call."""
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Cached"}}]},
+        )
+        first = await _call(hass, CALL_DATA)
+        second = await _call(hass, {**CALL_DATA, "query": "what was the state"})
+        calls = sum(len(requests) for requests in mocked.requests.values())
+
+    assert first == second == "Cached"
+    assert calls == 1
+    assert hass.data[DOMAIN]["cache"].stats()["hits"] == 1
+
+
+async def test_reworded_query_served_from_semantic_cache(
+    hass: HomeAssistant, setup_integration
+):
+    """A reworded question about the same history reuses the answer."""
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Yes, twice"}}]},
+        )
+        await _call(hass, {**CALL_DATA, "query": "Was the temperature above 25?"})
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            {**CALL_DATA, "query": "temperature above 25?"},
+            blocking=True,
+            return_response=True,
+        )
+        calls = sum(len(requests) for requests in mocked.requests.values())
+
+    assert calls == 1
+    assert response["answer"] == "Yes, twice"
+    assert response["cached"] is True
+    assert response["cache_similarity"] >= 0.85
+    assert hass.data[DOMAIN]["metrics"].semantic_cached == 1
+
+
+async def test_session_follow_up_reuses_prompt_prefix(
+    hass: HomeAssistant, setup_integration
+):
+    """A follow-up resends the earlier turn unchanged and fetches nothing new."""
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    states = [
+        State("sensor.temperature", value, last_changed=start + timedelta(hours=i))
+        for i, value in enumerate(["20", "26", "22"])
+    ]
+    with _patch_history(
+        {"sensor.temperature": states}
+    ) as get_instance, aioresponses() as mocked:
+        for answer in ("It peaked at 26", "At 01:00"):
+            mocked.post(
+                OPENAI_CHAT_URL,
+                status=200,
+                payload={"choices": [{"message": {"content": answer}}]},
+            )
+        first = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            {**CALL_DATA, "num_items": 2, "session_id": "heating"},
+            blocking=True,
+            return_response=True,
+        )
+        second = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            {**CALL_DATA, "num_items": 2, "session_id": "heating", "query": "When?"},
+            blocking=True,
+            return_response=True,
+        )
+        requests = next(iter(mocked.requests.values()))
+        executor = get_instance.return_value.async_add_executor_job
+
+    assert (first["session_turn"], second["session_turn"]) == (1, 2)
+    assert second["answer"] == "At 01:00"
+    assert second["history_items"] == 0
+    first_messages = requests[0].kwargs["json"]["messages"]
+    second_messages = requests[1].kwargs["json"]["messages"]
+    assert second_messages[:3] == [
+        *first_messages,
+        {"role": "assistant", "content": "It peaked at 26"},
+    ]
+    assert second_messages[3]["content"].endswith("User Query: When?")
+    assert "sensor.temperature" in first_messages[1]["content"]
+    assert "sensor.temperature" not in second_messages[3]["content"]
+    # Read once through the segment cache, then served from it.
+    loads = [c for c in executor.call_args_list if c.args[0] is load_columns]
+    assert len(loads) == 1
+
+
+async def test_concurrent_session_turns_run_in_order(
+    hass: HomeAssistant, setup_integration
+):
+    """Two turns of one session sent at once both end up in the conversation."""
+    sent: list[list[dict]] = []
+    second_sent = asyncio.Event()
+
+    async def _complete(_backend, _model, messages, *_args):
+        sent.append(list(messages))
+        if len(sent) == 1:
+            # Give an unserialised second turn the chance to start meanwhile.
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(second_sent.wait(), 0.1)
+            return "First"
+        second_sent.set()
+        return "Second"
+
+    with (
+        _patch_history(),
+        patch("custom_components.rag_search.search._call_openai", _complete),
+    ):
+        await asyncio.gather(
+            *(
+                hass.services.async_call(
+                    DOMAIN,
+                    SERVICE_SEARCH_HISTORY,
+                    {**CALL_DATA, "session_id": "heating", "query": query},
+                    blocking=True,
+                )
+                for query in ("How warm?", "How cold?")
+            )
+        )
+
+    assert sent[1][2] == {"role": "assistant", "content": "First"}
+    session = hass.data[DOMAIN]["sessions"].get("heating")
+    assert session.turns == 2
+    assert [m["content"] for m in session.messages[2::2]] == ["First", "Second"]
+
+
+async def test_structured_mode_answers_without_openai(
+    hass: HomeAssistant, setup_integration
+):
+    """Structured queries return locally computed facts and never call OpenAI."""
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    states = [
+        State("sensor.temperature", value, last_changed=start + timedelta(hours=i))
+        for i, value in enumerate(["20", "26", "22", "27"])
+    ]
+    with _patch_history({"sensor.temperature": states}), aioresponses() as mocked:
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            {**CALL_DATA, "mode": "structured", "threshold": "25"},
+            blocking=True,
+            return_response=True,
+        )
+        assert not mocked.requests
+
+    facts = response["facts"]["sensor.temperature"]
+    assert facts["max"] == {"value": 27, "at": "2024-10-01T03:00:00+00:00"}
+    assert facts["threshold"]["crossed_above"] == 2
+    assert response["history_items"] == 4
+    assert response["answer"].startswith("sensor.temperature from 2024-10-01")
+    assert hass.states.get(RESULT_ENTITY).state == response["answer"][:255]
+
+
+async def test_facts_lead_the_prompt(hass: HomeAssistant, setup_integration):
+    """The facts of the fetched window are packed ahead of the history lines."""
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    states = [
+        State("binary_sensor.kitchen_motion", value, last_changed=start + delta)
+        for value, delta in [("off", timedelta()), ("on", timedelta(hours=1))]
+    ]
+    with _patch_history(
+        {"binary_sensor.kitchen_motion": states}
+    ), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Once"}}]},
+        )
+        await _call(hass, {**CALL_DATA, "entity_id": "binary_sensor.kitchen_motion"})
+        request = next(iter(mocked.requests.values()))[0]
+
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert prompt.startswith(
+        "binary_sensor.kitchen_motion from 2024-10-01T00:00:00+00:00 to "
+        "2024-10-10T23:59:59+00:00: 1 changes; on 1 times for 9d 22h, off for 1h;"
+    )
+
+
+async def test_invalid_threshold(hass: HomeAssistant, setup_integration):
+    """A threshold that is not a number is rejected."""
+    result = await _call(hass, {**CALL_DATA, "threshold": "warm"})
+    assert result == "Invalid threshold."
+
+
+async def test_compression_fits_more_of_the_window(
+    hass: HomeAssistant, setup_integration
+):
+    """Repeats and noise are folded so the prompt covers more of the window."""
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    states = [
+        State(
+            "sensor.temperature",
+            ["20", "20", "unavailable"][i % 3] if i < 90 else "25",
+            last_changed=start + timedelta(minutes=i),
+        )
+        for i in range(100)
+    ]
+    with _patch_history(
+        {"sensor.temperature": states}
+    ) as get_instance, aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Warmed up"}}]},
+        )
+        await _call(hass, {**CALL_DATA, "num_items": 10})
+        request = next(iter(mocked.requests.values()))[0]
+
+    args = get_instance.return_value.async_add_executor_job.await_args.args
+    assert args[-1] == 10 * COMPRESS_FETCH_FACTOR
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert "unavailable" not in prompt
+    assert "sensor.temperature was 20 at 2024-10-01 00:00:00" in prompt
+    assert prompt.count("sensor.temperature was") <= 10
+
+
+async def test_prompt_packed_within_token_budget(hass: HomeAssistant, config_entry):
+    """The prompt is cut to the token budget, keeping the newest history."""
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(
+        config_entry, options={CONF_PROMPT_TOKENS: 120, CONF_MAX_TOKENS: 64}
+    )
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    states = [
+        State("sensor.temperature", str(i), last_changed=start + timedelta(minutes=i))
+        for i in range(50)
+    ]
+    with _patch_history({"sensor.temperature": states}), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "49"}}]},
+        )
+        await _call(hass, CALL_DATA)
+        request = next(iter(mocked.requests.values()))[0]
+
+    payload = request.kwargs["json"]
+    assert payload["max_tokens"] == 64
+    prompt = payload["messages"][0]["content"]
+    assert estimate_tokens(prompt) <= 120
+    assert "sensor.temperature was 49 at" in prompt
+    assert "sensor.temperature was 0 at" not in prompt
+
+
+async def test_query_over_budget_not_sent(hass: HomeAssistant, config_entry):
+    """A query that cannot fit the budget is rejected without an API call."""
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(
+        config_entry, options={CONF_PROMPT_TOKENS: 5}
+    )
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+
+    with _patch_history(), aioresponses() as mocked:
+        result = await _call(hass, CALL_DATA)
+        assert not mocked.requests
+    assert result == "Query too long."
+
+
+async def test_long_window_numeric_sensor_uses_statistics(
+    hass: HomeAssistant, setup_integration
+):
+    """A measurement sensor over a long window is read from statistics."""
+    hass.states.async_set("sensor.temperature", "21", {"state_class": "measurement"})
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    rows = [
+        {
+            "start": (start + timedelta(hours=i)).timestamp(),
+            "end": (start + timedelta(hours=i + 1)).timestamp(),
+            "mean": 20.0 + i % 2,
+            "min": 19.5,
+            "max": 22.0,
+        }
+        for i in range(240)
+    ]
+    motion = [
+        State(
+            "binary_sensor.kitchen_motion",
+            "on",
+            last_changed=start + timedelta(days=2),
+        )
+    ]
+
+    async def _executor_job(target, *args):
+        if target is statistics.statistics_during_period:
+            return {"sensor.temperature": rows}
+        return {"binary_sensor.kitchen_motion": motion}
+
+    with _patch_history() as get_instance, aioresponses() as mocked:
+        get_instance.return_value.async_add_executor_job.side_effect = _executor_job
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Stable"}}]},
+        )
+        await _call(
+            hass,
+            {
+                **CALL_DATA,
+                "entity_id": ["sensor.temperature", "binary_sensor.kitchen_motion"],
+                "num_items": 10,
+            },
+        )
+        request = next(iter(mocked.requests.values()))[0]
+
+    calls = get_instance.return_value.async_add_executor_job.await_args_list
+    stats_call = next(
+        c for c in calls if c.args[0] is statistics.statistics_during_period
+    )
+    assert stats_call.args[4] == {"sensor.temperature"}
+    assert stats_call.args[5] == "hour"
+    # The motion sensor still comes from raw states, without the temperature.
+    assert all(
+        "sensor.temperature" not in c.args[4]
+        for c in calls
+        if c.args[0] is not statistics.statistics_during_period
+    )
+    prompt = request.kwargs["json"]["messages"][0]["content"]
+    assert prompt.count("sensor.temperature averaged") == 9
+    assert "binary_sensor.kitchen_motion was on" in prompt
+
+
+async def test_streamed_answer_published(hass: HomeAssistant, config_entry):
+    """With streaming on, chunks fire events and the final answer is stored."""
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(config_entry, options={CONF_STREAM: True})
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+    events = []
+    hass.bus.async_listen(EVENT_PARTIAL_RESULT, events.append)
+
+    body = "".join(
+        "data: " + json.dumps({"choices": [{"delta": {"content": chunk}}]}) + "\n\n"
+        for chunk in ["It ", "was ", "warm."]
+    )
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            body=body + "data: [DONE]\n\n",
+            content_type="text/event-stream",
+        )
+        result = await _call(hass, CALL_DATA)
+        request = next(iter(mocked.requests.values()))[0]
+
+    assert request.kwargs["json"]["stream"] is True
+    assert result == "It was warm."
+    assert [event.data["delta"] for event in events] == ["It ", "was ", "warm."]
+    assert "streaming" not in hass.states.get(RESULT_ENTITY).attributes
+
+
+async def test_service_returns_response(hass: HomeAssistant, setup_integration):
+    """The answer and metadata are returned to a caller that asks for them."""
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Mild"}}]},
+        )
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            CALL_DATA,
+            blocking=True,
+            return_response=True,
+        )
+
+    assert response["answer"] == "Mild"
+    assert response["error"] is None
+    assert response["entity_ids"] == ["sensor.temperature"]
+    assert response["start_time"] == "2024-10-01T00:00:00+00:00"
+    assert response["mode"] == "recent"
+    assert response["cached"] is False
+    assert response["shared"] is False
+
+
+async def test_error_returned_in_response(hass: HomeAssistant, setup_integration):
+    """Validation errors are returned as well as published."""
+    response = await hass.services.async_call(
+        DOMAIN,
+        SERVICE_SEARCH_HISTORY,
+        {**CALL_DATA, "entity_id": "light.living_room"},
+        blocking=True,
+        return_response=True,
+    )
+    assert response == {"answer": None, "error": "Entity not in scope."}
+
+
+async def test_identical_concurrent_calls_coalesced(
+    hass: HomeAssistant, setup_integration
+):
+    """Identical calls in flight share one history fetch and one LLM call."""
+    release = asyncio.Event()
+
+    async def _slow_answer(*args, **kwargs):
+        await release.wait()
+        return "Shared answer"
+
+    def _call_with_response(query: str):
+        return hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY,
+            {**CALL_DATA, "query": query},
+            blocking=True,
+            return_response=True,
+        )
+
+    with _patch_history() as get_instance, patch(
+        "custom_components.rag_search.search._call_openai",
+        AsyncMock(side_effect=_slow_answer),
+    ) as call_openai:
+        calls = [
+            hass.async_create_task(_call_with_response(query))
+            for query in ("What was the state?", "what was the state", "Other?")
+        ]
+        # Let every call reach the point where it waits on OpenAI.
+        for _ in range(10):
+            await asyncio.sleep(0)
+        release.set()
+        responses = await asyncio.gather(*calls)
+
+    assert [r["answer"] for r in responses] == ["Shared answer"] * 3
+    assert [r["shared"] for r in responses] == [False, True, False]
+    assert call_openai.await_count == 2
+    assert get_instance.return_value.async_add_executor_job.await_count == 2
+
+
+async def test_batch_shares_fetches_and_returns_all(
+    hass: HomeAssistant, setup_integration
+):
+    """Overlapping items are fetched together and answered in one response."""
+    history_data = {
+        "sensor.temperature": [
+            State(
+                "sensor.temperature",
+                "21",
+                last_changed=datetime(2024, 10, 2, tzinfo=UTC),
+            )
+        ],
+        "binary_sensor.kitchen_motion": [
+            State(
+                "binary_sensor.kitchen_motion",
+                "on",
+                last_changed=datetime(2024, 10, 2, tzinfo=UTC),
+            )
+        ],
+    }
+    queries = [
+        {**CALL_DATA, "end_time": "2024-10-05T00:00:00Z", "query": "First?"},
+        {**CALL_DATA, "start_time": "2024-10-03T00:00:00Z", "query": "Second?"},
+        {
+            **CALL_DATA,
+            "entity_id": ["sensor.temperature", "binary_sensor.kitchen_motion"],
+            "query": "Third?",
+        },
+        {**CALL_DATA, "entity_id": "light.living_room"},
+    ]
+    with _patch_history(history_data) as get_instance, aioresponses() as mocked:
+        for _ in range(3):
+            mocked.post(
+                OPENAI_CHAT_URL,
+                status=200,
+                payload={"choices": [{"message": {"content": "Answer"}}]},
+            )
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY_BATCH,
+            {"queries": queries},
+            blocking=True,
+            return_response=True,
+        )
+
+    # The temperature windows merge into the motion sensor's window, so one
+    # fetch loads everything and the items are answered from the cache.
+    calls = get_instance.return_value.async_add_executor_job.await_args_list
+    assert [sorted(c.args[4]) for c in calls] == [
+        ["binary_sensor.kitchen_motion", "sensor.temperature"]
+    ]
+    results = response["results"]
+    assert [r["answer"] for r in results] == ["Answer"] * 3 + [None]
+    assert results[3]["error"] == "Entity not in scope."
+    assert results[2]["entity_ids"] == [
+        "sensor.temperature",
+        "binary_sensor.kitchen_motion",
+    ]
+    assert all(isinstance(r["duration_ms"], int) for r in results)
+    assert response["duration_ms"] >= 0
+
+
+async def test_batch_fetches_the_unsettled_tail_once(
+    hass: HomeAssistant, setup_integration
+):
+    """Items ending now share one fetch of the history not yet settled."""
+    now = dt_util.utcnow()
+    history_data = {
+        "sensor.temperature": [
+            State("sensor.temperature", "21", last_changed=now - timedelta(hours=2)),
+            State("sensor.temperature", "22", last_changed=now - timedelta(seconds=5)),
+        ]
+    }
+    queries = [
+        {
+            **CALL_DATA,
+            "start_time": (now - timedelta(hours=hours)).isoformat(),
+            "end_time": now.isoformat(),
+            "query": f"Question {hours}?",
+        }
+        for hours in (3, 2, 1)
+    ]
+    with _patch_history(history_data) as get_instance, aioresponses() as mocked:
+        for _ in queries:
+            mocked.post(
+                OPENAI_CHAT_URL,
+                status=200,
+                payload={"choices": [{"message": {"content": "Answer"}}]},
+            )
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY_BATCH,
+            {"queries": queries},
+            blocking=True,
+            return_response=True,
+        )
+
+    calls = get_instance.return_value.async_add_executor_job.await_args_list
+    assert [c.args[0] for c in calls] == [load_columns]
+    assert [r["answer"] for r in response["results"]] == ["Answer"] * 3
+    # The tail is not kept once the batch is done.
+    segments = hass.data[DOMAIN]["segments"]
+    assert not segments.covers(["sensor.temperature"], now - timedelta(hours=3), now)
+
+
+async def test_batch_validates_each_item(hass: HomeAssistant, setup_integration):
+    """An invalid item gets its own error; the valid items are answered."""
+    queries = [
+        {**CALL_DATA, "num_items": "5", "mode": "recent"},
+        {**CALL_DATA, "num_items": "many"},
+        {**CALL_DATA, "mode": "everything"},
+        {key: value for key, value in CALL_DATA.items() if key != "query"},
+        "What was the state?",
+    ]
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Answer"}}]},
+        )
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY_BATCH,
+            {"queries": queries},
+            blocking=True,
+            return_response=True,
+        )
+
+    results = response["results"]
+    assert [r["answer"] for r in results] == ["Answer", None, None, None, None]
+    assert "num_items" in results[1]["error"]
+    assert "mode" in results[2]["error"]
+    assert "query" in results[3]["error"]
+    assert results[4]["error"]
+
+
+async def test_batch_does_not_stream(hass: HomeAssistant, config_entry):
+    """With streaming on, batch items leave the result entity alone."""
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(config_entry, options={CONF_STREAM: True})
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+    hass.states.async_set(RESULT_ENTITY, "Earlier answer")
+    events = []
+    hass.bus.async_listen(EVENT_PARTIAL_RESULT, events.append)
+
+    with _patch_history(), aioresponses() as mocked:
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "Answer"}}]},
+        )
+        response = await hass.services.async_call(
+            DOMAIN,
+            SERVICE_SEARCH_HISTORY_BATCH,
+            {"queries": [CALL_DATA]},
+            blocking=True,
+            return_response=True,
+        )
+        request = next(iter(mocked.requests.values()))[0]
+
+    assert response["results"][0]["answer"] == "Answer"
+    assert "stream" not in request.kwargs["json"]
+    assert events == []
+    assert hass.states.get(RESULT_ENTITY).state == "Earlier answer"
@@ -0,0 +1,91 @@
+"""Unit tests for the local retrieval index."""
+
+from datetime import UTC, datetime, timedelta
+
+import numpy as np
+
+from custom_components.rag_search.retrieval import (
+    HashingEmbedder,
+    VectorIndex,
+    rank_relevant,
+)
+
+
+def test_hashing_embedder_is_deterministic():
+    """The same text always maps to the same vector."""
+    embedder = HashingEmbedder(dim=64)
+    first = embedder.embed(["garage door opened"])
+    second = embedder.embed(["garage door opened"])
+    assert first.shape == (1, 64)
+    assert np.array_equal(first, second)
+
+
+def test_vector_index_ranks_by_similarity():
+    """The document sharing the query's distinctive words ranks first."""
+    index = VectorIndex(HashingEmbedder())
+    index.build(
+        [
+            "sensor.temperature changed to 21",
+            "cover.garage_door changed to open",
+            "light.kitchen changed to on",
+        ]
+    )
+    hits = index.search("when was the garage open?", k=2)
+    assert hits[0][0] == 1
+    assert hits[0][1] > hits[1][1]
+
+
+def test_vector_index_empty():
+    """Searching an empty index returns nothing."""
+    index = VectorIndex(HashingEmbedder())
+    index.build([])
+    assert index.search("anything", k=3) == []
+
+
+def _lines(count: int, special_at: int) -> tuple[list[str], list[datetime]]:
+    start = datetime(2024, 10, 1, tzinfo=UTC)
+    lines = [f"sensor.power changed to {i % 7} at t{i}" for i in range(count)]
+    lines[special_at] = "cover.garage_door changed to open at t"
+    times = [start + timedelta(minutes=i) for i in range(count)]
+    return lines, times
+
+
+def _selected(lines, times, query, limit):
+    return [
+        line
+        for line, _score in rank_relevant(HashingEmbedder(), lines, times, query, limit)
+    ]
+
+
+def test_rank_relevant_finds_old_events():
+    """A matching event far from the end of the window is retrieved."""
+    lines, times = _lines(500, special_at=42)
+    ranked = rank_relevant(
+        HashingEmbedder(), lines, times, "was the garage door open?", limit=20
+    )
+    assert len(ranked) <= 20
+    scores = dict(ranked)
+    assert scores["cover.garage_door changed to open at t"] > 0
+
+
+def test_rank_relevant_keeps_chronological_order():
+    """Selected chunks are returned oldest first."""
+    lines, times = _lines(500, special_at=420)
+    lines[30] = "cover.garage_door changed to closed at t"
+    selected = _selected(lines, times, "garage door", limit=20)
+    assert selected.index("cover.garage_door changed to closed at t") < (
+        selected.index("cover.garage_door changed to open at t")
+    )
+
+
+def test_rank_relevant_falls_back_to_recent():
+    """With no overlap at all, the newest lines are used, unscored."""
+    lines, times = _lines(100, special_at=0)
+    ranked = rank_relevant(HashingEmbedder(), lines, times, "zzz", limit=10)
+    assert ranked == [(line, 0.0) for line in lines[-10:]]
+
+
+def test_rank_relevant_short_history_untouched():
+    """History that already fits is returned as is."""
+    lines, times = _lines(5, special_at=0)
+    assert _selected(lines, times, "x", limit=10) == lines
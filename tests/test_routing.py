@@ -0,0 +1,93 @@
+"""Tests for the entity routing index."""
+
+import pytest
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import (
+    area_registry as ar,
+)
+from homeassistant.helpers import (
+    device_registry as dr,
+)
+from homeassistant.helpers import (
+    entity_registry as er,
+)
+from homeassistant.helpers import (
+    label_registry as lr,
+)
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.rag_search.routing import EntityIndex, tokenize
+
+
+@pytest.fixture
+async def index(hass: HomeAssistant):
+    """Return an index over a small house, following the registries."""
+    entry = MockConfigEntry(domain="hue")
+    entry.add_to_hass(hass)
+    areas = ar.async_get(hass)
+    kitchen = areas.async_create("Kitchen", aliases={"cooking area"})
+    hallway = areas.async_create("Hallway")
+    devices = dr.async_get(hass)
+    spots = devices.async_get_or_create(
+        config_entry_id=entry.entry_id, identifiers={("hue", "spots")}, name="Spots"
+    )
+    devices.async_update_device(spots.id, area_id=kitchen.id)
+    entities = er.async_get(hass)
+    ceiling = entities.async_get_or_create(
+        "light",
+        "hue",
+        "ceiling",
+        suggested_object_id="ceiling",
+        original_name="Ceiling",
+    )
+    entities.async_update_entity(ceiling.entity_id, area_id=kitchen.id)
+    entities.async_get_or_create(
+        "light", "hue", "spots", suggested_object_id="spots", device_id=spots.id
+    )
+    hall = entities.async_get_or_create(
+        "light", "hue", "hall", suggested_object_id="hall", original_name="Hall"
+    )
+    entities.async_update_entity(hall.entity_id, area_id=hallway.id)
+    hass.states.async_set(
+        "sensor.kitchen_temperature", "21", {"friendly_name": "Kitchen Temperature"}
+    )
+
+    index = EntityIndex()
+    stop = index.async_start(hass)
+    yield index
+    stop()
+
+
+def test_tokenize():
+    """Words are lower-cased, stripped of accents and singular."""
+    assert tokenize("Küche_Lights, living-room") == ["kuche", "light", "living", "room"]
+
+
+async def test_resolves_areas_and_domains(hass: HomeAssistant, index: EntityIndex):
+    """A room and a kind of device resolve to the entities in both."""
+    assert index.resolve("kitchen lights") == ["light.ceiling", "light.spots"]
+    assert index.resolve("the cooking area lights") == ["light.ceiling", "light.spots"]
+    assert index.resolve("kitchen lights", scope={"light.spots"}) == ["light.spots"]
+    assert index.resolve("garage") == []
+
+
+async def test_prefix_and_typos(hass: HomeAssistant, index: EntityIndex):
+    """Word starts and misspellings still find the entity."""
+    assert index.resolve("kitchn temp") == ["sensor.kitchen_temperature"]
+
+
+async def test_follows_registry_updates(hass: HomeAssistant, index: EntityIndex):
+    """Renamed areas, new labels and removed entities are reindexed."""
+    areas = ar.async_get(hass)
+    areas.async_update(areas.async_get_area_by_name("Hallway").id, name="Entrance")
+    label = lr.async_get(hass).async_create("Night")
+    er.async_get(hass).async_update_entity("light.spots", labels={label.label_id})
+    await hass.async_block_till_done()
+
+    assert index.resolve("entrance") == ["light.hall"]
+    assert index.resolve("hallway") == []
+    assert index.resolve("night lights") == ["light.spots"]
+
+    er.async_get(hass).async_remove("light.ceiling")
+    await hass.async_block_till_done()
+    assert index.resolve("kitchen lights") == ["light.spots"]
@@ -0,0 +1,173 @@
+"""Tests for scheduled queries and their sensors."""
+
+from datetime import UTC, datetime, time, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+import voluptuous as vol
+from aioresponses import aioresponses
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import entity_registry as er
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.rag_search.const import (
+    CONF_SCHEDULED_QUERIES,
+    CONF_STREAM,
+    DOMAIN,
+    EVENT_PARTIAL_RESULT,
+    OPENAI_CHAT_URL,
+    RESULT_ENTITY,
+    SCHEDULED_JITTER,
+    SCHEDULED_STARTUP_DELAY,
+)
+from custom_components.rag_search.scheduled import (
+    SCHEDULED_QUERIES_SCHEMA,
+    ScheduledQueries,
+)
+
+BRIEFING = {
+    "name": "Morning briefing",
+    "entity_id": "sensor.temperature",
+    "query": "How cold was the night?",
+    "interval": 60,
+}
+
+
+def test_schema_requires_one_schedule_and_unique_names():
+    """A query runs at a time of day or on an interval, under a unique name."""
+    queries = SCHEDULED_QUERIES_SCHEMA([BRIEFING, {**BRIEFING, "name": "Evening"}])
+    assert queries[0]["entity_id"] == ["sensor.temperature"]
+    assert queries[0]["window"] == 24
+    assert queries[0]["mode"] == "recent"
+
+    without = {key: value for key, value in BRIEFING.items() if key != "interval"}
+    for invalid in (
+        [without],
+        [{**BRIEFING, "at": "07:00"}],
+        [{**BRIEFING, "interval": 1}],
+        [BRIEFING, {**BRIEFING, "name": "morning  briefing"}],
+    ):
+        with pytest.raises(vol.Invalid):
+            SCHEDULED_QUERIES_SCHEMA(invalid)
+
+    # Invalid queries are left out rather than failing the setup.
+    assert [q.key for q in ScheduledQueries([BRIEFING, without]).queries] == [
+        "morning_briefing"
+    ]
+
+
+def test_next_run_is_jittered_ahead_of_time():
+    """Daily runs land just before their time, interval runs a little early."""
+    now = datetime(2024, 10, 1, 6, 0, tzinfo=UTC)
+    daily_spec = {key: value for key, value in BRIEFING.items() if key != "interval"}
+    scheduled = ScheduledQueries(
+        [{**daily_spec, "name": "Daily", "at": "07:00"}, BRIEFING]
+    )
+    daily, every_hour = scheduled.queries
+    assert daily.at == time(7, 0)
+
+    seven = datetime(2024, 10, 1, 7, 0, tzinfo=UTC)
+    with patch.object(dt_util, "DEFAULT_TIME_ZONE", UTC):
+        for _ in range(50):
+            ready, run = scheduled.next_run(daily, now, now)
+            assert ready == seven
+            assert seven - timedelta(seconds=SCHEDULED_JITTER) <= run <= seven
+            # Served early, 07:00 is not served again that morning.
+            ready, run = scheduled.next_run(daily, seven, run)
+            assert ready == seven + timedelta(days=1)
+            assert run > seven + timedelta(hours=23)
+
+            ready, run = scheduled.next_run(every_hour, now, now)
+            assert ready == now + timedelta(hours=1)
+            assert now + timedelta(minutes=54) <= run <= ready
+            # Missed times are skipped rather than caught up.
+            ready, _run = scheduled.next_run(every_hour, now, now + timedelta(hours=3))
+            assert ready == now + timedelta(hours=4)
+
+
+async def test_scheduled_query_sensor(hass: HomeAssistant, config_entry):
+    """Answers are published as a sensor; a failure keeps the last answer."""
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(
+        config_entry, options={CONF_SCHEDULED_QUERIES: [BRIEFING]}
+    )
+    answer = AsyncMock(
+        side_effect=[
+            {"answer": "It dropped to 12°C", "error": None},
+            {"answer": None, "error": "API request failed."},
+        ]
+    )
+    with patch("custom_components.rag_search.scheduled.async_answer", answer):
+        await hass.config_entries.async_setup(config_entry.entry_id)
+        await hass.async_block_till_done()
+        entity_id = er.async_get(hass).async_get_entity_id(
+            "sensor", DOMAIN, f"{config_entry.entry_id}_scheduled_morning_briefing"
+        )
+        state = hass.states.get(entity_id)
+        assert state.state == "unknown"
+        assert state.attributes["next_run"] is not None
+
+        async_fire_time_changed(
+            hass, dt_util.utcnow() + timedelta(seconds=SCHEDULED_STARTUP_DELAY + 1)
+        )
+        await hass.async_block_till_done()
+        state = hass.states.get(entity_id)
+        assert state.state == "It dropped to 12°C"
+        assert state.attributes["answered_at"] is not None
+        assert state.attributes["error"] is None
+        next_run = dt_util.parse_datetime(state.attributes["next_run"])
+        assert next_run > dt_util.utcnow() + timedelta(minutes=50)
+
+        request = answer.call_args.args[2]
+        assert request.entity_ids == ["sensor.temperature"]
+        assert request.end_time - request.start_time == timedelta(hours=24)
+
+        async_fire_time_changed(hass, next_run + timedelta(seconds=1))
+        await hass.async_block_till_done()
+        failed = hass.states.get(entity_id)
+
+    assert answer.await_count == 2
+    assert failed.state == "It dropped to 12°C"
+    assert failed.attributes["answered_at"] == state.attributes["answered_at"]
+    assert failed.attributes["error"] == "API request failed."
+
+
+async def test_scheduled_query_does_not_stream(hass: HomeAssistant, config_entry):
+    """With streaming on, a scheduled answer leaves the result entity alone."""
+    config_entry.add_to_hass(hass)
+    hass.config_entries.async_update_entry(
+        config_entry,
+        options={CONF_STREAM: True, CONF_SCHEDULED_QUERIES: [BRIEFING]},
+    )
+    await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.async_block_till_done()
+    hass.states.async_set(RESULT_ENTITY, "Earlier answer")
+    events = []
+    hass.bus.async_listen(EVENT_PARTIAL_RESULT, events.append)
+
+    instance = MagicMock()
+    instance.async_add_executor_job = AsyncMock(return_value={})
+    get_instance = MagicMock(return_value=instance)
+    with (
+        patch("custom_components.rag_search.search.get_instance", get_instance),
+        patch("custom_components.rag_search.segments.get_instance", get_instance),
+        patch("custom_components.rag_search.planner.get_instance", get_instance),
+        aioresponses() as mocked,
+    ):
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "It dropped to 12°C"}}]},
+        )
+        scheduled = hass.data[DOMAIN]["scheduled"]
+        await scheduled.async_run(
+            hass, hass.data[DOMAIN]["config"], scheduled.queries[0]
+        )
+        await hass.async_block_till_done()
+        request = next(iter(mocked.requests.values()))[0]
+
+    assert scheduled.results["morning_briefing"]["answer"] == "It dropped to 12°C"
+    assert "stream" not in request.kwargs["json"]
+    assert events == []
+    assert hass.states.get(RESULT_ENTITY).state == "Earlier answer"
@@ -0,0 +1,148 @@
+"""Tests for the rate-limit-aware request scheduler."""
+
+import asyncio
+import time
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
+
+import aiohttp
+import pytest
+from aioresponses import aioresponses
+from homeassistant.util import dt as dt_util
+
+from custom_components.rag_search.backend import OpenAIBackend
+from custom_components.rag_search.const import (
+    OPENAI_CHAT_URL,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+)
+from custom_components.rag_search.scheduler import (
+    RequestScheduler,
+    parse_duration,
+    parse_retry_after,
+)
+from custom_components.rag_search.search import _call_openai
+
+
+def test_parse_duration():
+    """OpenAI reset durations are parsed into seconds."""
+    assert parse_duration("1s") == 1
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+    assert parse_duration("7") == 7
+    assert parse_duration("") is None
+    assert parse_duration("soon") is None
+
+
+def test_parse_retry_after():
+    """Retry-After is read as milliseconds, seconds or an HTTP date."""
+    assert parse_retry_after({}) is None
+    assert parse_retry_after({"retry-after-ms": "1500"}) == 1.5
+    assert parse_retry_after({"Retry-After": "3"}) == 3
+    date = (dt_util.utcnow() + timedelta(seconds=30)).strftime(
+        "%a, %d %b %Y %H:%M:%S GMT"
+    )
+    assert 28 <= parse_retry_after({"Retry-After": date}) <= 30
+    assert parse_retry_after({"Retry-After": "whenever"}) is None
+
+
+async def test_interactive_served_before_background():
+    """A freed slot goes to a waiting interactive request first."""
+    scheduler = RequestScheduler(max_concurrency=2)
+    deadline = time.monotonic() + 60
+    order: list[str] = []
+    release = asyncio.Event()
+
+    async def _request(name: str, priority: int) -> None:
+        async with scheduler.slot(priority, 1, deadline):
+            order.append(name)
+            await release.wait()
+
+    first = asyncio.ensure_future(_request("background-1", PRIORITY_BACKGROUND))
+    await asyncio.sleep(0)
+    # One slot is reserved for interactive requests.
+    second = asyncio.ensure_future(_request("background-2", PRIORITY_BACKGROUND))
+    third = asyncio.ensure_future(_request("interactive", PRIORITY_INTERACTIVE))
+    await asyncio.sleep(0)
+    assert order == ["background-1", "interactive"]
+    assert scheduler.active == 2
+    assert scheduler.queued == 1
+
+    release.set()
+    await asyncio.gather(first, second, third)
+    assert order[-1] == "background-2"
+    assert scheduler.active == 0
+
+
+async def test_rate_limit_headers_pace_requests():
+    """An exhausted token budget delays the next request, or fails it fast."""
+    scheduler = RequestScheduler()
+    scheduler.record_response(
+        {
+            "x-ratelimit-limit-tokens": "1000",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "10s",
+        }
+    )
+    # 100 tokens per second come back; 500 are needed.
+    with pytest.raises(TimeoutError):
+        async with scheduler.slot(PRIORITY_INTERACTIVE, 500, time.monotonic() + 1):
+            pass
+    assert scheduler.active == 0
+
+    with patch(
+        "custom_components.rag_search.scheduler.asyncio.sleep", AsyncMock()
+    ) as sleep:
+        async with scheduler.slot(PRIORITY_INTERACTIVE, 50, time.monotonic() + 60):
+            pass
+    assert sleep.await_args_list[0].args[0] == pytest.approx(0.5, abs=0.1)
+
+
+async def test_retry_delay():
+    """Retry-After is honoured and pauses everyone; otherwise jittered backoff."""
+    scheduler = RequestScheduler()
+    assert 2 <= scheduler.retry_delay(3) <= 4
+    assert 10 <= scheduler.retry_delay(10) <= 20
+
+    delay = scheduler.retry_delay(1, {"Retry-After": "5"})
+    assert 5 <= delay <= 5.5
+    with pytest.raises(TimeoutError):
+        async with scheduler.slot(PRIORITY_INTERACTIVE, 1, time.monotonic() + 1):
+            pass
+
+
+async def test_call_gives_up_when_retry_after_exceeds_deadline():
+    """A Retry-After past the deadline ends the call instead of sleeping."""
+    with aioresponses() as mocked, patch(
+        "custom_components.rag_search.search.asyncio.sleep", AsyncMock()
+    ) as sleep:
+        mocked.post(OPENAI_CHAT_URL, status=429, headers={"Retry-After": "120"})
+        async with aiohttp.ClientSession() as session:
+            answer = await _call_openai(
+                OpenAIBackend(session, "key"), "gpt-4o-mini", "prompt"
+            )
+
+    assert answer is None
+    sleep.assert_not_called()
+    assert len(next(iter(mocked.requests.values()))) == 1
+
+
+async def test_call_retries_after_server_delay():
+    """A short Retry-After is waited out and the request retried."""
+    with aioresponses() as mocked, patch(
+        "custom_components.rag_search.search.asyncio.sleep", AsyncMock()
+    ) as sleep:
+        mocked.post(OPENAI_CHAT_URL, status=429, headers={"retry-after-ms": "200"})
+        mocked.post(
+            OPENAI_CHAT_URL,
+            status=200,
+            payload={"choices": [{"message": {"content": "ok"}}]},
+        )
+        async with aiohttp.ClientSession() as session:
+            answer = await _call_openai(
+                OpenAIBackend(session, "key"), "gpt-4o-mini", "prompt"
+            )
+
+    assert answer == "ok"
+    assert 0.2 <= sleep.await_args_list[0].args[0] <= 0.25
@@ -0,0 +1,82 @@
+"""Tests for the compiled entity scope policy."""
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import (
+    area_registry as ar,
+)
+from homeassistant.helpers import (
+    device_registry as dr,
+)
+from homeassistant.helpers import (
+    entity_registry as er,
+)
+from homeassistant.helpers import (
+    label_registry as lr,
+)
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.rag_search.scope import ScopePolicy
+
+
+def test_entity_ids_allowed_before_compiling():
+    """Entity ids named outright are allowed, minus the excluded ones."""
+    scope = ScopePolicy(["sensor.a", "sensor.b", "!sensor.b", "not an entity"])
+    assert scope.allowed == {"sensor.a"}
+    assert scope.denied(["sensor.b", "sensor.a", "light.c"]) == ["sensor.b", "light.c"]
+    assert scope.denied(["sensor.a"]) == []
+
+
+async def test_globs_domains_and_exclusions(hass: HomeAssistant):
+    """Globs and domains match every known entity; exclusions win."""
+    for entity_id in (
+        "sensor.kitchen_temperature",
+        "sensor.kitchen_humidity",
+        "sensor.garage_temperature",
+        "binary_sensor.door",
+        "light.hall",
+    ):
+        hass.states.async_set(entity_id, "1")
+    scope = ScopePolicy(
+        ["sensor.*_temperature", "domain:binary_sensor", "!sensor.garage_*"]
+    )
+    stop = scope.async_start(hass)
+
+    assert scope.allowed == {"sensor.kitchen_temperature", "binary_sensor.door"}
+
+    er.async_get(hass).async_get_or_create(
+        "sensor", "demo", "attic", suggested_object_id="attic_temperature"
+    )
+    await hass.async_block_till_done()
+    assert "sensor.attic_temperature" in scope.allowed
+    stop()
+
+
+async def test_areas_and_labels_follow_registries(hass: HomeAssistant):
+    """Area and label rules use the device's too and follow renames."""
+    entry = MockConfigEntry(domain="hue")
+    entry.add_to_hass(hass)
+    kitchen = ar.async_get(hass).async_create("Kitchen")
+    device = dr.async_get(hass).async_get_or_create(
+        config_entry_id=entry.entry_id, identifiers={("hue", "spots")}
+    )
+    dr.async_get(hass).async_update_device(device.id, area_id=kitchen.id)
+    entities = er.async_get(hass)
+    entities.async_get_or_create(
+        "light", "hue", "spots", suggested_object_id="spots", device_id=device.id
+    )
+    entities.async_get_or_create("light", "hue", "hall", suggested_object_id="hall")
+    private = lr.async_get(hass).async_create("Private")
+    scope = ScopePolicy(["area:kitchen", "label:night", "!label:Private"])
+    changes = []
+    scope.async_add_listener(changes.append)
+    stop = scope.async_start(hass)
+
+    assert scope.allowed == {"light.spots"}
+
+    night = lr.async_get(hass).async_create("Night")
+    entities.async_update_entity("light.hall", labels={night.label_id})
+    entities.async_update_entity("light.spots", labels={private.label_id})
+    await hass.async_block_till_done()
+    assert scope.allowed == {"light.hall"}
+    assert changes[-1] == {"light.hall"}
+    stop()
@@ -1,19 +1,25 @@
 """Unit tests for the pure history-formatting/parsing helpers."""
 
-from datetime import datetime, timezone
+from datetime import UTC, datetime, timezone
 from types import SimpleNamespace
 
 import pytest
 
-from custom_components.rag_search.search import _format_history, _parse_iso
+from custom_components.rag_search.search import (
+    _allocate_budget,
+    _compress_history,
+    _format_state,
+    _merge_history,
+    _parse_iso,
+)
 
 
-def _state(entity_id: str, state: str) -> SimpleNamespace:
+def _state(entity_id: str, state: str, minute: int = 0) -> SimpleNamespace:
     """Build a minimal fake state object."""
     return SimpleNamespace(
         entity_id=entity_id,
         state=state,
-        last_changed=datetime(2024, 10, 1, 12, 0, tzinfo=timezone.utc),
+        last_changed=datetime(2024, 10, 1, 12, minute, tzinfo=timezone.utc),
     )
 
 
@@ -29,7 +35,7 @@ def test_parse_iso_invalid_raises():
         _parse_iso("not-a-date")
 
 
-def test_format_history_returns_lines():
+def test_merge_history_formats_lines():
     """Each state becomes a readable line."""
     history_data = {
         "sensor.temperature": [
@@ -37,21 +43,85 @@ def test_format_history_returns_lines():
             _state("sensor.temperature", "21"),
         ]
     }
-    lines = _format_history("sensor.temperature", history_data, num_items=50)
+    states = _merge_history(["sensor.temperature"], history_data, num_items=50)
+    lines = [_format_state(state) for state in states]
     assert len(lines) == 2
     assert lines[0].startswith("sensor.temperature changed to 20 at")
 
 
-def test_format_history_respects_num_items():
+def test_merge_history_respects_num_items():
     """Only the most recent num_items entries are kept."""
     states = [_state("sensor.temperature", str(i)) for i in range(10)]
-    lines = _format_history(
-        "sensor.temperature", {"sensor.temperature": states}, num_items=3
+    merged = _merge_history(
+        ["sensor.temperature"], {"sensor.temperature": states}, num_items=3
     )
-    assert len(lines) == 3
-    assert "changed to 9 at" in lines[-1]
+    assert [state.state for state in merged] == ["7", "8", "9"]
 
 
-def test_format_history_missing_entity_returns_empty():
-    """An entity with no history yields no lines."""
-    assert _format_history("sensor.unknown", {}, num_items=50) == []
+def test_merge_history_missing_entity_returns_empty():
+    """An entity with no history yields no states."""
+    assert _merge_history(["sensor.unknown"], {}, num_items=50) == []
+
+
+def test_merge_history_merges_entities_by_time():
+    """Several entities are interleaved into one chronological stream."""
+    history_data = {
+        "binary_sensor.kitchen": [
+            _state("binary_sensor.kitchen", "on", 1),
+            _state("binary_sensor.kitchen", "off", 4),
+        ],
+        "binary_sensor.bedroom": [
+            _state("binary_sensor.bedroom", "on", 2),
+            _state("binary_sensor.bedroom", "off", 3),
+        ],
+    }
+    merged = _merge_history(
+        ["binary_sensor.kitchen", "binary_sensor.bedroom"], history_data, 50
+    )
+    assert [state.entity_id for state in merged] == [
+        "binary_sensor.kitchen",
+        "binary_sensor.bedroom",
+        "binary_sensor.bedroom",
+        "binary_sensor.kitchen",
+    ]
+
+
+def test_merge_history_shares_budget_between_entities():
+    """A chatty entity cannot crowd a quiet one out of the budget."""
+    history_data = {
+        "sensor.power": [_state("sensor.power", str(i), i) for i in range(20)],
+        "binary_sensor.door": [_state("binary_sensor.door", "on", 0)],
+    }
+    merged = _merge_history(["sensor.power", "binary_sensor.door"], history_data, 5)
+    assert len(merged) == 5
+    assert merged[0].entity_id == "binary_sensor.door"
+    assert merged[-1].state == "19"
+
+
+def test_compress_history_shares_budget_between_entities():
+    """Compressed streams are merged by time within a shared budget."""
+    history_data = {
+        "sensor.power": [_state("sensor.power", str(i), i) for i in range(20)],
+        "binary_sensor.door": [
+            _state("binary_sensor.door", "on", 0),
+            _state("binary_sensor.door", "off", 30),
+        ],
+    }
+    records = _compress_history(
+        ["sensor.power", "binary_sensor.door"],
+        history_data,
+        8,
+        datetime(2024, 10, 1, 13, 0, tzinfo=UTC),
+    )
+    assert len(records) <= 8
+    assert [record.when for record in records] == sorted(
+        record.when for record in records
+    )
+    assert sum(r.entity_id == "binary_sensor.door" for r in records) == 2
+
+
+def test_allocate_budget_redistributes_unused_share():
+    """Budget unused by short streams goes to the longer ones."""
+    assert _allocate_budget([1, 100, 100], 9) == [1, 4, 4]
+    assert _allocate_budget([2, 3], 10) == [2, 3]
+    assert _allocate_budget([], 10) == []
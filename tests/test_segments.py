@@ -0,0 +1,212 @@
+"""Tests for the recorder history segment cache."""
+
+import asyncio
+from datetime import UTC, datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from homeassistant.core import HomeAssistant, State
+
+from custom_components.rag_search.columns import StateColumns
+from custom_components.rag_search.segments import SegmentCache
+
+START = datetime(2024, 10, 1, tzinfo=UTC)
+
+
+def _at(hour: float) -> datetime:
+    return START + timedelta(hours=hour)
+
+
+class FakeRecorder:
+    """Serve load_columns from a fixed list of states per entity."""
+
+    def __init__(self, history: dict[str, list[State]]) -> None:
+        self.history = history
+        self.calls: list[tuple[datetime, datetime, list[str], bool]] = []
+        self.instance = MagicMock()
+        self.instance.async_add_executor_job = AsyncMock(side_effect=self._fetch)
+
+    async def _fetch(
+        self, _func, _hass, start, end, entity_ids, vocabulary, start_state
+    ):
+        self.calls.append((start, end, list(entity_ids), start_state))
+        # Let concurrent fetches interleave, as the executor would.
+        await asyncio.sleep(0)
+        result = {}
+        for entity_id in entity_ids:
+            states = self.history.get(entity_id, [])
+            window = [s for s in states if start <= s.last_changed < end]
+            before = [s for s in states if s.last_changed < start]
+            if start_state and before:
+                window.insert(0, State(entity_id, before[-1].state, last_changed=start))
+            result[entity_id] = StateColumns.from_states(entity_id, window, vocabulary)
+        return result
+
+
+def _hourly(entity_id: str, hours: int) -> list[State]:
+    return [State(entity_id, str(h), last_changed=_at(h)) for h in range(hours)]
+
+
+def _patch(recorder: FakeRecorder, now: datetime | None = None):
+    if now is None:
+        now = _at(1000)
+    return (
+        patch(
+            "custom_components.rag_search.segments.get_instance",
+            return_value=recorder.instance,
+        ),
+        patch("custom_components.rag_search.segments.dt_util.utcnow", return_value=now),
+    )
+
+
+async def test_overlapping_window_fetches_only_delta(hass: HomeAssistant):
+    """A shifted window only fetches the part not loaded before."""
+    recorder = FakeRecorder({"sensor.a": _hourly("sensor.a", 48)})
+    cache = SegmentCache()
+    get_instance, utcnow = _patch(recorder)
+    with get_instance, utcnow:
+        first = await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(24))
+        second = await cache.async_get_states(hass, ["sensor.a"], _at(12.5), _at(36.5))
+
+    assert [s.state for s in first["sensor.a"]] == [str(h) for h in range(24)]
+    assert [s.state for s in second["sensor.a"]] == [str(h) for h in range(12, 37)]
+    assert second["sensor.a"][0].last_changed == _at(12.5)
+    assert recorder.calls[1][:2] == (_at(24), _at(36.5))
+    # The delta continues a loaded interval, so no start state is requested.
+    assert recorder.calls[1][3] is False
+
+
+async def test_covered_window_needs_no_fetch(hass: HomeAssistant):
+    """A window inside loaded intervals is served without the recorder."""
+    recorder = FakeRecorder({"sensor.a": _hourly("sensor.a", 48)})
+    cache = SegmentCache()
+    get_instance, utcnow = _patch(recorder)
+    with get_instance, utcnow:
+        await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(24))
+        assert cache.covers(["sensor.a"], _at(2), _at(20))
+        states = await cache.async_get_states(hass, ["sensor.a"], _at(2), _at(20))
+
+    assert len(recorder.calls) == 1
+    assert [s.state for s in states["sensor.a"]] == [str(h) for h in range(2, 20)]
+
+
+async def test_entities_with_same_gap_share_a_fetch(hass: HomeAssistant):
+    """Entities missing the same range are fetched in one call."""
+    recorder = FakeRecorder(
+        {"sensor.a": _hourly("sensor.a", 10), "sensor.b": _hourly("sensor.b", 10)}
+    )
+    cache = SegmentCache()
+    get_instance, utcnow = _patch(recorder)
+    with get_instance, utcnow:
+        await cache.async_get_states(hass, ["sensor.a", "sensor.b"], _at(0), _at(10))
+
+    assert len(recorder.calls) == 1
+    assert recorder.calls[0][2] == ["sensor.a", "sensor.b"]
+
+
+async def test_unsettled_tail_is_refetched(hass: HomeAssistant):
+    """History too recent to be committed is returned but not cached."""
+    recorder = FakeRecorder({"sensor.a": _hourly("sensor.a", 10)})
+    cache = SegmentCache()
+    get_instance, utcnow = _patch(recorder, now=_at(8))
+    with get_instance, utcnow:
+        states = await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(10))
+        assert not cache.covers(["sensor.a"], _at(0), _at(10))
+        await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(10))
+
+    assert [s.state for s in states["sensor.a"]] == [str(h) for h in range(10)]
+    assert recorder.calls[1][0] == _at(8) - timedelta(seconds=30)
+
+
+async def test_held_unsettled_tail_is_fetched_once(hass: HomeAssistant):
+    """While held, the unsettled tail is cached; it is dropped on release."""
+    recorder = FakeRecorder({"sensor.a": _hourly("sensor.a", 10)})
+    cache = SegmentCache()
+    get_instance, utcnow = _patch(recorder, now=_at(8))
+    with get_instance, utcnow:
+        with cache.hold_unsettled():
+            await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(10))
+            states = await cache.async_get_states(hass, ["sensor.a"], _at(4), _at(10))
+            assert len(recorder.calls) == 1
+        assert not cache.covers(["sensor.a"], _at(0), _at(10))
+        await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(10))
+
+    assert [s.state for s in states["sensor.a"]] == [str(h) for h in range(4, 10)]
+    settled = _at(8) - timedelta(seconds=30)
+    assert recorder.calls[1][:2] == (settled, _at(10))
+    assert cache.state_count == 8
+
+
+async def test_eviction_by_state_count(hass: HomeAssistant):
+    """The least recently used entity is evicted when over the state budget."""
+    recorder = FakeRecorder(
+        {"sensor.a": _hourly("sensor.a", 10), "sensor.b": _hourly("sensor.b", 10)}
+    )
+    cache = SegmentCache(max_states=15)
+    get_instance, utcnow = _patch(recorder)
+    with get_instance, utcnow:
+        await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(10))
+        await cache.async_get_states(hass, ["sensor.b"], _at(0), _at(10))
+
+    assert cache.state_count == 10
+    assert not cache.covers(["sensor.a"], _at(0), _at(10))
+    assert cache.covers(["sensor.b"], _at(0), _at(10))
+
+
+async def test_eviction_during_a_fetch(hass: HomeAssistant):
+    """An entity evicted by a concurrent call is still returned in full."""
+    recorder = FakeRecorder(
+        {"sensor.a": _hourly("sensor.a", 24), "sensor.b": _hourly("sensor.b", 24)}
+    )
+    cache = SegmentCache(max_states=30)
+    get_instance, utcnow = _patch(recorder)
+    with get_instance, utcnow:
+        # Two gaps, so sensor.a is still fetching when sensor.b evicts it.
+        await cache.async_get_states(hass, ["sensor.a"], _at(10), _at(14))
+        first, _second = await asyncio.gather(
+            cache.async_get_states(hass, ["sensor.a"], _at(0), _at(24)),
+            cache.async_get_states(hass, ["sensor.b"], _at(0), _at(24)),
+        )
+
+    assert [s.state for s in first["sensor.a"]] == [str(h) for h in range(24)]
+    assert cache.state_count <= 30
+
+
+async def test_concurrent_overlapping_fetches_cache_states_once(hass: HomeAssistant):
+    """Two searches fetching the same gap at once do not duplicate states."""
+    recorder = FakeRecorder({"sensor.a": _hourly("sensor.a", 48)})
+    cache = SegmentCache()
+    get_instance, utcnow = _patch(recorder)
+    with get_instance, utcnow:
+        await asyncio.gather(
+            cache.async_get_states(hass, ["sensor.a"], _at(0), _at(24)),
+            cache.async_get_states(hass, ["sensor.a"], _at(12), _at(36)),
+        )
+        states = await cache.async_get_states(hass, ["sensor.a"], _at(0), _at(36))
+
+    assert len(recorder.calls) == 2
+    assert [s.state for s in states["sensor.a"]] == [str(h) for h in range(36)]
+    assert cache.state_count == 36
+
+
+async def test_extending_backwards_drops_the_old_start_state(hass: HomeAssistant):
+    """The start state of an earlier fetch does not become a change."""
+    recorder = FakeRecorder(
+        {
+            "binary_sensor.door": [
+                State("binary_sensor.door", "on", last_changed=_at(0)),
+                State("binary_sensor.door", "off", last_changed=_at(20)),
+            ]
+        }
+    )
+    cache = SegmentCache()
+    get_instance, utcnow = _patch(recorder)
+    with get_instance, utcnow:
+        await cache.async_get_states(hass, ["binary_sensor.door"], _at(10), _at(30))
+        states = await cache.async_get_states(
+            hass, ["binary_sensor.door"], _at(5), _at(30)
+        )
+
+    assert [(s.state, s.last_changed) for s in states["binary_sensor.door"]] == [
+        ("on", _at(5)),
+        ("off", _at(20)),
+    ]
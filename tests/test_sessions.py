@@ -0,0 +1,65 @@
+"""Tests for the conversational sessions."""
+
+from unittest.mock import patch
+
+from custom_components.rag_search.prompt import QUERY_PREFIX
+from custom_components.rag_search.sessions import SYSTEM_PROMPT, SessionStore
+
+LINES = ["sensor.a was 1 at 10:00", "sensor.a was 2 at 11:00"]
+
+
+def test_follow_up_extends_the_prompt_with_new_lines_only():
+    """A turn repeats the earlier messages and adds only unseen lines."""
+    session = SessionStore().start("chat")
+    messages, packed = session.prompt(LINES, [0.0, 0.0], "First?", 1000)
+    assert [m["role"] for m in messages] == ["system", "user"]
+    assert messages[0]["content"] == SYSTEM_PROMPT
+    assert packed == LINES
+    session.add_turn(messages, packed, "One")
+
+    lines = [*LINES, "sensor.a was 3 at 12:00"]
+    follow_up, packed = session.prompt(lines, [0.0] * 3, "And then?", 1000)
+    assert follow_up[:3] == [*messages, {"role": "assistant", "content": "One"}]
+    assert follow_up[3]["content"] == "sensor.a was 3 at 12:00" + QUERY_PREFIX + (
+        "And then?"
+    )
+    assert packed == ["sensor.a was 3 at 12:00"]
+
+
+def test_full_session_refuses_follow_up():
+    """A follow-up whose new lines do not all fit is refused."""
+    session = SessionStore().start("chat")
+    messages, packed = session.prompt(LINES, [0.0, 0.0], "First?", 1000)
+    session.add_turn(messages, packed, "One")
+    budget = session.tokens + 30
+    assert session.prompt(LINES, [0.0, 0.0], "Short?", budget) is not None
+    assert session.prompt(["x " * 40], [0.0], "Short?", budget) is None
+
+
+def test_sessions_expire_and_are_bounded():
+    """Idle sessions expire; the least recently used is dropped first."""
+    with patch("custom_components.rag_search.sessions.time.monotonic") as now:
+        now.return_value = 1000
+        store = SessionStore(idle_timeout=60, max_sessions=2)
+        store.start("a")
+        store.start("b")
+        assert store.get("a") is not None
+        store.start("c")
+        assert store.get("b") is None
+        assert len(store) == 2
+
+        now.return_value = 1061
+        assert store.get("a") is None
+        assert len(store) == 0
+
+
+async def test_session_locks_are_not_kept():
+    """A lock is shared while a turn holds it and forgotten afterwards."""
+    store = SessionStore()
+    async with store.lock("chat"):
+        assert store.lock("chat") is store.lock("chat")
+        assert store.lock("chat").locked()
+    for session_id in ("chat", "other"):
+        async with store.lock(session_id):
+            pass
+    assert len(store._locks) == 0
@@ -0,0 +1,118 @@
+"""Test streaming chat completions against a local fake SSE server."""
+
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import HomeAssistant
+
+from custom_components.rag_search.backend import OpenAIBackend
+from custom_components.rag_search.const import (
+    EVENT_PARTIAL_RESULT,
+    RESULT_ENTITY,
+    STAGE_LLM_FIRST_BYTE,
+)
+from custom_components.rag_search.metrics import QueryTrace
+from custom_components.rag_search.search import _call_openai
+from custom_components.rag_search.stream import PartialPublisher
+
+CHUNKS = ["The ", "door ", "opened ", "twice."]
+
+
+def _sse(chunks: list[str]) -> bytes:
+    lines = [": keep-alive"]
+    lines.extend(
+        "data: " + json.dumps({"choices": [{"delta": {"content": chunk}}]})
+        for chunk in chunks
+    )
+    # The usage chunk OpenAI sends last with stream_options.include_usage.
+    usage = {"prompt_tokens": 5, "completion_tokens": len(chunks)}
+    lines.append("data: " + json.dumps({"choices": [], "usage": usage}))
+    lines.append("data: [DONE]")
+    return "".join(f"{line}\n\n" for line in lines).encode()
+
+
+@pytest.fixture
+async def sse_server(socket_enabled):
+    """Serve a fake streaming chat completions endpoint on localhost."""
+    requests: list[dict] = []
+
+    async def _completions(request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        requests.append(payload)
+        if not payload.get("stream"):
+            return web.json_response(
+                {"choices": [{"message": {"content": "".join(CHUNKS)}}]}
+            )
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for line in _sse(CHUNKS).split(b"\n\n"):
+            await response.write(line + b"\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", _completions)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    yield str(server.make_url("/v1")), requests
+    await server.close()
+
+
+async def test_call_openai_streams_deltas(hass: HomeAssistant, sse_server):
+    """Deltas are passed on as they arrive and joined into the answer."""
+    base_url, requests = sse_server
+    received: list[tuple[str, str]] = []
+    trace = QueryTrace()
+    async with aiohttp.ClientSession() as session:
+        answer = await _call_openai(
+            OpenAIBackend(session, "key", base_url),
+            "gpt-4o-mini",
+            "prompt",
+            on_delta=lambda delta, text: received.append((delta, text)),
+            trace=trace,
+        )
+
+    assert answer == "The door opened twice."
+    assert requests[0]["stream"] is True
+    assert [delta for delta, _text in received] == CHUNKS
+    assert received[-1][1] == "The door opened twice."
+    assert trace.usage == {"prompt_tokens": 5, "completion_tokens": len(CHUNKS)}
+    assert trace.retries == 0
+    assert STAGE_LLM_FIRST_BYTE in trace.stages
+
+
+async def test_call_openai_without_stream(hass: HomeAssistant, sse_server):
+    """Without a callback the request does not ask for a stream."""
+    base_url, requests = sse_server
+    async with aiohttp.ClientSession() as session:
+        answer = await _call_openai(
+            OpenAIBackend(session, "key", base_url), "gpt-4o-mini", "prompt"
+        )
+    assert answer == "The door opened twice."
+    assert "stream" not in requests[0]
+
+
+async def test_partial_publisher_throttles_state_writes(hass: HomeAssistant):
+    """Every chunk fires an event; the entity is written at most every N."""
+    events = []
+    hass.bus.async_listen(EVENT_PARTIAL_RESULT, events.append)
+    writes = []
+    hass.bus.async_listen(
+        EVENT_STATE_CHANGED, lambda event: writes.append(event.data["new_state"].state)
+    )
+    publisher = PartialPublisher(hass, RESULT_ENTITY, interval=3600, chunks=3)
+
+    text = ""
+    for index in range(7):
+        text += f"{index} "
+        publisher(f"{index} ", text)
+    await hass.async_block_till_done()
+
+    assert len(events) == 7
+    assert events[-1].data["answer"] == "0 1 2 3 4 5 6 "
+    # The first chunk is published at once, then every third.
+    assert writes == ["0 ", "0 1 2 3 ", "0 1 2 3 4 5 6 "]